@@ -1,25 +1,21 @@
 import streamlit as st
-import json
-import io
-import zipfile
-from openai import OpenAI
 import asyncio
 import atexit
 import time
-import re
-import os
 import logging
-from file_handlers import read_pdf, read_docx
-from text_processing import detect_language
-from hr_openai_utils import (
-    extract_hr_keywords,
-    categorize_hr_document,
-    extract_hr_entities,
-    summarize_hr_text,
-    extract_sentiment_keywords
-)
-from config import MAX_FILE_SIZE, OPENAI_MODEL, LOG_LEVEL, LOG_FILE
+from document_processor import process_file_async, clean_filename
+from config import MAX_FILE_SIZE, OPENAI_MODEL, LOG_LEVEL, LOG_FILE, MAX_CONCURRENT_FILES, JOB_POLL_INTERVAL
 from custom_exceptions import FileProcessingError, APIError
+from response_cache import get_response_cache
+from async_processors import get_async_client, run_async
+from utils import SpooledZipWriter
+from dedup import create_duplicate_index
+from manifest import get_manifest
+from metrics import get_metrics
+from token_budget import create_token_budget
+from local_tier import create_local_tier
+from jobs import get_job_manager, job_key
+from ingest import spool_upload, upload_digest
 
 # Setup logging
 logging.basicConfig(filename=LOG_FILE, level=getattr(logging, LOG_LEVEL),
@@ -36,24 +32,6 @@ def get_openai_api_key():
         return None
 
 
-def create_zip_file(all_results):
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'a', zipfile.ZIP_DEFLATED, False) as zip_file:
-        for original_filename, document_json in all_results.items():
-            try:
-                document_data = json.loads(document_json)
-                document_filename = f"{original_filename}.json"
-                document_content = json.dumps(document_data, ensure_ascii=False, indent=2)
-                zip_file.writestr(document_filename, document_content)
-            except json.JSONDecodeError:
-                logger.error(f"Invalid JSON for document {original_filename}")
-            except Exception as e:
-                logger.error(f"Error adding document {original_filename} to ZIP: {str(e)}")
-
-    zip_buffer.seek(0)
-    return zip_buffer
-
-
 def cleanup():
     logger.info("Performing cleanup operations...")
     # Add any necessary cleanup operations here
@@ -70,165 +48,210 @@ def format_time(seconds):
         return f"{seconds}s"
 
 
-def extract_url(text):
-    logger.info(f"Extracting URL from text: {text[:100].encode('unicode_escape').decode('utf-8')}")
-    text = text.lstrip('\ufeff')
-    url_pattern = r'^(https?://[^\s]+)[\s\S]*'
-    match = re.match(url_pattern, text)
-    if match:
-        url = match.group(1)
-        remaining_text = text[len(url):].strip()
-        logger.info(f"Extracted URL: {url}")
-        logger.info(f"Remaining text: {remaining_text[:100].encode('unicode_escape').decode('utf-8')}")
-        return url, remaining_text
-    logger.info("No URL found in text")
-    return None, text.strip()
-
-
-def clean_filename(filename):
-    name = os.path.splitext(filename)[0]
-    name = name.replace('docx', '').strip()
-    name = re.sub(r'[_-]', ' ', name)
-    return ' '.join(word.capitalize() for word in name.split())
-
-
-def process_file(file, client):
-    try:
-        if file.type == "text/plain":
-            text = file.read().decode("utf-8-sig")
-        elif file.type == "application/pdf":
-            text = read_pdf(file)
-        elif file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            text = read_docx(file)
-        else:
-            raise ValueError("Filtypen støttes ikke.")
-
-        logger.info(f"File content for {file.name}: {text[:100].encode('unicode_escape').decode('utf-8')}")
-        if not text.strip():
-            logger.warning(f"File {file.name} is empty or contains only whitespace.")
-            return None
-
-        logger.info(f"Calling structure_document for {file.name}")
-        return structure_document(text, client, file.name)
-    except Exception as e:
-        logger.error(f"Error processing file {file.name}: {str(e)}", exc_info=True)
-        return None
-
-
-def structure_document(text, client, filename):
-    lang = detect_language(text)
-    logger.info(f"Detected language for {filename}: {lang}")
-    if lang != 'no':
-        logger.warning(f"Document {filename} appears to be in {lang}, not Norwegian. Results may be inaccurate.")
-
-    logger.info(f"Original text (first 100 characters): {text[:100].encode('unicode_escape').decode('utf-8')}")
-    url, text = extract_url(text)
-    logger.info(f"Extracted URL for {filename}: {url}")
-    logger.info(f"Processed text (first 100 characters): {text[:100].encode('unicode_escape').decode('utf-8')}")
-
-    try:
-        title = clean_filename(filename)
-        keywords = extract_hr_keywords(text, client)
-        category = categorize_hr_document(text, client)
-        entities = extract_hr_entities(text, client)
-        sentiment_keywords = extract_sentiment_keywords(text, client)
-        logger.info(f"Sentiment keywords for {filename}: {sentiment_keywords}")
-        summary = summarize_hr_text(text, client, max_words=200)
-
-        document_data = {
-            "title": title,
-            "body": text.strip(),
-            "summary": summary,
-            "tags": keywords,
-            "url": url,
-            "category": category,
-            "entities": entities if isinstance(entities, dict) else {"raw": entities},
-            "positive": sentiment_keywords.get('positive', []) if isinstance(sentiment_keywords, dict) else [],
-            "negative": sentiment_keywords.get('negative', []) if isinstance(sentiment_keywords, dict) else []
-        }
-
-        logger.info(f"Document processed successfully: {filename}")
-        logger.info(f"Final document data for {filename}: {json.dumps(document_data, ensure_ascii=False, indent=2)}")
-        return json.dumps(document_data, ensure_ascii=False)
-    except Exception as e:
-        logger.error(f"Error processing document {filename}: {str(e)}", exc_info=True)
-        return None
-
-
-async def process_files(uploaded_files, api_key, progress_bar, status_text, file_overview, document_overview,
-                        time_estimate):
-    client = OpenAI(api_key=api_key)
-    all_results = {}
+async def process_files(uploaded_files, api_key, job):
+    client = get_async_client(api_key)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_FILES)
+    archive = SpooledZipWriter()
+    dedup_index = create_duplicate_index()
+    manifest = get_manifest()
+    budget = create_token_budget()
+    local_tier = create_local_tier()
+    tokens_before = get_metrics().snapshot()["tokens"]
+    file_status = {}
     document_titles = []
-    start_time = time.time()
     total_files = len(uploaded_files)
 
-    for i, uploaded_file in enumerate(uploaded_files):
-        try:
-            file_start_time = time.time()
-            status_text.text(f"Behandler fil {i + 1} av {total_files}: {uploaded_file.name}")
-            logger.info(f"Processing file {i + 1} of {total_files}: {uploaded_file.name}")
+    async def process_one(uploaded_file):
+        async with semaphore:
+            logger.info(f"Processing file {uploaded_file.name}")
 
             if uploaded_file.size > MAX_FILE_SIZE:
                 raise FileProcessingError(f"File {uploaded_file.name} exceeds maximum size limit.")
 
             logger.info(f"File size of {uploaded_file.name}: {uploaded_file.size} bytes")
+            if manifest is None:
+                return await process_file_async(uploaded_file, client, dedup_index=dedup_index, budget=budget,
+                                                 local_tier=local_tier, on_field=job.set_field)
+
+            digest = upload_digest(uploaded_file)
+            document_json = manifest.lookup(uploaded_file.name, digest)
+            if document_json is None:
+                fallbacks = []
+                document_json = await process_file_async(uploaded_file, client, dedup_index=dedup_index,
+                                                         budget=budget, local_tier=local_tier,
+                                                         on_field=job.set_field,
+                                                         on_fallback=lambda _, names: fallbacks.extend(names))
+                # A result with fields missing after API errors is kept out of the manifest, so it is redone.
+                if document_json and not fallbacks:
+                    await asyncio.to_thread(manifest.record, uploaded_file.name, digest, document_json)
+            return document_json
+
+    async def run(uploaded_file):
+        try:
+            return uploaded_file, await process_one(uploaded_file), None
+        except Exception as e:
+            return uploaded_file, None, e
 
-            document_json = process_file(uploaded_file, client)
-
-            if document_json:
-                all_results[uploaded_file.name] = document_json
-                logger.info(f"Added results for {uploaded_file.name}")
+    job.update(status_text=f"Behandler {total_files} filer ({MAX_CONCURRENT_FILES} samtidig)...")
+    tasks = [asyncio.create_task(run(uploaded_file)) for uploaded_file in uploaded_files]
+    # Cancelling this task closes the open OpenAI streams, so an aborted batch stops spending tokens.
+    loop, current = asyncio.get_running_loop(), asyncio.current_task()
+    cancel = lambda: loop.call_soon_threadsafe(current.cancel)
+    job.on_cancel(cancel)
 
+    try:
+        for files_processed, task in enumerate(asyncio.as_completed(tasks), start=1):
+            uploaded_file, document_json, error = await task
+            job.clear_fields(uploaded_file.name)
+            if error is not None:
+                logger.error(f"Error processing file {uploaded_file.name}: {str(error)}", exc_info=error)
+                job.notify("error", f"Feil ved behandling av {uploaded_file.name}: {str(error)}")
+                file_status[uploaded_file.name] = "Failed"
+            elif document_json:
                 try:
-                    document = json.loads(document_json)
-                    title = document.get('title', f"Document: {uploaded_file.name}")
+                    archive.write(uploaded_file.name, document_json)
+                    file_status[uploaded_file.name] = "Processed"
                     document_titles.append(f"{clean_filename(uploaded_file.name)}")
-                    logger.info(f"Processed document: {uploaded_file.name}: {title}")
-                except json.JSONDecodeError:
-                    logger.warning(f"Could not parse JSON for document: {clean_filename(uploaded_file.name)}")
-                    st.warning(f"Kunne ikke parse JSON for dokument: {clean_filename(uploaded_file.name)}")
-                    document_titles.append(f"{clean_filename(uploaded_file.name)} - [Parsing Error]")
+                    logger.info(f"Added results for {uploaded_file.name}")
                 except Exception as e:
-                    logger.error(f"Error processing document: {clean_filename(uploaded_file.name)}: {str(e)}",
-                                 exc_info=True)
-                    st.warning(f"Feil ved behandling av dokument: {clean_filename(uploaded_file.name)}: {str(e)}")
+                    logger.error(f"Error adding document {uploaded_file.name} to ZIP: {str(e)}", exc_info=True)
+                    job.notify("warning", f"Feil ved behandling av dokument: {clean_filename(uploaded_file.name)}: "
+                                          f"{str(e)}")
+                    file_status[uploaded_file.name] = "Failed"
                     document_titles.append(f"{clean_filename(uploaded_file.name)} - [Processing Error]")
             else:
                 logger.warning(f"No content was generated for {uploaded_file.name}")
+                file_status[uploaded_file.name] = "Failed"
                 document_titles.append(f"{clean_filename(uploaded_file.name)} - [Processing Failed]")
 
-            file_status = {name: "Processed" if doc else "Failed" for name, doc in all_results.items()}
-            file_overview.json(file_status)
-
-            document_overview.text("Behandlede dokumenter:\n" + "\n".join(document_titles))
-
-            await asyncio.sleep(0.1)
-
-            progress_bar.progress((i + 1) / total_files)
-
-            elapsed_time = time.time() - start_time
-            files_processed = i + 1
-            if files_processed > 1:
-                avg_time_per_file = elapsed_time / files_processed
-                remaining_files = total_files - files_processed
-                estimated_remaining_time = avg_time_per_file * remaining_files
-                time_estimate.text(f"Estimert gjenværende tid: {format_time(estimated_remaining_time)} "
-                                   f"({files_processed}/{total_files} filer behandlet)")
-            else:
-                time_estimate.text(f"Beregner estimert gjenværende tid... "
-                                   f"({files_processed}/{total_files} filer behandlet)")
-
-        except Exception as e:
-            logger.error(f"Error processing file {uploaded_file.name}: {str(e)}", exc_info=True)
-            st.error(f"Feil ved behandling av {uploaded_file.name}: {str(e)}")
-
-    status_text.text(f"Alle {total_files} filer er behandlet.")
-    progress_bar.empty()
-    time_estimate.empty()
+            job.update(status_text=f"Ferdig med fil {files_processed} av {total_files}: {uploaded_file.name}",
+                       processed=files_processed, file_status=dict(file_status),
+                       document_titles=list(document_titles))
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Documents that finished before the cancellation can still be downloaded.
+        job.keep_result(archive.close(), archive.count)
+        if manifest is not None:
+            job.notify("info", "Filer som ble ferdige før avbruddet er lagret og hentes fra tidligere "
+                               "resultater neste gang de behandles.")
+        raise
+    finally:
+        job.remove_cancel_callback(cancel)
+
+    job.update(status_text=f"Alle {total_files} filer er behandlet.")
+
+    logger.info(f"All files processed. Total results: {archive.count}")
+    cache = get_response_cache()
+    if cache is not None:
+        logger.info(f"Response cache stats: {cache.stats()}")
+    snapshot = get_metrics().snapshot()
+    logger.info(f"Metrics: {snapshot}")
+    tokens = {kind: count - tokens_before[kind] for kind, count in snapshot["tokens"].items()}
+    job.notify("caption", f"Tokenforbruk: {tokens['prompt']} prompt-tokens ({tokens['cached']} fra OpenAIs "
+                          f"prompt-cache), {tokens['completion']} svar-tokens.")
+    if budget is not None:
+        logger.info(f"Token budget stats: {budget.stats()}")
+        if budget.downgraded or budget.rejected:
+            job.notify("warning", f"Tokenbudsjettet på {budget.limit} tokens ble nådd: {budget.downgraded} "
+                                  f"dokument(er) fikk en forenklet analyse og {budget.rejected} ble ikke behandlet.")
+    if manifest is not None and manifest.skipped:
+        logger.info(f"Skipped {manifest.skipped} unchanged files")
+        job.notify("info", f"{manifest.skipped} fil(er) var uendret siden forrige kjøring og ble hentet fra "
+                           f"tidligere resultater.")
+    if local_tier is not None:
+        local_tier.save()
+        stats = local_tier.stats()
+        logger.info(f"Local tier stats: {stats}")
+        if stats["avoided_fraction"]:
+            job.notify("info", f"Den lokale modellen besvarte {stats['avoided_fraction']:.0%} av nøkkelord- og "
+                               f"kategorikallene uten OpenAI.")
+    if dedup_index is not None:
+        dedup_index.save()
+        logger.info(f"Duplicate detection stats: {dedup_index.stats()}")
+        if dedup_index.duplicates:
+            job.notify("info", f"{dedup_index.duplicates} dokument(er) var (nesten) like et annet dokument og "
+                               f"gjenbrukte analysen, som sparte {dedup_index.calls_saved} API-kall.")
+    return archive
+
+
+def render_job(job):
+    snapshot = job.snapshot()
+    st.progress(snapshot["processed"] / snapshot["total"] if snapshot["total"] else 1.0)
+    st.text(snapshot["status_text"] or "Venter på at behandlingen skal starte...")
+    if snapshot["file_status"]:
+        st.json(snapshot["file_status"])
+        st.text("Behandlede dokumenter:\n" + "\n".join(snapshot["document_titles"]))
+
+    if job.running:
+        render_partial(snapshot["partial"])
+        if snapshot["state"] == "cancelling":
+            st.text("Avbryter behandlingen...")
+        elif st.button("Avbryt behandling"):
+            job.cancel()
+        processed, total = snapshot["processed"], snapshot["total"]
+        if snapshot["started"] is not None and processed > 1:
+            remaining = (time.time() - snapshot["started"]) / processed * (total - processed)
+            st.text(f"Estimert gjenværende tid: {format_time(remaining)} ({processed}/{total} filer behandlet)")
+        elif snapshot["started"] is not None:
+            st.text(f"Beregner estimert gjenværende tid... ({processed}/{total} filer behandlet)")
+        return
+
+    for level, text in snapshot["messages"]:
+        getattr(st, level)(text)
+    if snapshot["state"] == "failed":
+        st.error(f"En feil oppstod under filbehandlingen: {snapshot['error']}")
+        return
+    if snapshot["state"] == "cancelled":
+        st.warning(f"Behandlingen ble avbrutt etter {snapshot['processed']} av {snapshot['total']} filer.")
+    if snapshot["count"] and snapshot["has_result"]:
+        st.success(f"Behandlet {snapshot['count']} dokument(er) vellykket.")
+        # The result lives in the job store, so the rerun caused by this button does not reprocess anything.
+        st.download_button(
+            label=f"Last ned alle resultater ({snapshot['count']} dokumenter) (ZIP)",
+            data=job.read_result(),
+            file_name="alle_dokumentresultater.zip",
+            mime="application/zip"
+        )
+    elif snapshot["state"] != "cancelled":
+        st.warning("Ingen dokumenter ble generert fra de opplastede filene.")
+
+
+def render_partial(partial):
+    # Fields arrive as each analysis finishes, and the summary grows while it is streamed.
+    for doc_id, fields in partial.items():
+        with st.expander(f"{doc_id} (under arbeid)", expanded=True):
+            if fields.get("category"):
+                st.text(f"Kategori: {fields['category']}")
+            if fields.get("keywords"):
+                st.text(f"Nøkkelord: {', '.join(fields['keywords'])}")
+            if fields.get("summary"):
+                st.write(fields["summary"])
+
+
+def start_job(uploaded_files, api_key):
+    # Spool the uploads to disk so the worker thread neither depends on widgets from an earlier rerun
+    # nor keeps every upload in memory while it works through them.
+    files = [spool_upload(uploaded_file) for uploaded_file in uploaded_files]
+    key = job_key(files, api_key)
+    manager = get_job_manager()
+    job = manager.get(key)
+    if job is not None and job.state not in ("failed", "cancelled"):
+        for file in files:
+            file.discard()
+        return job
+
+    def work(job):
+        try:
+            # On the shared loop the pooled client and its open connections carry over between jobs.
+            return run_async(process_files(files, api_key, job))
+        finally:
+            for file in files:
+                file.discard()
 
-    logger.info(f"All files processed. Total results: {len(all_results)}")
-    return all_results
+    logger.info(f"Starting processing of {len(files)} files")
+    return manager.submit(key, [file.name for file in files], work)
 
 
 async def main_async():
@@ -245,51 +268,14 @@ async def main_async():
             if not uploaded_files:
                 st.error("Vennligst last opp filer før du starter behandlingen.")
             else:
-                progress_placeholder = st.empty()
-                status_placeholder = st.empty()
-                file_overview_placeholder = st.empty()
-                document_overview_placeholder = st.empty()
-                time_estimate_placeholder = st.empty()
-
-                with st.spinner("Forbereder behandling..."):
-                    try:
-                        logger.info(f"Starting processing of {len(uploaded_files)} files")
-                        all_results = await process_files(
-                            uploaded_files,
-                            api_key,
-                            progress_placeholder,
-                            status_placeholder,
-                            file_overview_placeholder,
-                            document_overview_placeholder,
-                            time_estimate_placeholder
-                        )
-
-                        logger.info(f"Processing complete. Results: {all_results}")
-
-                        if all_results:
-                            st.success(f"Behandlet {len(all_results)} dokument(er) vellykket.")
-
-                            total_documents = len(all_results)
-                            logger.info(f"Total documents generated: {total_documents}")
-
-                            if total_documents > 0:
-                                zip_buffer = create_zip_file(all_results)
-                                st.download_button(
-                                    label=f"Last ned alle resultater ({total_documents} dokumenter) (ZIP)",
-                                    data=zip_buffer,
-                                    file_name="alle_dokumentresultater.zip",
-                                    mime="application/zip"
-                                )
-                                logger.info("ZIP file created and download button displayed")
-                            else:
-                                st.warning("Ingen dokumenter ble generert fra de opplastede filene.")
-                                logger.warning("No documents were generated from the uploaded files")
-                        else:
-                            st.warning("Ingen resultater ble generert fra de opplastede filene.")
-                            logger.warning("No results were generated from the uploaded files")
-                    except Exception as e:
-                        logger.error(f"Error during file processing: {str(e)}", exc_info=True)
-                        st.error(f"En feil oppstod under filbehandlingen: {str(e)}")
+                st.session_state["job_id"] = start_job(uploaded_files, api_key).id
+
+        job = get_job_manager().get(st.session_state.get("job_id"))
+        if job is not None:
+            render_job(job)
+            if job.running:
+                time.sleep(JOB_POLL_INTERVAL)
+                st.rerun()
     else:
         st.warning("Vennligst skriv inn din OpenAI API-nøkkel i sidepanelet for å bruke dokumentprosessoren.")
 
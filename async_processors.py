@@ -1,29 +1,87 @@
 import asyncio
-import aiohttp
-import aiofiles
-from openai import AsyncOpenAI
-
-async def read_file_async(file):
-    async with aiofiles.open(file.name, mode='rb') as f:
-        return await f.read()
-
-async def call_openai_api_async(client, messages, max_tokens):
-    async with client as aclient:
-        response = await aclient.chat.completions.create(
-            model="gpt-4o-2024-08-06",
-            messages=messages,
-            max_tokens=max_tokens
-        )
-    return response.choices[0].message.content.strip()
-
-async def process_file_async(file, client):
-    try:
-        content = await read_file_async(file)
-        # Process the content
-        # This is a placeholder - replace with your actual processing logic
-        result = await call_openai_api_async(client, [{"role": "user", "content": content[:500]}], 50)
-        return result
-    except Exception as e:
-        # Log the error and re-raise
-        raise
+import logging
+import threading
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from rate_limiter import on_response_async, rate_limiting_enabled
+from config import (HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS, HTTP_KEEPALIVE_EXPIRY, HTTP_CONNECT_TIMEOUT,
+                    HTTP_READ_TIMEOUT)
 
+logger = logging.getLogger(__name__)
+
+_loop = None
+_clients = None
+_lock = threading.Lock()
+
+
+def http_timeout():
+    return httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+
+def create_async_client(api_key, base_url=None):
+    limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                          max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                          keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
+    event_hooks = {}
+    rate_limited = rate_limiting_enabled()
+    if rate_limited:
+        event_hooks["response"] = [on_response_async]
+    http_client = DefaultAsyncHttpxClient(limits=limits, timeout=http_timeout(), event_hooks=event_hooks)
+    # With a rate limiter, retries are paced by the limiter instead of the SDK's own backoff.
+    return AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, timeout=http_timeout(),
+                       max_retries=0 if rate_limited else 2)
+
+
+def get_event_loop():
+    """Process-wide event loop on a daemon thread, so pooled clients and their connections outlive each job."""
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="openai-loop", daemon=True).start()
+        return _loop
+
+
+def run_async(coroutine):
+    # Blocks the calling thread until the coroutine has finished on the shared loop.
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result()
+
+
+class ClientManager:
+    """Keeps one pooled AsyncOpenAI client per API key and base URL for each event loop."""
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, api_key, base_url=None):
+        # httpx connection pools belong to the loop they were created on, so a client is only
+        # reused on the same loop; on the shared loop that means across every job and session.
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._clients.get((api_key, base_url))
+            if entry is not None and entry[0] is loop and not entry[1].is_closed():
+                return entry[1]
+            client = create_async_client(api_key, base_url)
+            self._clients[(api_key, base_url)] = (loop, client)
+            logger.info(f"Created pooled OpenAI client for {base_url or 'api.openai.com'}")
+            return client
+
+    async def close(self):
+        with self._lock:
+            clients = [client for loop, client in self._clients.values() if loop is asyncio.get_running_loop()]
+            self._clients = {key: entry for key, entry in self._clients.items() if entry[1] not in clients}
+        for client in clients:
+            await client.close()
+
+
+def get_client_manager():
+    global _clients
+    with _lock:
+        if _clients is None:
+            _clients = ClientManager()
+        return _clients
+
+
+def get_async_client(api_key, base_url=None):
+    return get_client_manager().get(api_key, base_url)
@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+import time
+from document_processor import ANALYSIS_FALLBACKS, prepare_text, build_document
+from hr_openai_utils import build_hr_analysis_requests, parse_hr_analysis_result
+from custom_exceptions import APIError
+from config import BATCH_POLL_INTERVAL, BATCH_MAX_REQUESTS, BATCH_MAX_FILE_BYTES
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_BATCH_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BulkJob:
+    """Bulk run of the HR analyses through the OpenAI Batch API that resumes from its work_dir."""
+
+    def __init__(self, work_dir):
+        self.work_dir = work_dir
+        self.state_path = os.path.join(work_dir, "state.json")
+        self.texts_dir = os.path.join(work_dir, "texts")
+        os.makedirs(self.texts_dir, exist_ok=True)
+        self.state = self._load_state()
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding="utf-8") as f:
+                return json.load(f)
+        return {"status": "new", "documents": {}, "batches": []}
+
+    def _save_state(self):
+        # Written atomically after every step, so a restart never sees a half-written state.
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    @property
+    def status(self):
+        return self.state["status"]
+
+    def _new_batch(self, model):
+        index = len(self.state["batches"])
+        batch = {"model": model, "requests_path": os.path.join(self.work_dir, f"requests-{index}.jsonl"),
+                 "output_path": os.path.join(self.work_dir, f"output-{index}.jsonl"), "requests": 0, "bytes": 0}
+        self.state["batches"].append(batch)
+        return batch, open(batch["requests_path"], "w", encoding="utf-8")
+
+    def prepare(self, documents):
+        if self.status != "new":
+            logger.info(f"Bulk job in {self.work_dir} is already prepared, skipping")
+            return
+
+        # The Batch API takes one model and at most BATCH_MAX_REQUESTS requests and BATCH_MAX_FILE_BYTES
+        # per input file, so each model gets its own batches.
+        open_batches = {}
+        try:
+            for i, (filename, text) in enumerate(documents):
+                doc_id = f"doc-{i:05d}"
+                url, text = prepare_text(text, filename)
+                with open(os.path.join(self.texts_dir, f"{doc_id}.txt"), "w", encoding="utf-8") as f:
+                    f.write(text)
+                self.state["documents"][doc_id] = {"filename": filename, "url": url}
+
+                for task, body in build_hr_analysis_requests(text).items():
+                    request = {"custom_id": f"{doc_id}:{task}", "method": "POST",
+                               "url": "/v1/chat/completions", "body": body}
+                    line = json.dumps(request, ensure_ascii=False) + "\n"
+                    size = len(line.encode("utf-8"))
+                    batch, requests_file = open_batches.get(body["model"]) or (None, None)
+                    if batch is None or batch["requests"] >= BATCH_MAX_REQUESTS \
+                            or batch["bytes"] + size > BATCH_MAX_FILE_BYTES:
+                        if requests_file is not None:
+                            requests_file.close()
+                        batch, requests_file = open_batches[body["model"]] = self._new_batch(body["model"])
+                    requests_file.write(line)
+                    batch["requests"] += 1
+                    batch["bytes"] += size
+        finally:
+            for _, requests_file in open_batches.values():
+                requests_file.close()
+
+        self.state["status"] = "prepared"
+        self._save_state()
+        logger.info(f"Prepared {len(self.state['documents'])} documents for bulk processing "
+                    f"in {len(self.state['batches'])} batches")
+
+    def submit(self, client):
+        for batch in self.state["batches"]:
+            if batch.get("batch_id"):
+                logger.info(f"Batch {batch['batch_id']} already submitted")
+                continue
+
+            if not batch.get("input_file_id"):
+                with open(batch["requests_path"], "rb") as f:
+                    batch["input_file_id"] = client.files.create(file=f, purpose="batch").id
+                self._save_state()
+
+            batch["batch_id"] = client.batches.create(input_file_id=batch["input_file_id"],
+                                                      endpoint="/v1/chat/completions", completion_window="24h").id
+            self._save_state()
+            logger.info(f"Submitted batch {batch['batch_id']}")
+
+        if self.status == "prepared":
+            self.state["status"] = "submitted"
+            self._save_state()
+
+    def poll(self, client, interval=BATCH_POLL_INTERVAL, timeout=None):
+        if self.status in ("completed", "collected"):
+            return
+
+        start_time = time.time()
+        while True:
+            pending = {}
+            for batch in self.state["batches"]:
+                if batch.get("output_file_id"):
+                    continue
+                retrieved = client.batches.retrieve(batch["batch_id"])
+                logger.info(f"Batch {retrieved.id} status: {retrieved.status}")
+                if retrieved.status not in TERMINAL_BATCH_STATUSES:
+                    pending[retrieved.id] = retrieved
+                elif retrieved.status != "completed" or not retrieved.output_file_id:
+                    self.state["status"] = retrieved.status
+                    self._save_state()
+                    raise APIError(f"Batch {retrieved.id} ended with status {retrieved.status}")
+                else:
+                    batch["output_file_id"] = retrieved.output_file_id
+                    self._save_state()
+            if not pending:
+                break
+            if timeout is not None and time.time() - start_time > timeout:
+                raise TimeoutError(f"Batches {', '.join(pending)} did not finish within {timeout} seconds")
+            time.sleep(interval)
+
+        self.state["status"] = "completed"
+        self._save_state()
+
+    def _download_output(self, client):
+        for batch in self.state["batches"]:
+            if not os.path.exists(batch["output_path"]):
+                content = client.files.content(batch["output_file_id"]).text
+                tmp_path = f"{batch['output_path']}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(content)
+                os.replace(tmp_path, batch["output_path"])
+
+    def _read_results(self):
+        results = {}
+        for batch in self.state["batches"]:
+            self._read_output(batch["output_path"], results)
+        return results
+
+    def _read_output(self, path, results):
+        # A document's requests can end up in different batches, so results are merged per document.
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                doc_id, task = item["custom_id"].split(":", 1)
+                response = item.get("response") or {}
+                if item.get("error") or response.get("status_code") != 200:
+                    logger.error(f"Batch request {item['custom_id']} failed: {item.get('error') or response}")
+                    continue
+                try:
+                    content = response["body"]["choices"][0]["message"]["content"]
+                    results.setdefault(doc_id, {})[task] = parse_hr_analysis_result(task, content)
+                except Exception as e:
+                    logger.error(f"Could not parse batch result {item['custom_id']}: {str(e)}")
+
+    def collect(self, client, output_dir):
+        self._download_output(client)
+        os.makedirs(output_dir, exist_ok=True)
+
+        documents = {}
+        failed = 0
+        results = self._read_results()
+        for doc_id, document in self.state["documents"].items():
+            with open(os.path.join(self.texts_dir, f"{doc_id}.txt"), encoding="utf-8") as f:
+                text = f.read()
+            fields = {task: results.get(doc_id, {}).get(task, fallback)
+                      for task, fallback in ANALYSIS_FALLBACKS.items()}
+            # Still written with fallbacks, but counted as failed because an analysis is missing.
+            if not set(ANALYSIS_FALLBACKS) <= set(results.get(doc_id, {})):
+                failed += 1
+            document_json = build_document(document["filename"], text, document["url"], **fields)
+            path = os.path.join(output_dir, f"{document['filename']}.json")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(document_json)
+            documents[document["filename"]] = document_json
+
+        self.state["failed"] = failed
+        self.state["status"] = "collected"
+        self._save_state()
+        logger.info(f"Collected {len(documents)} documents from {len(self.state['batches'])} batches, "
+                    f"{failed} with missing analyses")
+        return documents
+
+    def run(self, client, documents, output_dir, interval=BATCH_POLL_INTERVAL, timeout=None):
+        self.prepare(documents)
+        self.submit(client)
+        self.poll(client, interval=interval, timeout=timeout)
+        return self.collect(client, output_dir)
@@ -0,0 +1,59 @@
+import random
+from pipeline import InMemoryFile
+from tests.document_factory import make_docx, make_pdf
+
+SIZES = {"small": 2_000, "medium": 20_000, "large": 200_000}
+MIME_TYPES = {
+    "txt": "text/plain",
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+
+_SUBJECTS = ["Arbeidstaker", "Den ansatte", "Lederen", "Arbeidsgiver", "Medarbeideren", "Tillitsvalgt",
+             "HR-avdelingen", "Verneombudet", "Nyansatte", "Deltidsansatte"]
+_VERBS = ["har rett til", "skal avtale", "må dokumentere", "kan søke om", "skal melde fra om",
+          "har ansvar for", "får tilbud om", "skal gjennomføre", "må godkjenne", "kan be om"]
+_OBJECTS = ["ferie", "foreldrepermisjon", "lønnsjustering", "overtidsbetaling", "medarbeidersamtale",
+            "sykefravær", "kompetanseutvikling", "hjemmekontor", "reiseregning", "oppsigelse",
+            "varsling av kritikkverdige forhold", "arbeidstid", "pensjonsordning", "velferdspermisjon"]
+_QUALIFIERS = ["i henhold til arbeidsmiljøloven", "etter avtale med nærmeste leder", "innen utgangen av måneden",
+               "i samsvar med tariffavtalen", "så snart som mulig", "via HR-portalen", "minst to uker i forveien",
+               "i forbindelse med årsoppgjøret", "når behovet oppstår", "etter gjeldende retningslinjer"]
+_HEADINGS = ["Formål", "Omfang", "Ansvar", "Rutine", "Permisjon", "Lønn og godtgjørelse", "Arbeidstid",
+             "Oppfølging", "Avvik", "Ikrafttredelse"]
+
+
+def make_paragraphs(rng, target_chars):
+    paragraphs = []
+    size = 0
+    while size < target_chars:
+        sentences = [f"{rng.choice(_SUBJECTS)} {rng.choice(_VERBS)} {rng.choice(_OBJECTS)} "
+                     f"{rng.choice(_QUALIFIERS)}." for _ in range(rng.randint(3, 7))]
+        paragraph = f"{rng.choice(_HEADINGS)} {len(paragraphs) + 1}. " + " ".join(sentences)
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 2
+    return paragraphs
+
+
+def _encode(fmt, paragraphs):
+    if fmt == "txt":
+        return "\n\n".join(paragraphs).encode("utf-8")
+    if fmt == "docx":
+        return make_docx(paragraphs)
+    # Roughly one A4 page of text per PDF page.
+    pages, page = [], []
+    for paragraph in paragraphs:
+        page.extend(paragraph[i:i + 90] for i in range(0, len(paragraph), 90))
+        if len(page) >= 50:
+            pages.append("\n".join(page))
+            page = []
+    if page:
+        pages.append("\n".join(page))
+    return make_pdf(pages)
+
+
+def make_corpus(fmt, size, count, seed=0):
+    rng = random.Random(f"{fmt}-{size}-{seed}")
+    return [InMemoryFile(_encode(fmt, make_paragraphs(rng, SIZES[size])), f"retningslinje_{i:04d}.{fmt}",
+                         MIME_TYPES[fmt])
+            for i in range(count)]
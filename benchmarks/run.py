@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from unittest.mock import patch
+from openai import OpenAI, DefaultHttpxClient
+from benchmarks.corpus import SIZES, MIME_TYPES, make_corpus
+from tests.fake_openai_server import FakeOpenAIServer
+from jobs import Job
+from metrics import get_metrics
+from config import RATE_LIMIT_RPM, RATE_LIMIT_TPM
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+TARGETS = ("process_files", "structure_document")
+REGRESSION_TOLERANCE = 0.10
+
+
+def fake_reply(body):
+    prompt = body["messages"][-1]["content"]
+    if body.get("response_format"):
+        return json.dumps({"keywords": ["ferie", "permisjon", "lønn", "arbeidstid", "oppsigelse"],
+                           "category": "Personaladministrasjon",
+                           "entities": {"ansatte": [], "avdelinger": ["HR"], "stillinger": ["leder"],
+                                        "kompetanser": []},
+                           "positive": ["rett til"], "negative": ["avvik"],
+                           "summary": "Retningslinjen beskriver rettigheter og plikter for ansatte."})
+    if prompt.startswith("Trekk ut 5"):
+        return "ferie, permisjon, lønn, arbeidstid, oppsigelse"
+    if prompt.startswith("Kategoriser"):
+        return "Personaladministrasjon"
+    if prompt.startswith("Trekk ut relevante HR-enheter"):
+        return '{"ansatte": [], "avdelinger": ["HR"], "stillinger": ["leder"], "kompetanser": []}'
+    if "'positive' og 'negative'" in prompt:
+        return '{"positive": ["rett til"], "negative": ["avvik"]}'
+    return "Retningslinjen beskriver rettigheter og plikter for ansatte."
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _isolate(rpm, tpm):
+    # Every scenario measures uncached work with fresh client-side rate limiters.
+    import dedup
+    import local_tier
+    import manifest
+    import rate_limiter
+    import response_cache
+    response_cache.CACHE_ENABLED = False
+    manifest.MANIFEST_ENABLED = False
+    dedup.DEDUP_ENABLED = False
+    local_tier.LOCAL_TIER_ENABLED = False
+    rate_limiter.RATE_LIMIT_RPM, rate_limiter.RATE_LIMIT_TPM = rpm, tpm
+    rate_limiter._limiters = {}
+
+
+def _run_process_files(files, server):
+    import app
+
+    latencies = []
+    original = app.process_file_async
+
+    async def timed_process_file_async(file, client, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await original(file, client, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    os.environ["OPENAI_BASE_URL"] = server.url
+    with patch('app.process_file_async', side_effect=timed_process_file_async):
+        archive = asyncio.run(app.process_files(files, "benchmark", Job("benchmark", [file.name for file in files])))
+    return latencies, archive.count
+
+
+def _run_structure_document(files, server):
+    import rate_limiter
+    from document_processor import read_file_text, structure_document
+
+    http_client = DefaultHttpxClient(event_hooks={"response": [rate_limiter.on_response]})
+    client = OpenAI(api_key="benchmark", base_url=server.url, max_retries=0, http_client=http_client)
+    latencies = []
+    succeeded = 0
+    for file in files:
+        start = time.perf_counter()
+        text = read_file_text(file)
+        if structure_document(text, client, file.name):
+            succeeded += 1
+        latencies.append(time.perf_counter() - start)
+    return latencies, succeeded
+
+
+def run_scenario(scenario):
+    logging.basicConfig(level=logging.CRITICAL)
+    _isolate(scenario["rpm"], scenario["tpm"])
+    files = make_corpus(scenario["format"], scenario["size"], scenario["docs"], seed=scenario["seed"])
+    runner = _run_process_files if scenario["target"] == "process_files" else _run_structure_document
+
+    with FakeOpenAIServer(reply=fake_reply, latency=0) as server:
+        # The first API call pays one-off costs (client setup, response model construction) that
+        # would otherwise land on whichever document happens to go first.
+        runner(make_corpus(scenario["format"], "small", 1, seed=-1), server)
+
+    _isolate(scenario["rpm"], scenario["tpm"])
+    tokens_before = get_metrics().snapshot()["tokens"]
+    with FakeOpenAIServer(reply=fake_reply, latency=scenario["latency"], rate_limit_rate=scenario["rate_limit_rate"],
+                          seed=scenario["seed"], connect_latency=scenario["connect_latency"]) as server:
+        start = time.perf_counter()
+        latencies, succeeded = runner(files, server)
+        elapsed = time.perf_counter() - start
+    tokens = {kind: count - tokens_before[kind] for kind, count in get_metrics().snapshot()["tokens"].items()}
+
+    return {
+        "docs": len(files),
+        "succeeded": succeeded,
+        "elapsed": elapsed,
+        "docs_per_sec": len(files) / elapsed if elapsed else 0.0,
+        "p50_latency": percentile(latencies, 0.50),
+        "p95_latency": percentile(latencies, 0.95),
+        # ru_maxrss is in kilobytes on Linux; each scenario runs in its own process.
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "requests": server.request_count,
+        "rate_limited": server.rate_limited,
+        "prompt_tokens": tokens["prompt"],
+        "cached_tokens": tokens["cached"],
+    }
+
+
+def scenario_name(scenario):
+    return f"{scenario['target']}/{scenario['format']}/{scenario['size']}"
+
+
+def build_scenarios(args):
+    return [{"target": target, "format": fmt, "size": size, "docs": args.docs, "latency": args.latency,
+             "connect_latency": args.connect_latency, "rate_limit_rate": args.rate_limit_rate, "rpm": args.rpm, "tpm": args.tpm, "seed": args.seed}
+            for target in args.targets for fmt in args.formats for size in args.sizes]
+
+
+def run_all(scenarios):
+    results = {}
+    for scenario in scenarios:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            results[scenario_name(scenario)] = executor.submit(run_scenario, scenario).result()
+    return results
+
+
+def compare(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            continue
+        if result["docs_per_sec"] < before["docs_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: {before['docs_per_sec']:.2f} -> {result['docs_per_sec']:.2f} docs/s")
+        if result["p95_latency"] > before["p95_latency"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_latency']:.3f}s -> {result['p95_latency']:.3f}s")
+        if result["requests"] > before["requests"]:
+            regressions.append(f"{name}: {before['requests']} -> {result['requests']} requests")
+    return regressions
+
+
+def format_report(results):
+    lines = [f"{'scenario':<40} {'docs/s':>8} {'p50 s':>8} {'p95 s':>8} {'RSS MB':>8} {'requests':>9} {'429s':>5} "
+             f"{'cached':>7}"]
+    for name, result in results.items():
+        cached_share = result["cached_tokens"] / result["prompt_tokens"] if result.get("prompt_tokens") else 0
+        lines.append(f"{name:<40} {result['docs_per_sec']:>8.2f} {result['p50_latency']:>8.3f} "
+                     f"{result['p95_latency']:>8.3f} {result['peak_rss_mb']:>8.1f} {result['requests']:>9} "
+                     f"{result['rate_limited']:>5} {cached_share:>7.0%}")
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end benchmarks against a local fake OpenAI server.")
+    parser.add_argument("--targets", nargs="+", choices=TARGETS, default=list(TARGETS))
+    parser.add_argument("--formats", nargs="+", choices=sorted(MIME_TYPES), default=sorted(MIME_TYPES))
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=["small", "medium"])
+    parser.add_argument("--docs", type=int, default=20, help="Documents per scenario")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake API latency per request in seconds")
+    parser.add_argument("--connect-latency", type=float, default=0.05,
+                        help="Fake TCP/TLS handshake time per new connection in seconds")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    # The client-side budget is effectively off by default so the numbers measure this code rather than
+    # the account limits; pass --rpm/--tpm (e.g. the values from config.py) to include its pacing.
+    parser.add_argument("--rpm", type=int, default=1_000_000, help=f"Client-side request budget (config: {RATE_LIMIT_RPM})")
+    parser.add_argument("--tpm", type=int, default=1_000_000_000, help=f"Client-side token budget (config: {RATE_LIMIT_TPM})")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", metavar="NAME", help="Store the results as a named baseline")
+    parser.add_argument("--compare", metavar="NAME", help="Compare the results with a stored baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = build_scenarios(args)
+    results = run_all(scenarios)
+    print(format_report(results))
+
+    settings = {key: value for key, value in vars(args).items() if key not in ("save_baseline", "compare")}
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(os.path.join(BASELINE_DIR, f"{args.save_baseline}.json"), "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "results": results}, f, indent=2)
+
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json"), encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["settings"] != settings:
+            print(f"Warning: baseline {args.compare} was recorded with different settings: {baseline['settings']}")
+        regressions = compare(results, baseline)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
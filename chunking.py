@@ -0,0 +1,69 @@
+import functools
+import tiktoken
+from text_processing import norwegian_tokenize, is_complete_sentence
+from config import OPENAI_MODEL, CHUNK_MAX_TOKENS, DOCUMENT_TOKEN_BUDGET
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model=OPENAI_MODEL):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text, model=OPENAI_MODEL):
+    return len(get_encoding(model).encode(text))
+
+
+def iter_sentences(text):
+    # norwegian_tokenize also breaks on line breaks, so fragments are joined until they end a sentence.
+    pending = []
+    for part in norwegian_tokenize(text):
+        part = part.strip()
+        if not part:
+            continue
+        pending.append(part)
+        if is_complete_sentence(part):
+            yield " ".join(pending)
+            pending = []
+    if pending:
+        yield " ".join(pending)
+
+
+def _split_long_sentence(tokens, max_tokens, encoding):
+    for start in range(0, len(tokens), max_tokens):
+        yield encoding.decode(tokens[start:start + max_tokens]), min(max_tokens, len(tokens) - start)
+
+
+def chunk_text(text, max_tokens=CHUNK_MAX_TOKENS, token_budget=DOCUMENT_TOKEN_BUDGET, model=OPENAI_MODEL):
+    encoding = get_encoding(model)
+    chunks = []
+    current = []
+    current_tokens = 0
+    used_tokens = 0
+
+    def flush():
+        nonlocal current, current_tokens
+        if current:
+            chunks.append(" ".join(current))
+        current = []
+        current_tokens = 0
+
+    for sentence in iter_sentences(text):
+        tokens = encoding.encode(sentence)
+        pieces = [(sentence, len(tokens))] if len(tokens) <= max_tokens else \
+            _split_long_sentence(tokens, max_tokens, encoding)
+
+        for piece, piece_tokens in pieces:
+            if token_budget is not None and used_tokens + piece_tokens > token_budget:
+                flush()
+                return chunks
+            if current_tokens + piece_tokens > max_tokens:
+                flush()
+            current.append(piece)
+            current_tokens += piece_tokens
+            used_tokens += piece_tokens
+
+    flush()
+    return chunks
@@ -0,0 +1,212 @@
+import argparse
+import asyncio
+import glob
+import logging
+import os
+import re
+import sys
+import time
+from openai import OpenAI
+from async_processors import create_async_client
+from batch_processor import BulkJob
+from document_processor import read_file_text
+from file_handlers import LocalFile, MIME_TYPES
+from pipeline import Pipeline
+from dedup import create_duplicate_index
+from manifest import get_manifest
+from metrics import get_metrics
+from token_budget import create_token_budget
+from local_tier import create_local_tier
+from peach import create_peach_writer, export_results
+from utils import MultiWriter, ResultWriter
+from config import MAX_CONCURRENT_FILES, MAX_FILE_SIZE, LOG_LEVEL, PIPELINE_PARSE_WORKERS, PEACH_URL
+
+logger = logging.getLogger(__name__)
+
+
+def collect_paths(inputs):
+    paths = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            for root, _, filenames in os.walk(pattern):
+                paths.update(os.path.join(root, filename) for filename in filenames)
+        else:
+            paths.update(glob.glob(pattern, recursive=True))
+    return sorted(path for path in paths
+                  if os.path.isfile(path) and os.path.splitext(path)[1].lower() in MIME_TYPES)
+
+
+def input_root(inputs):
+    """Common directory of the inputs, which document names are relative to."""
+    roots = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            roots.append(pattern)
+            continue
+        # A glob's root is the directory part before its first wildcard.
+        wildcard = re.search(r"[*?[]", pattern)
+        roots.append(os.path.dirname(pattern[:wildcard.start()] if wildcard else pattern))
+    return os.path.commonpath([os.path.abspath(root or ".") for root in roots])
+
+
+def document_name(path, root=None):
+    # Relative to the input root, so equal file names in different folders get their own result and manifest entry.
+    if root is None:
+        return os.path.basename(path)
+    return os.path.relpath(os.path.abspath(path), root).replace(os.sep, "/")
+
+
+def shard_paths(paths, shard_index, shard_count):
+    # Paths are sorted, so every worker computes the same split without coordinating.
+    return paths[shard_index::shard_count]
+
+
+def iter_items(paths, root=None):
+    for path in paths:
+        name = document_name(path, root)
+        if os.path.getsize(path) > MAX_FILE_SIZE:
+            logger.error(f"File {path} exceeds maximum size limit.")
+            continue
+        yield name, MIME_TYPES[os.path.splitext(path)[1].lower()], path
+
+
+def log_progress(total):
+    done = 0
+    start_time = time.time()
+
+    def on_result(filename, document_json):
+        nonlocal done
+        done += 1
+        elapsed = time.time() - start_time
+        logger.info(f"{done}/{total} files done ({done / elapsed:.2f} files/s): {filename}")
+
+    return on_result
+
+
+def run_bulk(paths, api_key, work_dir, output, base_url=None, peach_url=None, root=None):
+    def documents():
+        for path in paths:
+            with LocalFile(path) as file:
+                yield document_name(path, root), read_file_text(file)
+
+    client = OpenAI(api_key=api_key, base_url=base_url)
+    start_time = time.time()
+    job = BulkJob(work_dir)
+    results = job.run(client, documents(), output)
+    failed = job.state["failed"]
+    stats = {"processed": len(results) - failed, "failed": failed, "elapsed": time.time() - start_time}
+    peach = create_peach_writer(peach_url)
+    if peach is not None:
+        try:
+            export_results(output, peach)
+        finally:
+            peach.close()
+        stats["peach"] = peach.stats()
+    return stats
+
+
+async def run(paths, api_key, output, concurrency=MAX_CONCURRENT_FILES, parse_workers=PIPELINE_PARSE_WORKERS,
+              base_url=None, peach_url=None, root=None):
+    client = create_async_client(api_key, base_url=base_url)
+    peach = create_peach_writer(peach_url)
+    writers = [writer for writer in (ResultWriter(output) if output else None, peach) if writer is not None]
+    writer = MultiWriter(*writers)
+    dedup_index = create_duplicate_index()
+    budget = create_token_budget()
+    local_tier = create_local_tier()
+    pipeline = Pipeline(client, writer, parse_workers=parse_workers, analysis_workers=concurrency,
+                        on_result=log_progress(len(paths)), dedup_index=dedup_index,
+                        manifest=get_manifest(), budget=budget, local_tier=local_tier)
+    try:
+        stats = await pipeline.run(iter_items(paths, root))
+    finally:
+        writer.close()
+        await client.close()
+    stats["failed"] = len(paths) - stats["processed"]
+    if dedup_index is not None:
+        dedup_index.save()
+        stats.update(duplicates=dedup_index.duplicates, calls_saved=dedup_index.calls_saved)
+    if budget is not None:
+        stats["budget"] = budget.stats()
+    if local_tier is not None:
+        local_tier.save()
+        stats["local_tier"] = local_tier.stats()
+    if peach is not None:
+        stats["peach"] = peach.stats()
+    return stats
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Behandle HR-dokumenter uten Streamlit.")
+    parser.add_argument("inputs", nargs="+", help="Input directories or glob patterns")
+    parser.add_argument("-o", "--output", help="Output directory, or a path ending in .zip")
+    parser.add_argument("-c", "--concurrency", type=int, default=MAX_CONCURRENT_FILES,
+                        help="Number of documents analysed at the same time")
+    parser.add_argument("-p", "--parse-workers", type=int, default=PIPELINE_PARSE_WORKERS,
+                        help="Number of processes parsing files")
+    parser.add_argument("--shard-index", type=int, default=int(os.environ.get("SHARD_INDEX", 0)))
+    parser.add_argument("--shard-count", type=int, default=int(os.environ.get("SHARD_COUNT", 1)))
+    parser.add_argument("--bulk", metavar="WORK_DIR", help="Use the Batch API, keeping job state in WORK_DIR")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="Write stage timings and token usage to PATH (Prometheus text for .prom, else JSON)")
+    parser.add_argument("--peach", metavar="URL", default=PEACH_URL,
+                        help="Export results to this Peach bulk import endpoint (default: PEACH_URL)")
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"))
+    parser.add_argument("--base-url", default=os.environ.get("OPENAI_BASE_URL"))
+    args = parser.parse_args(argv)
+    if not args.api_key:
+        parser.error("an OpenAI API key is required (--api-key or OPENAI_API_KEY)")
+    if not args.output and not args.peach:
+        parser.error("an output (-o) or a Peach import URL (--peach) is required")
+    if args.bulk and not args.output:
+        parser.error("--bulk needs an output directory (-o)")
+    if not 0 <= args.shard_index < args.shard_count:
+        parser.error("--shard-index must be between 0 and --shard-count - 1")
+    if args.bulk and args.output.lower().endswith(".zip"):
+        parser.error("--bulk writes to an output directory, not a ZIP file")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=getattr(logging, LOG_LEVEL),
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    paths = shard_paths(collect_paths(args.inputs), args.shard_index, args.shard_count)
+    root = input_root(args.inputs)
+    logger.info(f"Shard {args.shard_index + 1}/{args.shard_count}: {len(paths)} files")
+
+    if args.bulk:
+        stats = run_bulk(paths, args.api_key, args.bulk, args.output, base_url=args.base_url, peach_url=args.peach,
+                         root=root)
+    else:
+        stats = asyncio.run(run(paths, args.api_key, args.output, args.concurrency, args.parse_workers,
+                                base_url=args.base_url, peach_url=args.peach, root=root))
+
+    if args.metrics:
+        get_metrics().export(args.metrics)
+
+    throughput = stats["processed"] / stats["elapsed"] if stats["elapsed"] else 0
+    print(f"Processed {stats['processed']} files, {stats['failed']} failed, in {stats['elapsed']:.1f}s "
+          f"({throughput:.2f} files/s)")
+    tokens = get_metrics().snapshot()["tokens"]
+    print(f"Tokens: {tokens['prompt']} prompt ({tokens['cached']} cached), {tokens['completion']} completion")
+    if stats.get("budget"):
+        print(f"Token budget: {stats['budget']['used']}/{stats['budget']['limit']} used, "
+              f"{stats['budget']['downgraded']} files downgraded, {stats['budget']['rejected']} skipped")
+    if stats.get("local_tier"):
+        print(f"Local tier answered {stats['local_tier']['avoided_fraction']:.0%} of keyword and category calls")
+    if stats.get("skipped"):
+        print(f"{stats['skipped']} unchanged files were taken from the manifest of an earlier run")
+    if stats.get("duplicates"):
+        print(f"{stats['duplicates']} near-duplicate files reused an earlier analysis, "
+              f"saving {stats['calls_saved']} API calls")
+    if stats.get("peach"):
+        peach = stats["peach"]
+        print(f"Peach: {peach['documents']} documents in {peach['batches']} batches "
+              f"({peach['docs_per_sec']:.0f} documents/s), {peach['retries']} retries, {peach['failed']} failed")
+    return 0 if stats["failed"] == 0 and not stats.get("peach", {}).get("failed") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,127 @@
 # Configuration settings for the HR Document Processor
+import os
 
 # OpenAI API settings
 OPENAI_MODEL = "gpt-4o-2024-08-06"
 MAX_TOKENS = 4000
+# Model and max_tokens per analysis task; tasks without a route, and routes without max_tokens, use
+# OPENAI_MODEL and a limit sized from the task's answer format. Short classification answers do not
+# need the largest model, the summary and the combined analysis stay on it.
+MODEL_ROUTES = {
+    "keywords": {"model": "gpt-4o-mini"},
+    "category": {"model": "gpt-4o-mini"},
+    "entities": {"model": "gpt-4o-mini"},
+    "sentiment_keywords": {"model": "gpt-4o-mini"},
+    "summary": {"model": OPENAI_MODEL},
+    "full_analysis": {"model": OPENAI_MODEL},
+}
+MODEL_FALLBACK = OPENAI_MODEL  # Model that answers again when a routed model's answer fails validation, or None
+FULL_ANALYSIS_MODE = False  # Run all HR analyses as one structured-output call per document
+PROMPT_VERSION = "3"  # Bump when prompts or the output format change, so the manifest reprocesses documents
+PROMPT_DOCUMENT_CHARS = 4500  # Document characters in the prefix all tasks share once it is long enough to be cached
+TASK_DOCUMENT_CHARS = {  # Document characters per task when the shared prefix would be too short to be cached
+    "keywords": 1000,
+    "category": 1000,
+    "entities": 2000,
+    "sentiment_keywords": 2000,
+    "summary": 2000,
+    "full_analysis": 2000,
+}
+PROMPT_CACHE_MIN_TOKENS = 1024  # Shortest prompt prefix the provider caches; longer ones get one call per model first
+BATCH_TOKEN_BUDGET = None  # Maximum API tokens (prompt + completion) per batch, or None for no limit
+BATCH_BUDGET_DOWNGRADE_AT = 0.8  # Share of the budget after which documents get one combined analysis call
+
+# Chunked analysis settings
+CHUNKED_ANALYSIS = False  # Summarize and extract keywords from the whole document instead of its first characters
+CHUNK_MAX_TOKENS = 1500  # Maximum size of one chunk sent to the API
+DOCUMENT_TOKEN_BUDGET = 12000  # Maximum number of document tokens analysed per document
+
+# Section splitting settings
+SECTION_SPLITTING = False  # Split documents at headings and numbered clauses and analyse every section
+SECTION_MAX_CHARS = PROMPT_DOCUMENT_CHARS  # Longer sections are split at sentence boundaries so none is truncated
+SECTION_MIN_CHARS = 500  # Shorter sections are merged with the next one
+MAX_CONCURRENT_SECTIONS = 5  # Sections of one document analysed at the same time
+
+# Rate limiting settings (set to None to disable client-side pacing)
+RATE_LIMIT_RPM = 500  # Requests per minute allowed by the OpenAI quota
+RATE_LIMIT_TPM = 30000  # Tokens per minute allowed by the OpenAI quota
+RATE_LIMITS = {}  # Per-model (requests, tokens) per minute where a model's quota differs from the two above
+
+# HTTP connection pool settings (shared OpenAI client)
+HTTP_MAX_CONNECTIONS = 64  # Open connections to the API at most; above the number of calls in flight
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 32  # Idle connections kept open so later calls skip the TCP/TLS handshake
+HTTP_KEEPALIVE_EXPIRY = 120  # Seconds an idle connection is kept open
+HTTP_CONNECT_TIMEOUT = 10  # Seconds to wait for a new connection
+HTTP_READ_TIMEOUT = 120  # Seconds to wait for a response; long completions need more than the connect timeout
+
+# Bulk (Batch API) settings
+BATCH_POLL_INTERVAL = 60  # Seconds between batch status checks
+BATCH_MAX_REQUESTS = 50000  # Requests per Batch API input file at most
+BATCH_MAX_FILE_BYTES = 200 * 1024 * 1024  # Batch API limit on the size of one input file
 
 # File processing settings
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 MB
+MAX_FILE_SIZE = 50 * 1024 * 1024  # 50 MB; uploads are spooled to disk and parsed within INGEST_MEMORY_BUDGET
+MAX_CONCURRENT_FILES = 5  # Number of documents processed at the same time
+PDF_MAX_CHARS = None  # Stop extracting PDF pages once this many characters are read (None = whole document)
+PDF_EXTRACT_WORKERS = 4  # Worker processes for extracting large PDFs in full-document modes (0 = in-process)
+PDF_PARALLEL_MIN_PAGES = 20  # Smaller PDFs are always extracted in-process
+LANG_SAMPLE_CHARS = 1000  # Size of each text sample used for language detection
+LANG_SAMPLE_COUNT = 3  # Number of evenly spaced samples taken from long documents
+LANG_DETECT_SEED = 0  # Makes langdetect's random sampling reproducible
+ZIP_SPOOL_MAX_MEMORY = 5 * 1024 * 1024  # Result archives larger than this are spooled to a temp file
+INGEST_SPOOL_DIR = None  # Directory uploads are spooled to before parsing (None = the system temp directory)
+INGEST_MEMORY_BUDGET = 256 * 1024 * 1024  # Estimated bytes of documents in progress across all jobs (None = no limit)
+INGEST_MEMORY_FACTOR = 4  # Estimated bytes in memory per byte of uploaded file while it is parsed and analysed
+
+# Pipeline settings (headless runs)
+PIPELINE_PARSE_WORKERS = 2  # Processes that parse files and detect their language
+PIPELINE_QUEUE_SIZE = 10  # Maximum number of documents waiting between two stages
+
+# Background job settings (Streamlit app)
+JOB_WORKERS = 4  # Jobs that run at the same time; INGEST_MEMORY_BUDGET and the rate limiters bound their load
+JOB_HISTORY = 20  # Finished jobs kept in memory so their results survive page reruns
+JOB_POLL_INTERVAL = 1.0  # Seconds between progress refreshes while a job runs
+STREAMING_ENABLED = True  # Stream summaries so the app can show them while they are written
+
+# Peach export settings
+PEACH_URL = os.environ.get("PEACH_URL")  # Peach bulk import endpoint for NDJSON batches (None = no export)
+PEACH_API_KEY = os.environ.get("PEACH_API_KEY")
+PEACH_BATCH_SIZE = 500  # Documents per import request
+PEACH_MAX_ATTEMPTS = 5  # Attempts per batch before its documents are reported as failed
+PEACH_RETRY_BACKOFF = 1  # Multiplier in seconds for the exponential wait between attempts
+PEACH_TIMEOUT = 60  # Seconds per import request
 
 # Caching settings
+CACHE_ENABLED = True
+CACHE_DIR = os.environ.get("HR_CACHE_DIR", ".cache")
 CACHE_TTL = 3600  # Cache time-to-live in seconds
+CACHE_MAX_SIZE = 100 * 1024 * 1024  # 100 MB of cached responses before LRU eviction
+
+# Duplicate detection settings
+DEDUP_ENABLED = True  # Reuse the analysis of near-identical documents within a batch
+DEDUP_ACROSS_BATCHES = False  # Also match against documents from earlier batches
+DEDUP_INDEX_PATH = os.path.join(CACHE_DIR, "dedup_index.json")
+DEDUP_THRESHOLD = 0.9  # Estimated Jaccard similarity of word shingles to count as a duplicate
+DEDUP_NUM_PERM = 128
+DEDUP_BANDS = 32
+DEDUP_SHINGLE_SIZE = 5
+
+# Local tier settings (answers keywords and category without the LLM once trained on earlier results)
+LOCAL_TIER_ENABLED = False  # Opt-in: local answers replace LLM answers once the agreement below is measured
+LOCAL_TIER_PATH = os.path.join(CACHE_DIR, "local_tier.json")
+LOCAL_TIER_MIN_DOCUMENTS = 50  # LLM-analysed documents to learn from before answering locally
+LOCAL_TIER_CATEGORY_THRESHOLD = 0.95  # Minimum classifier probability for a category to be a local answer candidate
+LOCAL_TIER_CATEGORY_AGREEMENT = 0.95  # Minimum measured share of candidates that matched the LLM's category
+LOCAL_TIER_SHADOW_DOCUMENTS = 30  # Candidates compared with the LLM's answer before any is used
+LOCAL_TIER_SHADOW_RATE = 0.1  # Share of later candidates still sent to the LLM to keep measuring agreement
+LOCAL_TIER_KEYWORD_AGREEMENT = 0.8  # Minimum measured share of local keywords that were among the LLM's keywords
+
+# Manifest settings (incremental re-runs)
+MANIFEST_ENABLED = True  # Skip files whose content, prompt version and model are unchanged since the last run
+MANIFEST_DIR = os.path.join(CACHE_DIR, "manifest")
 
 # Logging settings
 LOG_LEVEL = "INFO"
 LOG_FILE = "hr_processor.log"
+LOG_PAYLOADS = False  # Log document text and results at DEBUG level (verbose, may contain personal data)
 
@@ -13,3 +13,6 @@ class APIError(HRProcessorError):
     """Raised when there's an error with API calls."""
     pass
 
+class TokenBudgetExceeded(HRProcessorError):
+    """Raised when a batch has used up its token budget."""
+    pass
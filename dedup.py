@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import numpy as np
+from manifest import model_signature
+from config import (DEDUP_ENABLED, DEDUP_ACROSS_BATCHES, DEDUP_INDEX_PATH, DEDUP_THRESHOLD, DEDUP_NUM_PERM,
+                    DEDUP_BANDS, DEDUP_SHINGLE_SIZE, PROMPT_VERSION)
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+_PRIME = (1 << 31) - 1
+
+
+def normalize_text(text):
+    return " ".join(_WORD.findall(text.lower()))
+
+
+def _shingle_hashes(words, size):
+    if len(words) <= size:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return np.array([int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+                     for shingle in shingles], dtype=np.uint64) % _PRIME
+
+
+class MinHasher:
+    """MinHash signatures over word shingles, with (a * x + b) mod p permutations."""
+
+    def __init__(self, num_perm=DEDUP_NUM_PERM, shingle_size=DEDUP_SHINGLE_SIZE, seed=1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, _PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64)
+        self.shingle_size = shingle_size
+
+    def signature(self, normalized_text):
+        hashes = _shingle_hashes(normalized_text.split(), self.shingle_size)
+        # Both factors are below 2**31, so the products fit in uint64.
+        return ((np.outer(hashes, self.a) + self.b) % _PRIME).min(axis=0)
+
+
+def similarity(signature, other):
+    return float(np.mean(signature == other))
+
+
+class DuplicateIndex:
+    """Groups exact and near-duplicate documents so only one of each group is analysed."""
+
+    def __init__(self, path=None, threshold=DEDUP_THRESHOLD, num_perm=DEDUP_NUM_PERM, bands=DEDUP_BANDS,
+                 prompt_version=PROMPT_VERSION, model=None):
+        self.path = path
+        self.prompt_version = prompt_version
+        self.model = model or model_signature()
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+        self.entries = {}
+        self._exact = {}
+        self._buckets = {}
+        self._pending = {}
+        self.duplicates = 0
+        self.calls_saved = 0
+        if path and os.path.exists(path):
+            self._load()
+
+    def _band_keys(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def fingerprint(self, text):
+        normalized = normalize_text(text)
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest(), self.hasher.signature(normalized)
+
+    def find(self, digest, signature):
+        if digest in self._exact:
+            return self._exact[digest], 1.0
+        best = None
+        candidates = {doc_id for key in self._band_keys(signature) for doc_id in self._buckets.get(key, ())}
+        for doc_id in candidates:
+            score = similarity(signature, self.entries[doc_id]["signature"])
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (doc_id, score)
+        return best
+
+    def add(self, doc_id, digest, signature, analysis=None):
+        self.entries[doc_id] = {"digest": digest, "signature": signature, "analysis": analysis}
+        self._exact.setdefault(digest, doc_id)
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, []).append(doc_id)
+
+    async def get_or_analyse(self, text, doc_id, analyse, calls=1, reusable=None):
+        """Returns the analysis of a duplicate of text, or analyses it with analyse().
+
+        An analysis that reusable(analysis) rejects, e.g. one with fields missing after an API
+        error, is returned but not kept, so the next duplicate is analysed again.
+        """
+        digest, signature = await asyncio.to_thread(self.fingerprint, text)
+        match = self.find(digest, signature)
+        if match is not None:
+            representative, score = match
+            self.duplicates += 1
+            self.calls_saved += calls
+            logger.info(f"{doc_id} duplicates {representative} (similarity {score:.2f}), reusing its analysis")
+            if representative in self._pending:
+                return await asyncio.shield(self._pending[representative])
+            return self.entries[representative]["analysis"]
+
+        base_id, n = doc_id, 1
+        while doc_id in self.entries:
+            doc_id = f"{base_id}#{n}"
+            n += 1
+
+        # Registered before the first await, so duplicates that arrive meanwhile wait for this analysis.
+        future = asyncio.get_running_loop().create_future()
+        self._pending[doc_id] = future
+        self.add(doc_id, digest, signature)
+        try:
+            analysis = await analyse()
+        except BaseException as e:
+            self._remove(doc_id)
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            del self._pending[doc_id]
+        if reusable is not None and not reusable(analysis):
+            logger.info(f"Analysis of {doc_id} is incomplete, not reusing it for duplicates")
+            self._remove(doc_id)
+        else:
+            self.entries[doc_id]["analysis"] = analysis
+        future.set_result(analysis)
+        return analysis
+
+    def _remove(self, doc_id):
+        entry = self.entries.pop(doc_id)
+        if self._exact.get(entry["digest"]) == doc_id:
+            del self._exact[entry["digest"]]
+        for key in self._band_keys(entry["signature"]):
+            self._buckets[key].remove(doc_id)
+
+    def stats(self):
+        return {"documents": len(self.entries), "duplicates": self.duplicates, "calls_saved": self.calls_saved}
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        # Saved analyses come from the prompts and models of the run that wrote them.
+        if data.get("prompt_version") != self.prompt_version or data.get("model") != self.model:
+            logger.info(f"Discarding duplicate index {self.path} from another prompt version or model")
+            return
+        for doc_id, entry in data["entries"].items():
+            self.add(doc_id, entry["digest"], np.array(entry["signature"], dtype=np.uint64), entry["analysis"])
+
+    def save(self):
+        if not self.path:
+            return
+        entries = {doc_id: {"digest": entry["digest"], "signature": entry["signature"].tolist(),
+                            "analysis": entry["analysis"]}
+                   for doc_id, entry in self.entries.items() if entry["analysis"] is not None}
+        data = {"prompt_version": self.prompt_version, "model": self.model, "entries": entries}
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def create_duplicate_index():
+    if not DEDUP_ENABLED:
+        return None
+    return DuplicateIndex(DEDUP_INDEX_PATH if DEDUP_ACROSS_BATCHES else None)
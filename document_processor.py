@@ -1,54 +1,88 @@
+import asyncio
 import json
 import re
 import os
 import logging
-from file_handlers import read_pdf, read_docx
+from file_handlers import read_pdf, read_docx, read_text
+from ingest import estimate_memory, get_memory_budget
 from text_processing import detect_language
 from hr_openai_utils import (
     extract_hr_keywords,
     categorize_hr_document,
     extract_hr_entities,
     summarize_hr_text,
-    extract_sentiment_keywords
+    extract_sentiment_keywords,
+    extract_hr_keywords_async,
+    categorize_hr_document_async,
+    extract_hr_entities_async,
+    summarize_hr_text_async,
+    extract_sentiment_keywords_async,
+    analyze_hr_document,
+    analyze_hr_document_async,
+    extract_hr_keywords_chunked_async,
+    summarize_hr_chunks_async,
+    is_prefix_cacheable,
+    task_route
 )
+from chunking import chunk_text
+from sections import split_sections
+from metrics import get_metrics, log_payload
+from token_budget import use_budget
+from config import (FULL_ANALYSIS_MODE, CHUNKED_ANALYSIS, SECTION_SPLITTING, MAX_CONCURRENT_SECTIONS, PDF_MAX_CHARS,
+                    PDF_EXTRACT_WORKERS, STREAMING_ENABLED)
 
 logger = logging.getLogger(__name__)
 
+ANALYSIS_FALLBACKS = {
+    "keywords": [],
+    "category": "",
+    "entities": {},
+    "sentiment_keywords": {'positive': [], 'negative': []},
+    "summary": ""
+}
+
 
 def extract_url(text):
-    logger.info(f"Extracting URL from text: {text[:100].encode('unicode_escape').decode('utf-8')}")
+    log_payload(logger, "Extracting URL from text", text)
     text = text.lstrip('\ufeff')
-    url_pattern = r'(https?://[^\s]+)'
-    match = re.search(url_pattern, text)
+    url_pattern = r'^(https?://[^\s]+)[\s\S]*'
+    match = re.match(url_pattern, text)
     if match:
         url = match.group(1)
-        remaining_text = text[:match.start()] + text[match.end():]
+        remaining_text = text[len(url):].strip()
         logger.info(f"Extracted URL: {url}")
-        logger.info(f"Remaining text: {remaining_text[:100].encode('unicode_escape').decode('utf-8')}")
-        return url, remaining_text.strip()
+        log_payload(logger, "Remaining text", remaining_text)
+        return url, remaining_text
     logger.info("No URL found in text")
     return None, text.strip()
 
 
 def clean_filename(filename):
-    name = os.path.splitext(filename)[0]
+    name = os.path.splitext(os.path.basename(filename))[0]
     name = name.replace('docx', '').strip()
     name = re.sub(r'[_-]', ' ', name)
     return ' '.join(word.capitalize() for word in name.split())
 
 
+def read_file_text(file):
+    if file.type == "text/plain":
+        return read_text(file)
+    elif file.type == "application/pdf":
+        # Only whole-document analysis gains from extracting every page of a large PDF in parallel.
+        full_document = CHUNKED_ANALYSIS or SECTION_SPLITTING
+        return read_pdf(file, max_chars=PDF_MAX_CHARS, workers=PDF_EXTRACT_WORKERS if full_document else 0)
+    elif file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
+        return read_docx(file)
+    else:
+        raise ValueError("Filtypen støttes ikke.")
+
+
 def process_file(file, client):
     try:
-        if file.type == "text/plain":
-            text = file.read().decode("utf-8")
-        elif file.type == "application/pdf":
-            text = read_pdf(file)
-        elif file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            text = read_docx(file)
-        else:
-            raise ValueError("Filtypen støttes ikke.")
+        with get_metrics().timer("parse"):
+            text = read_file_text(file)
 
-        logger.info(f"File content for {file.name} (first 100 characters): {text[:100].encode('unicode_escape').decode('utf-8')}")
+        log_payload(logger, f"File content for {file.name}", text)
         if not text.strip():
             logger.warning(f"File {file.name} is empty or contains only whitespace.")
             return None
@@ -59,38 +93,260 @@ def process_file(file, client):
         return None
 
 
-def structure_document(text, client, filename):
-    lang = detect_language(text)
+async def process_file_async(file, client, dedup_index=None, budget=None, local_tier=None, on_field=None,
+                             on_fallback=None):
+    memory_budget = get_memory_budget()
+    if memory_budget is None:
+        return await _process_file_async(file, client, dedup_index, budget, local_tier, on_field, on_fallback)
+    # The parsed text stays in memory until the analysis is done, so the reservation covers both.
+    async with memory_budget.reserve(estimate_memory(file)):
+        return await _process_file_async(file, client, dedup_index, budget, local_tier, on_field, on_fallback)
+
+
+async def _process_file_async(file, client, dedup_index, budget, local_tier, on_field, on_fallback):
+    try:
+        with get_metrics().timer("parse"):
+            text = await asyncio.to_thread(read_file_text, file)
+
+        log_payload(logger, f"File content for {file.name}", text)
+        if not text.strip():
+            logger.warning(f"File {file.name} is empty or contains only whitespace.")
+            return None
+
+        return await structure_document_async(text, client, file.name, dedup_index=dedup_index, budget=budget,
+                                              local_tier=local_tier, on_field=on_field, on_fallback=on_fallback)
+    except Exception as e:
+        logger.error(f"Error processing file {file.name}: {str(e)}", exc_info=True)
+        return None
+
+
+def prepare_text(text, filename, lang=None):
+    if lang is None:
+        with get_metrics().timer("langdetect"):
+            lang = detect_language(text)
     logger.info(f"Detected language for {filename}: {lang}")
     if lang != 'no':
         logger.warning(f"Document {filename} appears to be in {lang}, not Norwegian. Results may be inaccurate.")
 
-    logger.info(f"Original text (first 100 characters): {text[:100].encode('unicode_escape').decode('utf-8')}")
+    log_payload(logger, f"Original text of {filename}", text)
     url, text = extract_url(text)
     logger.info(f"Extracted URL for {filename}: {url}")
-    logger.info(f"Processed text (first 100 characters): {text[:100].encode('unicode_escape').decode('utf-8')}")
+    log_payload(logger, f"Processed text of {filename}", text)
+    return url, text
+
+
+def section_title(filename, heading, number):
+    return f"{clean_filename(filename)} - {heading or f'del {number}'}"
+
+
+def build_document(filename, text, url, keywords, category, entities, sentiment_keywords, summary, title=None,
+                   section=None):
+    log_payload(logger, f"Sentiment keywords for {filename}", str(sentiment_keywords))
+    document_data = {
+        "title": title or clean_filename(filename),
+        "body": text.strip(),
+        "summary": summary,
+        "tags": keywords,
+        "url": url,
+        "category": category,
+        "entities": entities if isinstance(entities, dict) else {"raw": entities},
+        "positive": sentiment_keywords.get('positive', []) if isinstance(sentiment_keywords, dict) else [],
+        "negative": sentiment_keywords.get('negative', []) if isinstance(sentiment_keywords, dict) else []
+    }
+    if section is not None:
+        document_data["section"] = section
+
+    document_json = json.dumps(document_data, ensure_ascii=False)
+    logger.info(f"Document processed successfully: {filename}")
+    log_payload(logger, f"Final document data for {filename}", document_json, limit=None)
+    return document_json
+
+
+def structure_document(text, client, filename, full_analysis=None):
+    url, text = prepare_text(text, filename)
+    if full_analysis is None:
+        full_analysis = FULL_ANALYSIS_MODE
 
     try:
-        title = clean_filename(filename)
+        if full_analysis:
+            return build_document(filename, text, url, **analyze_hr_document(text, client, max_words=200))
+
         keywords = extract_hr_keywords(text, client)
         category = categorize_hr_document(text, client)
         entities = extract_hr_entities(text, client)
         sentiment_keywords = extract_sentiment_keywords(text, client)
-        logger.info(f"Sentiment keywords for {filename}: {sentiment_keywords}")
         summary = summarize_hr_text(text, client, max_words=200)
 
-        document_data = {
-            "title": title,
-            "body": text.strip(),
-            "summary": summary,
-            "tags": keywords,
-            "url": url,
-            "category": category,
-            "entities": entities if isinstance(entities, dict) else {"raw": entities},
-            "positive": sentiment_keywords.get('positive', []) if isinstance(sentiment_keywords, dict) else [],
-            "negative": sentiment_keywords.get('negative', []) if isinstance(sentiment_keywords, dict) else []
-        }
-
-        logger.info(f"Final document data for {filename}: {json.dumps(document_data, ensure_ascii=False, indent=2)}")
-        return json.dumps(document_data, ensure_ascii=False)
+        return build_document(filename, text, url, keywords, category, entities, sentiment_keywords, summary)
+    except Exception as e:
+        logger.error(f"Error processing document {filename}: {str(e)}", exc_info=True)
+        return None
+
+
+async def analyse_text_async(text, client, filename, full_analysis=False, chunked=False, local_tier=None,
+                             on_field=None):
+    """Runs the HR analyses of one text and returns their fields.
 
+    on_field(filename, name, value) is called as each field finishes, and with the partial
+    summary while it is streamed, so a caller can show results before the whole document is done.
+    """
+    if full_analysis:
+        fields = await analyze_hr_document_async(text, client, max_words=200)
+        if local_tier is not None:
+            await asyncio.to_thread(local_tier.learn, text, fields["category"], fields["keywords"])
+        return fields
+
+    if chunked:
+        chunks = await asyncio.to_thread(chunk_text, text)
+        logger.info(f"Split {filename} into {len(chunks)} chunks")
+        keywords = lambda: extract_hr_keywords_chunked_async(chunks, client)
+        summary = lambda: summarize_hr_chunks_async(chunks, client, max_words=200)
+    else:
+        keywords = lambda: extract_hr_keywords_async(text, client)
+        on_delta = None
+        if on_field is not None and STREAMING_ENABLED:
+            on_delta = lambda partial: on_field(filename, "summary", partial)
+        summary = lambda: summarize_hr_text_async(text, client, max_words=200, on_delta=on_delta)
+
+    # Category goes first: it has the shortest answer, so it primes the prompt cache fastest.
+    analyses = {
+        "category": lambda: categorize_hr_document_async(text, client),
+        "keywords": keywords,
+        "entities": lambda: extract_hr_entities_async(text, client),
+        "sentiment_keywords": lambda: extract_sentiment_keywords_async(text, client),
+        "summary": summary
+    }
+
+    fields = {}
+    if local_tier is not None:
+        local_answers = {"keywords": await asyncio.to_thread(local_tier.answer_keywords, text),
+                         "category": await asyncio.to_thread(local_tier.answer_category, text)}
+        fields = {name: answer for name, answer in local_answers.items() if answer is not None}
+        if fields:
+            logger.info(f"Answered {', '.join(fields)} for {filename} locally")
+
+    async def report(name):
+        result = await analyses[name]()
+        if on_field is not None:
+            on_field(filename, name, result)
+        return result
+
+    if on_field is not None:
+        for name, answer in fields.items():
+            on_field(filename, name, answer)
+    pending = [name for name in analyses if name not in fields]
+    results = await _gather_primed(pending, report, is_prefix_cacheable(text))
+
+    learned = {}
+    fallbacks = []
+    for name, result in zip(pending, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error in {name} analysis for {filename}: {str(result)}", exc_info=result)
+            result = ANALYSIS_FALLBACKS[name]
+            fallbacks.append(name)
+        elif name in ("keywords", "category"):
+            learned[name] = result
+        fields[name] = result
+
+    # Only LLM answers are learned from, so local answers never reinforce themselves.
+    if local_tier is not None and learned:
+        await asyncio.to_thread(local_tier.learn, text, learned.get("category"), learned.get("keywords"))
+    # Fields that failed hold an empty fallback value, so the analysis must not be reused or recorded as done.
+    fields["fallbacks"] = fallbacks
+    return fields
+
+
+async def _gather_primed(names, run, cacheable):
+    """Runs run(name) for every name and returns the results or exceptions in order.
+
+    When the shared prompt prefix can be cached, the first call per model goes alone and the rest
+    follow once it has finished, so they read the prefix from the cache instead of all paying for it.
+    """
+    if not cacheable:
+        return await asyncio.gather(*(run(name) for name in names), return_exceptions=True)
+    groups = {}
+    for name in names:
+        groups.setdefault(task_route(name)[0], []).append(name)
+
+    async def run_group(group):
+        first = await asyncio.gather(run(group[0]), return_exceptions=True)
+        return first + await asyncio.gather(*(run(name) for name in group[1:]), return_exceptions=True)
+
+    grouped = await asyncio.gather(*(run_group(group) for group in groups.values()))
+    results = {name: result for group, group_results in zip(groups.values(), grouped)
+               for name, result in zip(group, group_results)}
+    return [results[name] for name in names]
+
+
+def is_complete(analysis):
+    return not analysis.get("fallbacks")
+
+
+async def structure_sections_async(sections, filename, url, analyse):
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_SECTIONS)
+
+    async def structure_section(number, heading, body):
+        async with semaphore:
+            fields = await analyse(body, f"{filename} section {number}")
+        return build_document(filename, body, url, **fields, title=section_title(filename, heading, number),
+                              section=number)
+
+    documents = await asyncio.gather(*(structure_section(number, heading, body)
+                                       for number, (heading, body) in enumerate(sections, start=1)))
+    # A sectioned document is a list with the JSON of each section, so writers don't parse it to split it.
+    return list(documents)
+
+
+async def structure_document_async(text, client, filename, full_analysis=None, chunked=None, lang=None,
+                                   dedup_index=None, budget=None, local_tier=None, sectioned=None, on_field=None,
+                                   on_fallback=None):
+    """Analyses text and returns the document JSON, a list of section JSONs for a sectioned document,
+    or None if it could not be structured.
+
+    on_fallback(filename, names) is called when fields fell back to empty values after API errors,
+    so a caller can avoid recording the result as done.
+    """
+    url, text = await asyncio.to_thread(prepare_text, text, filename, lang)
+    if full_analysis is None:
+        full_analysis = FULL_ANALYSIS_MODE
+    if chunked is None:
+        chunked = CHUNKED_ANALYSIS
+    if sectioned is None:
+        sectioned = SECTION_SPLITTING
+
+    async def analyse(text, doc_id, chunked=chunked):
+        def analysis():
+            return analyse_text_async(text, client, doc_id, full_analysis, chunked, local_tier, on_field)
+
+        if dedup_index is not None:
+            result = await dedup_index.get_or_analyse(text, doc_id, analysis, calls=1 if full_analysis else 5,
+                                                      reusable=is_complete)
+        else:
+            result = await analysis()
+        # Copied, because the duplicate index shares one analysis between documents.
+        fields = dict(result)
+        fallbacks = fields.pop("fallbacks", [])
+        if fallbacks and on_fallback is not None:
+            on_fallback(filename, fallbacks)
+        return fields
+
+    try:
+        if budget is not None:
+            budget.check(filename)
+            use_budget(budget)
+            if budget.should_downgrade and not full_analysis:
+                logger.info(f"Token budget {budget.used}/{budget.limit} used, analysing {filename} in one call")
+                budget.downgraded += 1
+                full_analysis = True
+        if sectioned:
+            sections = await asyncio.to_thread(lambda: list(split_sections(text)))
+            if len(sections) > 1:
+                logger.info(f"Split {filename} into {len(sections)} sections")
+                # Sections fit in one prompt, so chunking them would only add requests.
+                return await structure_sections_async(sections, filename, url,
+                                                      lambda body, doc_id: analyse(body, doc_id, chunked=False))
+        fields = await analyse(text, filename)
+        return build_document(filename, text, url, **fields)
+    except Exception as e:
+        logger.error(f"Error processing document {filename}: {str(e)}", exc_info=True)
+        return None
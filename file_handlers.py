@@ -1,12 +1,135 @@
+import atexit
+import codecs
+import io
+import itertools
+import mmap
+import multiprocessing
+import os
+import re
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
 import PyPDF2
-import docx2txt
+from chunking import count_tokens
+from config import PDF_PARALLEL_MIN_PAGES
 
-def read_pdf(file):
+MIME_TYPES = {
+    ".txt": "text/plain",
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+}
+
+
+class LocalFile:
+    """File on disk with the name/type/size attributes of a Streamlit upload."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.type = MIME_TYPES.get(os.path.splitext(path)[1].lower())
+        self.size = os.path.getsize(path)
+        self._file = open(path, "rb")
+
+    def __getattr__(self, attr):
+        return getattr(self._file, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool(workers):
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # spawn instead of fork: the app process runs threads (Streamlit, asyncio.to_thread).
+            _pdf_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            atexit.register(_pdf_pool.shutdown, cancel_futures=True)
+        return _pdf_pool
+
+
+def iter_pdf_pages(file, start=0, stop=None):
     pdf_reader = PyPDF2.PdfReader(file)
-    text = ""
-    for page in pdf_reader.pages:
-        text += page.extract_text() + "\n"
-    return text
+    for page in itertools.islice(pdf_reader.pages, start, stop):
+        yield page.extract_text() or ""
+
+
+def _extract_page_range(source, start, stop):
+    # source is the PDF contents, or the path of a file on disk that the worker opens itself.
+    return list(iter_pdf_pages(io.BytesIO(source) if isinstance(source, bytes) else source, start, stop))
+
+
+def read_pdf_parallel(file, workers):
+    source = file.path if isinstance(file, LocalFile) else file.read()
+    page_count = len(PyPDF2.PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source).pages)
+    if page_count < PDF_PARALLEL_MIN_PAGES:
+        return "".join(text + "\n" for text in _extract_page_range(source, 0, None))
+
+    step = -(-page_count // workers)
+    starts = range(0, page_count, step)
+    ranges = _get_pdf_pool(workers).map(_extract_page_range, itertools.repeat(source),
+                                        starts, [start + step for start in starts])
+    return "".join(text + "\n" for texts in ranges for text in texts)
+
+
+def read_pdf(file, max_chars=None, max_tokens=None, workers=0):
+    if workers > 1 and max_chars is None and max_tokens is None:
+        return read_pdf_parallel(file, workers)
+
+    parts = []
+    chars = 0
+    tokens = 0
+    for text in iter_pdf_pages(file):
+        parts.append(text + "\n")
+        chars += len(text) + 1
+        if max_tokens is not None:
+            tokens += count_tokens(text)
+        if (max_chars is not None and chars >= max_chars) or (max_tokens is not None and tokens >= max_tokens):
+            break
+    return "".join(parts)
+
+def read_text(file):
+    if not isinstance(file, LocalFile) or file.size == 0:
+        return file.read().decode("utf-8-sig")
+    # Decode straight from the page cache instead of reading a copy of the file into memory first.
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return codecs.decode(mapped, "utf-8-sig")
+
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_DOCX_PARTS = re.compile(r"word/(header\d*|document|footer\d*)\.xml$")
+
+
+def _iter_docx_text(stream):
+    # Same output as docx2txt, but the XML is parsed as a stream and discarded paragraph by paragraph.
+    for event, element in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            if element.tag == f"{_W}p":
+                yield "\n\n"
+            elif element.tag == f"{_W}tab":
+                yield "\t"
+            elif element.tag in (f"{_W}br", f"{_W}cr"):
+                yield "\n"
+        elif element.tag == f"{_W}t":
+            yield element.text or ""
+        elif element.tag == f"{_W}p":
+            element.clear()
+
 
 def read_docx(file):
-    return docx2txt.process(file)
\ No newline at end of file
+    with zipfile.ZipFile(file) as docx:
+        names = [name for name in docx.namelist() if _DOCX_PARTS.match(name)]
+        # Headers first, then the document body, then footers.
+        names.sort(key=lambda name: ("header" not in name) + ("footer" in name))
+        parts = []
+        for name in names:
+            with docx.open(name) as stream:
+                parts.extend(_iter_docx_text(stream))
+    return "".join(parts).strip()
@@ -1,10 +1,52 @@
-from openai import OpenAI
+from openai import OpenAI, RateLimitError
 import json
 from tenacity import retry, stop_after_attempt, wait_exponential
 import logging
+import asyncio
+import time
+from custom_exceptions import APIError
+from response_cache import ResponseCache, get_response_cache
+from rate_limiter import estimate_tokens, get_rate_limiter
+from metrics import get_metrics, log_payload, timed
+from token_budget import charge_usage
+from config import (OPENAI_MODEL, PROMPT_DOCUMENT_CHARS, TASK_DOCUMENT_CHARS, PROMPT_CACHE_MIN_TOKENS, MODEL_ROUTES,
+                    MODEL_FALLBACK)
 
 logger = logging.getLogger(__name__)
 
+HR_CATEGORIES = ["Rekruttering", "Onboarding", "Opplæring", "Ytelsesstyring", "Kompensasjon og fordeler",
+                 "Arbeidsmiljø", "Personaladministrasjon", "Organisasjonsutvikling", "HMS", "Annet"]
+
+_STRING_LIST = {"type": "array", "items": {"type": "string"}}
+
+HR_ANALYSIS_SCHEMA = {
+    "name": "hr_analysis",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "keywords": _STRING_LIST,
+            "category": {"type": "string", "enum": HR_CATEGORIES},
+            "entities": {
+                "type": "object",
+                "properties": {
+                    "ansatte": _STRING_LIST,
+                    "avdelinger": _STRING_LIST,
+                    "stillinger": _STRING_LIST,
+                    "kompetanser": _STRING_LIST
+                },
+                "required": ["ansatte", "avdelinger", "stillinger", "kompetanser"],
+                "additionalProperties": False
+            },
+            "positive": _STRING_LIST,
+            "negative": _STRING_LIST,
+            "summary": {"type": "string"}
+        },
+        "required": ["keywords", "category", "entities", "positive", "negative", "summary"],
+        "additionalProperties": False
+    }
+}
+
 def safe_json_loads(content):
     try:
         if isinstance(content, str):
@@ -16,76 +58,395 @@ def safe_json_loads(content):
         else:
             raise ValueError(f"Unexpected type: {type(content)}")
     except json.JSONDecodeError as e:
-        logger.error(f"Failed to parse JSON: {content}")
         logger.error(f"JSON decode error: {str(e)}")
+        log_payload(logger, "Unparsable JSON", content)
         return {}
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-def call_openai_api(client, messages, max_tokens):
-    response = client.chat.completions.create(
-        model="gpt-4o-2024-08-06",
-        messages=messages,
-        max_tokens=max_tokens
-    )
-    return response.choices[0].message.content.strip()
+def _message_content(response):
+    message = response.choices[0].message
+    if message.content is None:
+        raise APIError(f"OpenAI returned no content: {getattr(message, 'refusal', None)}")
+    return message.content.strip()
 
-def extract_hr_keywords(text, client):
-    messages = [
-        {"role": "system", "content": "Du er en HR-spesialist som trekker ut relevante HR-relaterte nøkkelord fra tekst på norsk."},
-        {"role": "user", "content": f"Trekk ut 5 HR-relaterte nøkkelord eller fraser fra følgende tekst på norsk. Svar kun med nøkkelordene, adskilt med komma:\n\n{text[:1000]}"}
+def _completion_kwargs(messages, max_tokens, response_format, model=OPENAI_MODEL):
+    kwargs = {"model": model, "messages": messages, "max_tokens": max_tokens}
+    if response_format is not None:
+        kwargs["response_format"] = response_format
+    return kwargs
+
+_wait_on_error = wait_exponential(multiplier=1, min=4, max=10)
+
+def _retry_wait(retry_state):
+    # After a 429 with retry-after the model's rate limiter already pauses its callers until it has passed.
+    if isinstance(retry_state.outcome.exception(), RateLimitError):
+        limiter = get_rate_limiter(retry_state.args[1]["model"])
+        if limiter is not None and limiter.paused_until > time.monotonic():
+            return 0
+    return _wait_on_error(retry_state)
+
+def _record_rate_limit(limiter, error):
+    if limiter is not None and error.response is not None:
+        limiter.update_from_headers(error.response.headers)
+
+@retry(stop=stop_after_attempt(3), wait=_retry_wait)
+def _create_completion(client, kwargs):
+    limiter = get_rate_limiter(kwargs["model"])
+    if limiter is not None:
+        limiter.acquire_sync(estimate_tokens(kwargs["messages"], kwargs["max_tokens"]))
+    try:
+        response = client.chat.completions.create(**kwargs)
+    except RateLimitError as e:
+        _record_rate_limit(limiter, e)
+        raise
+    get_metrics().record_usage(getattr(response, "usage", None), kwargs["model"])
+    charge_usage(getattr(response, "usage", None))
+    return _message_content(response)
+
+@retry(stop=stop_after_attempt(3), wait=_retry_wait)
+async def _create_completion_async(client, kwargs):
+    limiter = get_rate_limiter(kwargs["model"])
+    if limiter is not None:
+        await limiter.acquire(estimate_tokens(kwargs["messages"], kwargs["max_tokens"]))
+    try:
+        response = await client.chat.completions.create(**kwargs)
+    except RateLimitError as e:
+        _record_rate_limit(limiter, e)
+        raise
+    get_metrics().record_usage(getattr(response, "usage", None), kwargs["model"])
+    charge_usage(getattr(response, "usage", None))
+    return _message_content(response)
+
+@retry(stop=stop_after_attempt(3), wait=_retry_wait)
+async def _create_completion_stream_async(client, kwargs, on_delta):
+    limiter = get_rate_limiter(kwargs["model"])
+    if limiter is not None:
+        await limiter.acquire(estimate_tokens(kwargs["messages"], kwargs["max_tokens"]))
+    start = time.perf_counter()
+    parts = []
+    usage = None
+    try:
+        stream = await client.chat.completions.create(**kwargs, stream=True, stream_options={"include_usage": True})
+    except RateLimitError as e:
+        _record_rate_limit(limiter, e)
+        raise
+    # Closing the stream on cancellation drops the connection, so the model stops generating tokens.
+    async with stream:
+        async for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                if not parts:
+                    get_metrics().observe("first_token", time.perf_counter() - start)
+                parts.append(chunk.choices[0].delta.content)
+                on_delta("".join(parts))
+    get_metrics().record_usage(usage, kwargs["model"])
+    charge_usage(usage)
+    content = "".join(parts).strip()
+    if not content:
+        raise APIError("OpenAI returned no content")
+    return content
+
+def call_openai_api(client, messages, max_tokens, response_format=None, model=OPENAI_MODEL):
+    kwargs = _completion_kwargs(messages, max_tokens, response_format, model)
+    cache = get_response_cache()
+    if cache is None:
+        return _create_completion(client, kwargs)
+
+    key = ResponseCache.make_key(kwargs["model"], messages, max_tokens, response_format)
+    content = cache.get(key)
+    if content is None:
+        content = _create_completion(client, kwargs)
+        cache.set(key, content)
+    return content
+
+async def call_openai_api_async(client, messages, max_tokens, response_format=None, on_delta=None,
+                                model=OPENAI_MODEL):
+    # With on_delta the answer is streamed, and on_delta receives the text received so far.
+    kwargs = _completion_kwargs(messages, max_tokens, response_format, model)
+
+    def create():
+        if on_delta is None:
+            return _create_completion_async(client, kwargs)
+        return _create_completion_stream_async(client, kwargs, on_delta)
+
+    cache = get_response_cache()
+    if cache is None:
+        return await create()
+
+    key = ResponseCache.make_key(kwargs["model"], messages, max_tokens, response_format)
+    content = await asyncio.to_thread(cache.get, key)
+    if content is None:
+        content = await create()
+        await asyncio.to_thread(cache.set, key, content)
+    return content
+
+# Every analysis sends the same system message and document first and the task last, so the calls
+# for one document share a long identical prefix that the provider's prompt caching can reuse.
+_SYSTEM_PROMPT = ("Du er en HR-spesialist som analyserer HR-relaterte dokumenter på norsk. Du får først et dokument "
+                  "og deretter én oppgave om dokumentet. Svar kun i formatet oppgaven ber om.")
+
+def _document_messages(text, task, limit=PROMPT_DOCUMENT_CHARS):
+    document = text if limit is None else text[:limit]
+    return [
+        {"role": "system", "content": _SYSTEM_PROMPT},
+        {"role": "user", "content": f"Dokument:\n\n{document}"},
+        {"role": "user", "content": task}
     ]
-    keywords = call_openai_api(client, messages, 100).split(',')
+
+def is_prefix_cacheable(text):
+    # The shared prefix is everything before the task message.
+    return estimate_tokens(_document_messages(text, "")[:-1], 0) >= PROMPT_CACHE_MIN_TOKENS
+
+def _task_document_chars(text, task):
+    # The longer shared prefix only pays off when the provider caches it. Below the threshold every call
+    # pays for its whole prompt, so each task only gets the part of the document it needs.
+    return PROMPT_DOCUMENT_CHARS if is_prefix_cacheable(text) else TASK_DOCUMENT_CHARS[task]
+
+_KEYWORD_TOKENS = 8  # One Norwegian HR keyword or short phrase
+_WORD_TOKENS = 2  # Upper bound per word of Norwegian prose
+_FORMAT_TOKENS = 20  # Separators, JSON punctuation and keys
+
+def task_max_tokens(task, max_words=200):
+    sizes = {
+        "keywords": 5 * _KEYWORD_TOKENS,
+        "category": max(len(category) for category in HR_CATEGORIES) // 2,
+        "entities": 4 * 10 * _KEYWORD_TOKENS,
+        "sentiment_keywords": 2 * 5 * _KEYWORD_TOKENS,
+        "summary": max_words * _WORD_TOKENS
+    }
+    if task == "full_analysis":
+        return sum(sizes.values()) + len(sizes) * _FORMAT_TOKENS
+    return sizes[task] + _FORMAT_TOKENS
+
+def task_route(task, max_words=200):
+    """Returns the model and max_tokens that MODEL_ROUTES assigns to an analysis task."""
+    route = MODEL_ROUTES.get(task, {})
+    return route.get("model", OPENAI_MODEL), route.get("max_tokens") or task_max_tokens(task, max_words)
+
+def _json_object(result):
+    try:
+        parsed = json.loads(result.strip().replace('```json', '').replace('```', '').strip())
+    except json.JSONDecodeError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+def is_valid_answer(task, result):
+    validators = {
+        "keywords": lambda result: any(_parse_hr_keywords(result)),
+        "category": lambda result: result.strip().rstrip(".") in HR_CATEGORIES,
+        "entities": lambda result: _json_object(result) is not None,
+        "sentiment_keywords": lambda result: {"positive", "negative"} <= set(_json_object(result) or {}),
+        "full_analysis": lambda result: _json_object(result) is not None
+    }
+    return validators.get(task, lambda result: bool(result.strip()))(result)
+
+def _fallback_model(task, model, result):
+    # An unusable answer from a routed model is asked once more of the fallback model.
+    if not MODEL_FALLBACK or MODEL_FALLBACK == model or is_valid_answer(task, result):
+        return None
+    logger.warning(f"Answer from {model} for {task} failed validation, retrying with {MODEL_FALLBACK}")
+    get_metrics().record_fallback()
+    return MODEL_FALLBACK
+
+def call_task(client, task, messages, max_words=200, response_format=None):
+    model, max_tokens = task_route(task, max_words)
+    result = call_openai_api(client, messages, max_tokens, response_format, model=model)
+    fallback = _fallback_model(task, model, result)
+    if fallback is None:
+        return result
+    return call_openai_api(client, messages, max_tokens, response_format, model=fallback)
+
+async def call_task_async(client, task, messages, max_words=200, response_format=None, on_delta=None):
+    model, max_tokens = task_route(task, max_words)
+    result = await call_openai_api_async(client, messages, max_tokens, response_format, on_delta=on_delta, model=model)
+    fallback = _fallback_model(task, model, result)
+    if fallback is None:
+        return result
+    return await call_openai_api_async(client, messages, max_tokens, response_format, on_delta=on_delta,
+                                       model=fallback)
+
+def _hr_keywords_messages(text, whole=False):
+    limit = None if whole else _task_document_chars(text, "keywords")
+    return _document_messages(text, "Trekk ut 5 HR-relaterte nøkkelord eller fraser fra dokumentet. Svar kun med nøkkelordene, adskilt med komma.", limit)
+
+def _parse_hr_keywords(result):
+    keywords = result.split(',')
     return [word.strip() for word in keywords][:5]
 
+@timed()
+def extract_hr_keywords(text, client):
+    return _parse_hr_keywords(call_task(client, "keywords", _hr_keywords_messages(text)))
+
+@timed()
+async def extract_hr_keywords_async(text, client):
+    return _parse_hr_keywords(await call_task_async(client, "keywords", _hr_keywords_messages(text)))
+
+def _rank_chunk_keywords(chunk_keywords, limit=5):
+    counts = {}
+    first_seen = {}
+    spelling = {}
+    for keywords in chunk_keywords:
+        for keyword in keywords:
+            key = keyword.lower()
+            if not key:
+                continue
+            counts[key] = counts.get(key, 0) + 1
+            first_seen.setdefault(key, len(first_seen))
+            spelling.setdefault(key, keyword)
+    ranked = sorted(counts, key=lambda key: (-counts[key], first_seen[key]))
+    return [spelling[key] for key in ranked[:limit]]
+
+@timed()
+async def extract_hr_keywords_chunked_async(chunks, client):
+    if len(chunks) == 1:
+        return await extract_hr_keywords_async(chunks[0], client)
+    results = await asyncio.gather(*(
+        call_task_async(client, "keywords", _hr_keywords_messages(chunk, whole=True)) for chunk in chunks))
+    return _rank_chunk_keywords(_parse_hr_keywords(result) for result in results)
+
+def _categorize_hr_messages(text):
+    categories_str = ", ".join(HR_CATEGORIES)
+    return _document_messages(text, f"Kategoriser dokumentet i en av disse kategoriene: {categories_str}. Svar kun med kategorinavnet.",
+                              _task_document_chars(text, "category"))
+
+@timed()
 def categorize_hr_document(text, client):
-    hr_categories = ["Rekruttering", "Onboarding", "Opplæring", "Ytelsesstyring", "Kompensasjon og fordeler",
-                     "Arbeidsmiljø", "Personaladministrasjon", "Organisasjonsutvikling", "HMS", "Annet"]
-    categories_str = ", ".join(hr_categories)
-    messages = [
-        {"role": "system", "content": "Du er en HR-spesialist som kategoriserer HR-dokumenter basert på gitte kategorier."},
-        {"role": "user", "content": f"Kategoriser følgende HR-relaterte tekst i en av disse kategoriene: {categories_str}. Svar kun med kategorinavnet:\n\n{text[:1000]}"}
-    ]
-    return call_openai_api(client, messages, 50)
+    return call_task(client, "category", _categorize_hr_messages(text))
+
+@timed()
+async def categorize_hr_document_async(text, client):
+    return await call_task_async(client, "category", _categorize_hr_messages(text))
 
+def _hr_entities_messages(text):
+    return _document_messages(text, "Trekk ut relevante HR-enheter (ansatte, avdelinger, stillinger, kompetanser) fra dokumentet, høyst 10 av hver. Returner resultatet som en JSON-streng med nøklene 'ansatte', 'avdelinger', 'stillinger', og 'kompetanser'.",
+                              _task_document_chars(text, "entities"))
+
+@timed()
 def extract_hr_entities(text, client):
-    messages = [
-        {"role": "system", "content": "Du er en HR-spesialist som trekker ut relevante enheter fra HR-relatert tekst på norsk."},
-        {"role": "user", "content": f"Trekk ut relevante HR-enheter (ansatte, avdelinger, stillinger, kompetanser) fra følgende tekst. Returner resultatet som en JSON-streng med nøklene 'ansatte', 'avdelinger', 'stillinger', og 'kompetanser':\n\n{text[:2000]}"}
-    ]
-    return safe_json_loads(call_openai_api(client, messages, 500))
+    return safe_json_loads(call_task(client, "entities", _hr_entities_messages(text)))
 
-def summarize_hr_text(text, client, max_words=200):
-    messages = [
+@timed()
+async def extract_hr_entities_async(text, client):
+    return safe_json_loads(await call_task_async(client, "entities", _hr_entities_messages(text)))
+
+def _summarize_hr_messages(text, max_words, whole=False):
+    limit = None if whole else _task_document_chars(text, "summary")
+    return _document_messages(text, f"Lag et HR-fokusert sammendrag på rundt {max_words} ord av dokumentet på norsk.", limit)
+
+def _combine_summaries_messages(summaries, max_words):
+    joined = "\n\n".join(f"Del {i + 1}:\n{summary}" for i, summary in enumerate(summaries))
+    return [
         {"role": "system", "content": "Du er en HR-spesialist som lager konsise sammendrag av HR-relatert tekst på norsk."},
-        {"role": "user", "content": f"Lag et HR-fokusert sammendrag på rundt {max_words} ord av følgende tekst på norsk:\n\n{text[:2000]}"}
+        {"role": "user", "content": f"Følgende er sammendrag av hver del av ett HR-dokument. Slå dem sammen til ett HR-fokusert sammendrag på rundt {max_words} ord på norsk:\n\n{joined}"}
     ]
-    return call_openai_api(client, messages, max_words * 2)
 
-def extract_sentiment_keywords(text, client):
-    messages = [
-        {"role": "system", "content": "Du er en HR-spesialist som analyserer stemning og trekker ut nøkkelord relatert til stemning fra HR-relatert tekst på norsk."},
-        {"role": "user", "content": f"""
-        Analyser følgende HR-relaterte tekst og trekk ut nøkkelord relatert til stemning. 
+@timed()
+def summarize_hr_text(text, client, max_words=200):
+    return call_task(client, "summary", _summarize_hr_messages(text, max_words), max_words)
+
+@timed()
+async def summarize_hr_text_async(text, client, max_words=200, on_delta=None):
+    return await call_task_async(client, "summary", _summarize_hr_messages(text, max_words), max_words, on_delta=on_delta)
+
+@timed()
+async def summarize_hr_chunks_async(chunks, client, max_words=200):
+    if len(chunks) == 1:
+        return await call_task_async(client, "summary", _summarize_hr_messages(chunks[0], max_words, whole=True), max_words)
+    chunk_words = max(50, max_words // 2)
+    summaries = await asyncio.gather(*(
+        call_task_async(client, "summary", _summarize_hr_messages(chunk, chunk_words, whole=True), chunk_words)
+        for chunk in chunks))
+    return await call_task_async(client, "summary", _combine_summaries_messages(summaries, max_words), max_words)
+
+def _sentiment_keywords_messages(text):
+    return _document_messages(text, """
+        Analyser dokumentet og trekk ut nøkkelord relatert til stemning.
         Fokuser på ord og fraser som indikerer positive eller negative følelser, holdninger, eller oppfatninger.
-        Returner resultatet som en JSON-streng med nøklene 'positive' og 'negative', hver med en liste av 5 relevante nøkkelord:
+        Returner resultatet som en JSON-streng med nøklene 'positive' og 'negative', hver med en liste av 5 relevante nøkkelord.
+        """, _task_document_chars(text, "sentiment_keywords"))
 
-        {text[:2000]}
-        """}
-    ]
+def _parse_sentiment_keywords(result):
+    log_payload(logger, "Raw result from sentiment keywords extraction", str(result))
+    parsed_result = safe_json_loads(result)
+
+    if isinstance(parsed_result, dict) and 'positive' in parsed_result and 'negative' in parsed_result:
+        logger.debug("Sentiment keywords extracted successfully")
+        return parsed_result
+    else:
+        # The answer may quote the document, so only its shape is logged.
+        keys = list(parsed_result) if isinstance(parsed_result, dict) else type(parsed_result).__name__
+        logger.error(f"Unexpected format in sentiment keywords extraction: {keys}")
+        return {'positive': [], 'negative': []}
+
+@timed()
+def extract_sentiment_keywords(text, client):
     try:
-        result = call_openai_api(client, messages, 200)
-        logger.info(f"Raw result from sentiment keywords extraction: {result}")
-        parsed_result = safe_json_loads(result)
-        logger.info(f"Parsed result from sentiment keywords extraction: {parsed_result}")
-        logger.info(f"Type of parsed_result: {type(parsed_result)}")
-        logger.info(f"Keys in parsed_result: {parsed_result.keys() if isinstance(parsed_result, dict) else 'Not a dict'}")
-
-        if isinstance(parsed_result, dict) and 'positive' in parsed_result and 'negative' in parsed_result:
-            logger.info("Sentiment keywords extracted successfully")
-            return parsed_result
-        else:
-            logger.error(f"Unexpected format in sentiment keywords extraction: {parsed_result}")
-            return {'positive': [], 'negative': []}
+        result = call_task(client, "sentiment_keywords", _sentiment_keywords_messages(text))
+        return _parse_sentiment_keywords(result)
     except Exception as e:
         logger.error(f"Error in sentiment keywords extraction: {str(e)}")
-        return {'positive': [], 'negative': []}
\ No newline at end of file
+        return {'positive': [], 'negative': []}
+
+@timed()
+async def extract_sentiment_keywords_async(text, client):
+    # Errors propagate, so analyse_text_async records the empty fallback as a failed field.
+    result = await call_task_async(client, "sentiment_keywords", _sentiment_keywords_messages(text))
+    return _parse_sentiment_keywords(result)
+
+def _full_hr_analysis_messages(text, max_words):
+    # The only call for the document, so no other call would read a longer prefix from the cache.
+    categories_str = ", ".join(HR_CATEGORIES)
+    return _document_messages(text, f"""
+        Analyser dokumentet og returner:
+        - keywords: 5 HR-relaterte nøkkelord eller fraser
+        - category: én av disse kategoriene: {categories_str}
+        - entities: relevante HR-enheter fordelt på 'ansatte', 'avdelinger', 'stillinger' og 'kompetanser', høyst 10 av hver
+        - positive og negative: 5 nøkkelord hver som indikerer positive eller negative følelser, holdninger eller oppfatninger
+        - summary: et HR-fokusert sammendrag på rundt {max_words} ord
+        """, TASK_DOCUMENT_CHARS["full_analysis"])
+
+def _parse_full_hr_analysis(result):
+    analysis = json.loads(result)
+    return {
+        "keywords": analysis["keywords"][:5],
+        "category": analysis["category"],
+        "entities": analysis["entities"],
+        "sentiment_keywords": {'positive': analysis["positive"], 'negative': analysis["negative"]},
+        "summary": analysis["summary"]
+    }
+
+@timed()
+def analyze_hr_document(text, client, max_words=200):
+    result = call_task(client, "full_analysis", _full_hr_analysis_messages(text, max_words), max_words,
+                       response_format={"type": "json_schema", "json_schema": HR_ANALYSIS_SCHEMA})
+    return _parse_full_hr_analysis(result)
+
+@timed()
+async def analyze_hr_document_async(text, client, max_words=200):
+    result = await call_task_async(client, "full_analysis", _full_hr_analysis_messages(text, max_words), max_words,
+                                   response_format={"type": "json_schema", "json_schema": HR_ANALYSIS_SCHEMA})
+    return _parse_full_hr_analysis(result)
+
+def build_hr_analysis_requests(text, max_words=200):
+    messages = {
+        "keywords": _hr_keywords_messages(text),
+        "category": _categorize_hr_messages(text),
+        "entities": _hr_entities_messages(text),
+        "sentiment_keywords": _sentiment_keywords_messages(text),
+        "summary": _summarize_hr_messages(text, max_words)
+    }
+    requests = {}
+    for task, task_messages in messages.items():
+        model, max_tokens = task_route(task, max_words)
+        requests[task] = _completion_kwargs(task_messages, max_tokens, None, model)
+    return requests
+
+def parse_hr_analysis_result(task, content):
+    parsers = {
+        "keywords": _parse_hr_keywords,
+        "category": lambda result: result,
+        "entities": safe_json_loads,
+        "sentiment_keywords": _parse_sentiment_keywords,
+        "summary": lambda result: result
+    }
+    return parsers[task](content.strip())
@@ -0,0 +1,147 @@
+import asyncio
+import atexit
+import collections
+import contextlib
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from file_handlers import LocalFile
+from manifest import content_hash
+from config import INGEST_SPOOL_DIR, INGEST_MEMORY_BUDGET, INGEST_MEMORY_FACTOR
+
+logger = logging.getLogger(__name__)
+
+_spool_dir = None
+_budget = None
+_lock = threading.Lock()
+
+
+def _get_spool_dir():
+    global _spool_dir
+    with _lock:
+        if _spool_dir is None:
+            if INGEST_SPOOL_DIR:
+                os.makedirs(INGEST_SPOOL_DIR, exist_ok=True)
+            _spool_dir = tempfile.mkdtemp(prefix="hr_uploads_", dir=INGEST_SPOOL_DIR)
+            atexit.register(shutil.rmtree, _spool_dir, ignore_errors=True)
+        return _spool_dir
+
+
+class SpooledUpload(LocalFile):
+    """Upload copied to a temporary file on disk, so only the parsed text of a document is held in memory."""
+
+    def __init__(self, source, name, type, chunk_size=1024 * 1024):
+        digest = hashlib.sha256()
+        fd, path = tempfile.mkstemp(prefix="upload_", dir=_get_spool_dir())
+        with os.fdopen(fd, "wb") as f:
+            while chunk := source.read(chunk_size):
+                digest.update(chunk)
+                f.write(chunk)
+        super().__init__(path)
+        self.name = name
+        self.type = type
+        self.digest = digest.hexdigest()
+
+    def getvalue(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def discard(self):
+        self._file.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path)
+
+
+def spool_upload(uploaded_file):
+    uploaded_file.seek(0)
+    return SpooledUpload(uploaded_file, uploaded_file.name, uploaded_file.type)
+
+
+def upload_digest(file):
+    # Spooled uploads were hashed while they were copied to disk.
+    if isinstance(file, SpooledUpload):
+        return file.digest
+    return content_hash(file.getvalue())
+
+
+def estimate_memory(file):
+    return file.size * INGEST_MEMORY_FACTOR
+
+
+class MemoryBudget:
+    """Estimated bytes of document data in memory, shared by every job and session in the process."""
+
+    def __init__(self, limit=INGEST_MEMORY_BUDGET):
+        self.limit = limit
+        self.used = 0
+        self.waits = 0
+        self._lock = threading.Lock()
+        # Reservations waiting on an event loop, as (loop, future, nbytes), granted in order.
+        self._waiters = collections.deque()
+
+    def release(self, nbytes):
+        with self._lock:
+            self.used -= nbytes
+            self._wake()
+
+    def _wake(self):
+        # Called with the lock held.
+        while self._waiters and self.used + self._waiters[0][2] <= self.limit:
+            loop, future, nbytes = self._waiters.popleft()
+            self.used += nbytes
+            loop.call_soon_threadsafe(self._grant, future, nbytes)
+
+    def _grant(self, future, nbytes):
+        # Runs on the waiter's loop; a reservation that was cancelled in the meantime is handed back.
+        if future.cancelled():
+            self.release(nbytes)
+        else:
+            future.set_result(nbytes)
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, nbytes):
+        # Waits on the event loop rather than in a thread, so waiting documents don't occupy
+        # the default executor that parsing and file I/O run on. A document larger than the whole
+        # budget still runs, but only on its own.
+        nbytes = min(nbytes, self.limit)
+        waiter = None
+        with self._lock:
+            if not self._waiters and self.used + nbytes <= self.limit:
+                self.used += nbytes
+            else:
+                self.waits += 1
+                logger.info(f"Waiting for {nbytes} bytes of memory budget ({self.used}/{self.limit} in use)")
+                loop = asyncio.get_running_loop()
+                waiter = (loop, loop.create_future(), nbytes)
+                self._waiters.append(waiter)
+        if waiter is not None:
+            try:
+                await waiter[1]
+            except asyncio.CancelledError:
+                with self._lock:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+                        waiter = None
+                        # The reservations behind it may fit now.
+                        self._wake()
+                # Granted just before the cancellation, so _grant will not hand it back.
+                if waiter is not None and waiter[1].done() and not waiter[1].cancelled():
+                    self.release(nbytes)
+                raise
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+
+def get_memory_budget():
+    global _budget
+    if INGEST_MEMORY_BUDGET is None:
+        return None
+    with _lock:
+        if _budget is None:
+            _budget = MemoryBudget()
+        return _budget
@@ -0,0 +1,207 @@
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from ingest import upload_digest
+from config import JOB_WORKERS, JOB_HISTORY
+
+logger = logging.getLogger(__name__)
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def job_key(files, api_key):
+    """Identifies a run by its API key and the names and contents of its files.
+
+    The same upload with the same key maps to the same job; another key never sees its result.
+    """
+    digest = hashlib.sha256(hashlib.sha256(api_key.encode("utf-8")).digest())
+    for file in sorted(files, key=lambda file: file.name):
+        digest.update(file.name.encode("utf-8"))
+        digest.update(bytes.fromhex(upload_digest(file)))
+    return digest.hexdigest()
+
+
+class Job:
+    """Progress and result of one processing run, shared by the worker thread and every UI rerun."""
+
+    def __init__(self, job_id, filenames):
+        self.id = job_id
+        self.filenames = filenames
+        self.state = "queued"
+        self.status_text = ""
+        self.processed = 0
+        self.file_status = {}
+        self.document_titles = []
+        self.partial = {}
+        self.messages = []
+        self.result = None
+        self.count = 0
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._cancel_callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def total(self):
+        return len(self.filenames)
+
+    @property
+    def running(self):
+        return self.state in ("queued", "running", "cancelling")
+
+    @property
+    def cancelled(self):
+        return self.state in ("cancelling", "cancelled")
+
+    def update(self, **fields):
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+
+    def set_field(self, doc_id, name, value):
+        # Fields of documents that are still being analysed, shown while the job runs.
+        with self._lock:
+            self.partial.setdefault(doc_id, {})[name] = value
+
+    def clear_fields(self, filename):
+        with self._lock:
+            for doc_id in [doc_id for doc_id in self.partial
+                           if doc_id == filename or doc_id.startswith(f"{filename} section ")]:
+                del self.partial[doc_id]
+
+    def on_cancel(self, callback):
+        """Registers callback to stop the job's in-flight work; runs it at once if the job is already cancelled."""
+        with self._lock:
+            if not self.cancelled:
+                self._cancel_callbacks.append(callback)
+                return
+        callback()
+
+    def remove_cancel_callback(self, callback):
+        with self._lock:
+            if callback in self._cancel_callbacks:
+                self._cancel_callbacks.remove(callback)
+
+    def cancel(self):
+        with self._lock:
+            if self.state == "queued":
+                self.state, self.finished = "cancelled", time.time()
+            elif self.state == "running":
+                self.state = "cancelling"
+            else:
+                return False
+            callbacks, self._cancel_callbacks = self._cancel_callbacks, []
+        logger.info(f"Cancelling job {self.id[:12]}")
+        for callback in callbacks:
+            callback()
+        return True
+
+    def keep_result(self, file, count):
+        """Stores the result archive's spooled file; it is read from disk only when it is downloaded."""
+        # Moved to disk at once, so the finished jobs in the history don't keep their archives in memory.
+        file.rollover()
+        with self._lock:
+            if self.result is not None:
+                self.result.close()
+            self.result, self.count = file, count
+
+    def read_result(self):
+        with self._lock:
+            if self.result is None:
+                return None
+            self.result.seek(0)
+            return self.result.read()
+
+    def discard(self):
+        # Closing the spooled file deletes it.
+        with self._lock:
+            if self.result is not None:
+                self.result.close()
+                self.result = None
+
+    def notify(self, level, text):
+        # Shown with st.<level> once the job has finished.
+        with self._lock:
+            self.messages.append((level, text))
+
+    def snapshot(self):
+        with self._lock:
+            return {"id": self.id, "state": self.state, "status_text": self.status_text,
+                    "processed": self.processed, "total": self.total, "file_status": dict(self.file_status),
+                    "document_titles": list(self.document_titles),
+                    "partial": {doc_id: dict(fields) for doc_id, fields in self.partial.items()},
+                    "messages": list(self.messages),
+                    "has_result": self.result is not None, "count": self.count, "error": self.error,
+                    "started": self.started, "finished": self.finished}
+
+
+class JobManager:
+    """Runs processing jobs on worker threads and keeps their results across Streamlit reruns."""
+
+    def __init__(self, workers=JOB_WORKERS, history=JOB_HISTORY):
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, filenames, work):
+        """Starts work(job) in the background unless a job for the same key is running or finished.
+
+        work must return the result archive (an object with close(), returning its spooled file,
+        and count). A failed or cancelled job is started again.
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job.state not in ("failed", "cancelled"):
+                logger.info(f"Reusing job {key[:12]} ({job.state})")
+                return job
+            if job is not None:
+                job.discard()
+            job = Job(key, filenames)
+            self._jobs[key] = job
+            self._prune()
+        self._executor.submit(self._run, job, work)
+        return job
+
+    def get(self, key):
+        with self._lock:
+            return self._jobs.get(key)
+
+    def _prune(self):
+        finished = sorted((job for job in self._jobs.values() if not job.running), key=lambda job: job.created)
+        for job in finished[:max(0, len(self._jobs) - self.history)]:
+            del self._jobs[job.id]
+            job.discard()
+
+    def _run(self, job, work):
+        with job._lock:
+            if job.state != "queued":
+                # Cancelled while it waited for a worker.
+                return
+            job.state, job.started = "running", time.time()
+        logger.info(f"Job {job.id[:12]} started with {job.total} files")
+        try:
+            archive = work(job)
+            job.keep_result(archive.close(), archive.count)
+            job.update(state="done", partial={}, finished=time.time())
+            logger.info(f"Job {job.id[:12]} finished with {archive.count} documents")
+        except CancelledError:
+            # work may have stored the documents that finished before the cancellation as the result.
+            logger.info(f"Job {job.id[:12]} was cancelled after {job.processed} of {job.total} files")
+            job.update(state="cancelled", partial={}, finished=time.time())
+        except Exception as e:
+            logger.error(f"Job {job.id[:12]} failed: {str(e)}", exc_info=True)
+            job.update(state="failed", error=str(e), finished=time.time())
+
+
+def get_job_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
@@ -0,0 +1,219 @@
+import json
+import logging
+import os
+import random
+import re
+import threading
+from collections import Counter
+import numpy as np
+from hr_openai_utils import HR_CATEGORIES
+from config import (LOCAL_TIER_ENABLED, LOCAL_TIER_PATH, LOCAL_TIER_MIN_DOCUMENTS, LOCAL_TIER_CATEGORY_THRESHOLD,
+                    LOCAL_TIER_CATEGORY_AGREEMENT, LOCAL_TIER_SHADOW_DOCUMENTS, LOCAL_TIER_SHADOW_RATE,
+                    LOCAL_TIER_KEYWORD_AGREEMENT)
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+_MAX_PHRASE_WORDS = 3
+_STOPWORDS = {"og", "i", "er", "på", "av", "til", "som", "det", "med", "en", "et", "ei", "den", "de", "for", "har",
+              "skal", "kan", "ikke", "eller", "ved", "når", "etter", "også", "fra", "om", "at", "vi", "du", "seg",
+              "sin", "sitt", "sine", "være", "vil", "må", "bli", "blir", "så", "hvis", "dette", "disse", "der"}
+
+
+def tokenize(text):
+    return _WORD.findall(text.lower())
+
+
+def normalize_phrase(phrase):
+    return " ".join(tokenize(phrase))
+
+
+def _ngrams(words):
+    return Counter(" ".join(words[i:i + n]) for n in range(1, _MAX_PHRASE_WORDS + 1)
+                   for i in range(len(words) - n + 1))
+
+
+class LocalTier:
+    """TF-IDF keywords and a naive Bayes category classifier learned from earlier LLM answers."""
+
+    def __init__(self, path=None, min_documents=LOCAL_TIER_MIN_DOCUMENTS,
+                 category_threshold=LOCAL_TIER_CATEGORY_THRESHOLD, category_agreement=LOCAL_TIER_CATEGORY_AGREEMENT,
+                 keyword_agreement=LOCAL_TIER_KEYWORD_AGREEMENT, shadow_documents=LOCAL_TIER_SHADOW_DOCUMENTS,
+                 shadow_rate=LOCAL_TIER_SHADOW_RATE, seed=None):
+        self.path = path
+        self.min_documents = min_documents
+        self.category_threshold = category_threshold
+        self.category_agreement = category_agreement
+        self.keyword_agreement = keyword_agreement
+        self.shadow_documents = shadow_documents
+        self.shadow_rate = shadow_rate
+        self.documents = 0
+        # Category classifier: documents and term counts per category.
+        self.class_documents = Counter()
+        self.class_terms = {}
+        # Keyword vocabulary: how often a phrase occurred in a document and how often the LLM picked it.
+        self.phrase_documents = Counter()
+        self.phrase_picked = Counter()
+        self.spellings = {}
+        self.answers = {"keywords": Counter(), "category": Counter()}
+        # Shadow scoring: how often a candidate category matched the LLM's answer for the same document,
+        # and what share of the local keywords were among the LLM's keywords.
+        self.shadow = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def _terms(self, words):
+        return Counter(word for word in words if word not in _STOPWORDS and len(word) > 2 and not word.isdigit())
+
+    def learn(self, text, category=None, keywords=None):
+        if category in HR_CATEGORIES:
+            # Scored before learning, so the document never grades a prediction it trained.
+            predicted, confidence = self.category(text)
+            if predicted is not None and confidence >= self.category_threshold:
+                with self._lock:
+                    self.shadow["candidates"] += 1
+                    self.shadow["agreed"] += predicted == category
+        if keywords:
+            local = self.keywords(text)
+            if local is not None:
+                overlap = {normalize_phrase(keyword) for keyword in local} & set(map(normalize_phrase, keywords))
+                with self._lock:
+                    self.shadow["keyword_candidates"] += 1
+                    self.shadow["keyword_overlap"] += len(overlap) / len(local)
+        words = tokenize(text)
+        with self._lock:
+            self.documents += 1
+            if category in HR_CATEGORIES:
+                self.class_documents[category] += 1
+                self.class_terms.setdefault(category, Counter()).update(self._terms(words))
+            if keywords:
+                ngrams = _ngrams(words)
+                spellings = {normalize_phrase(keyword): keyword for keyword in keywords}
+                picked = spellings.keys() & ngrams.keys()
+                self.phrase_picked.update(picked)
+                self.spellings.update((phrase, spellings[phrase]) for phrase in picked)
+                known = [phrase for phrase in ngrams if phrase in self.phrase_picked]
+                self.phrase_documents.update(known)
+
+    def category(self, text):
+        with self._lock:
+            if self.documents < self.min_documents or len(self.class_documents) < 2:
+                return None, 0.0
+            categories = list(self.class_documents)
+            doc_terms = self._terms(tokenize(text))
+            vocabulary = set().union(*(self.class_terms[category] for category in categories))
+            doc_terms = {term: count for term, count in doc_terms.items() if term in vocabulary}
+            if not doc_terms:
+                return None, 0.0
+            terms = list(doc_terms)
+            counts = np.array([[self.class_terms[category].get(term, 0) for term in terms] for category in categories],
+                              dtype=float)
+            totals = np.array([sum(self.class_terms[category].values()) for category in categories], dtype=float)
+            priors = np.array([self.class_documents[category] for category in categories], dtype=float)
+
+        # Multinomial naive Bayes with Laplace smoothing, normalised to a posterior probability.
+        log_likelihood = np.log((counts + 1) / (totals + len(vocabulary))[:, None])
+        scores = np.log(priors / priors.sum()) + log_likelihood @ np.array([doc_terms[term] for term in terms])
+        posterior = np.exp(scores - scores.max())
+        posterior /= posterior.sum()
+        best = int(posterior.argmax())
+        return categories[best], float(posterior[best])
+
+    def keywords(self, text, limit=5):
+        with self._lock:
+            if self.documents < self.min_documents:
+                return None
+            ngrams = _ngrams(tokenize(text))
+            candidates = [phrase for phrase in ngrams if self.phrase_picked.get(phrase)]
+            if len(candidates) < limit:
+                return None
+            picked = np.array([self.phrase_picked[phrase] for phrase in candidates], dtype=float)
+            seen = np.array([max(self.phrase_documents[phrase], self.phrase_picked[phrase]) for phrase in candidates],
+                            dtype=float)
+            tf = np.array([ngrams[phrase] for phrase in candidates], dtype=float)
+            idf = np.log((self.documents + 1) / (seen + 1)) + 1
+
+        # The selection rate only ranks candidates: documents are counted for a phrase after the LLM first
+        # picked it, so it overestimates how often the LLM picks the phrase.
+        selection_rate = picked / seen
+        scores = selection_rate * tf * idf
+        top = np.argsort(-scores, kind="stable")[:limit]
+        return [self.spellings.get(candidates[i], candidates[i]) for i in top]
+
+    def agreement(self):
+        """Measured share of candidate categories that matched the LLM, or None until enough are scored."""
+        with self._lock:
+            if self.shadow["candidates"] < self.shadow_documents:
+                return None
+            return self.shadow["agreed"] / self.shadow["candidates"]
+
+    def keyword_overlap(self):
+        """Measured share of local keywords that the LLM also picked, or None until enough are scored."""
+        with self._lock:
+            if self.shadow["keyword_candidates"] < self.shadow_documents:
+                return None
+            return self.shadow["keyword_overlap"] / self.shadow["keyword_candidates"]
+
+    def answer_category(self, text):
+        # The naive Bayes posterior is overconfident, so it only picks candidates; whether candidates
+        # are answered locally depends on how often they matched the LLM.
+        category, confidence = self.category(text)
+        agreement = self.agreement()
+        source = "llm"
+        if category is not None and confidence >= self.category_threshold and agreement is not None \
+                and agreement >= self.category_agreement and self._random.random() >= self.shadow_rate:
+            source = "local"
+        with self._lock:
+            self.answers["category"][source] += 1
+        return category if source == "local" else None
+
+    def answer_keywords(self, text):
+        keywords = self.keywords(text)
+        overlap = self.keyword_overlap()
+        source = "llm"
+        if keywords is not None and overlap is not None and overlap >= self.keyword_agreement \
+                and self._random.random() >= self.shadow_rate:
+            source = "local"
+        with self._lock:
+            self.answers["keywords"][source] += 1
+        return keywords if source == "local" else None
+
+    def stats(self):
+        local = sum(answers["local"] for answers in self.answers.values())
+        total = sum(sum(answers.values()) for answers in self.answers.values())
+        return {"documents": self.documents,
+                "keywords": dict(self.answers["keywords"]), "category": dict(self.answers["category"]),
+                "category_agreement": self.agreement(), "keyword_overlap": self.keyword_overlap(),
+                "avoided_fraction": local / total if total else 0.0}
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        self.documents = data["documents"]
+        self.class_documents = Counter(data["class_documents"])
+        self.class_terms = {category: Counter(terms) for category, terms in data["class_terms"].items()}
+        self.phrase_documents = Counter(data["phrase_documents"])
+        self.phrase_picked = Counter(data["phrase_picked"])
+        self.spellings = data["spellings"]
+        self.shadow = Counter(data.get("shadow", {}))
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {"documents": self.documents, "class_documents": self.class_documents,
+                    "class_terms": self.class_terms, "phrase_documents": self.phrase_documents,
+                    "phrase_picked": self.phrase_picked, "spellings": self.spellings, "shadow": self.shadow}
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+
+def create_local_tier():
+    if not LOCAL_TIER_ENABLED:
+        return None
+    return LocalTier(LOCAL_TIER_PATH)
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from utils import sanitize_filename
+from config import MANIFEST_ENABLED, MANIFEST_DIR, PROMPT_VERSION, OPENAI_MODEL, MODEL_ROUTES, MODEL_FALLBACK
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def model_signature(model=OPENAI_MODEL, routes=MODEL_ROUTES, fallback=MODEL_FALLBACK):
+    # Results depend on every routed model, so changing a route reprocesses documents as a model change does.
+    if not routes and not fallback:
+        return model
+    routing = json.dumps({"routes": routes, "fallback": fallback}, sort_keys=True).encode("utf-8")
+    return f"{model}+{content_hash(routing)[:12]}"
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Append-only record of processed files, so re-runs skip documents that have not changed."""
+
+    def __init__(self, directory, prompt_version=PROMPT_VERSION, model=None):
+        self.path = os.path.join(directory, "manifest.jsonl")
+        self.results_dir = os.path.join(directory, "results")
+        self.prompt_version = prompt_version
+        self.model = model or model_signature()
+        self.entries = {}
+        self.skipped = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.results_dir, exist_ok=True)
+        if os.path.exists(self.path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash while appending leaves at most one torn line behind.
+                    logger.warning(f"Ignoring incomplete manifest line in {self.path}")
+                    continue
+                self.entries[entry["filename"]] = entry
+
+    def lookup(self, filename, digest):
+        entry = self.entries.get(filename)
+        if (entry is None or entry["content_hash"] != digest or entry["prompt_version"] != self.prompt_version
+                or entry["model"] != self.model or not os.path.exists(entry["output"])):
+            return None
+        with open(entry["output"], encoding="utf-8") as f:
+            document_json = f.read()
+        if document_json.startswith("["):
+            document_json = json.loads(document_json)
+        self.skipped += 1
+        logger.info(f"{filename} is unchanged since {entry['output']} was written, skipping")
+        return document_json
+
+    def record(self, filename, digest, document_json):
+        output = os.path.join(self.results_dir, f"{digest[:16]}_{sanitize_filename(filename)}.json")
+        entry = {"filename": filename, "content_hash": digest, "prompt_version": self.prompt_version,
+                 "model": self.model, "output": output}
+        with self._lock:
+            tmp_path = f"{output}.tmp"
+            # A sectioned document is stored as a JSON list of the JSON of its sections.
+            data = document_json if isinstance(document_json, str) else json.dumps(document_json, ensure_ascii=False)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, output)
+            # The result is on disk before its manifest line, so every recorded entry can be reused.
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries[filename] = entry
+
+
+def get_manifest():
+    if not MANIFEST_ENABLED:
+        return None
+    return Manifest(MANIFEST_DIR)
@@ -0,0 +1,144 @@
+import asyncio
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from config import LOG_PAYLOADS
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def _token_count(value):
+    return value if isinstance(value, int) else 0
+
+
+def _cached_tokens(usage):
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        return _token_count(details.get("cached_tokens"))
+    return _token_count(getattr(details, "cached_tokens", None))
+
+
+class Metrics:
+    """Wall time per stage and OpenAI token usage, exported as JSON or Prometheus text."""
+
+    def __init__(self):
+        self.stages = {}
+        self.tokens = {"prompt": 0, "completion": 0, "cached": 0}
+        self.api_calls = 0
+        self.models = {}
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            timing = self.stages.setdefault(stage, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            timing["count"] += 1
+            timing["seconds"] += seconds
+            timing["max_seconds"] = max(timing["max_seconds"], seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def record_usage(self, usage, model=None):
+        if usage is None:
+            return
+        prompt = _token_count(getattr(usage, "prompt_tokens", None))
+        completion = _token_count(getattr(usage, "completion_tokens", None))
+        with self._lock:
+            self.api_calls += 1
+            self.tokens["prompt"] += prompt
+            self.tokens["completion"] += completion
+            self.tokens["cached"] += _cached_tokens(usage)
+            if model is not None:
+                # Per model, so the cost of routing tasks to smaller models can be compared.
+                totals = self.models.setdefault(model, {"calls": 0, "prompt": 0, "completion": 0})
+                totals["calls"] += 1
+                totals["prompt"] += prompt
+                totals["completion"] += completion
+
+    def record_fallback(self):
+        with self._lock:
+            self.fallbacks += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {"stages": {stage: dict(timing) for stage, timing in self.stages.items()},
+                    "tokens": dict(self.tokens), "api_calls": self.api_calls,
+                    "models": {model: dict(totals) for model, totals in self.models.items()},
+                    "fallbacks": self.fallbacks}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        lines = ["# TYPE hr_stage_seconds summary"]
+        for stage, timing in sorted(snapshot["stages"].items()):
+            lines.append(f'hr_stage_seconds_count{{stage="{stage}"}} {timing["count"]}')
+            lines.append(f'hr_stage_seconds_sum{{stage="{stage}"}} {timing["seconds"]:.6f}')
+        lines.append("# TYPE hr_stage_seconds_max gauge")
+        for stage, timing in sorted(snapshot["stages"].items()):
+            lines.append(f'hr_stage_seconds_max{{stage="{stage}"}} {timing["max_seconds"]:.6f}')
+        lines.append("# TYPE hr_openai_tokens_total counter")
+        for kind, count in snapshot["tokens"].items():
+            lines.append(f'hr_openai_tokens_total{{type="{kind}"}} {count}')
+        lines.append("# TYPE hr_openai_calls_total counter")
+        lines.append(f"hr_openai_calls_total {snapshot['api_calls']}")
+        lines.append("# TYPE hr_openai_model_tokens_total counter")
+        for model, totals in sorted(snapshot["models"].items()):
+            for kind in ("prompt", "completion"):
+                lines.append(f'hr_openai_model_tokens_total{{model="{model}",type="{kind}"}} {totals[kind]}')
+        lines.append("# TYPE hr_openai_model_fallbacks_total counter")
+        lines.append(f"hr_openai_model_fallbacks_total {snapshot['fallbacks']}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        content = self.to_prometheus() if path.endswith((".prom", ".txt")) else self.to_json()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+
+def get_metrics():
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+        return _metrics
+
+
+def timed(stage=None):
+    def decorator(func):
+        # Sync and async variants of an analysis share one stage.
+        name = stage or func.__name__.removesuffix("_async")
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with get_metrics().timer(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_metrics().timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def log_payload(logger, label, payload, limit=100):
+    # Document text is only formatted when LOG_PAYLOADS is on and the logger emits DEBUG records.
+    if LOG_PAYLOADS and logger.isEnabledFor(logging.DEBUG):
+        if limit is not None:
+            payload = payload[:limit].encode("unicode_escape").decode("utf-8")
+        logger.debug("%s: %s", label, payload)
@@ -0,0 +1,177 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+import zipfile
+import httpx
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_exponential
+from metrics import get_metrics
+from utils import result_files
+from config import (PEACH_URL, PEACH_API_KEY, PEACH_BATCH_SIZE, PEACH_MAX_ATTEMPTS, PEACH_RETRY_BACKOFF,
+                    PEACH_TIMEOUT, LOG_LEVEL)
+
+logger = logging.getLogger(__name__)
+
+_RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+def _retryable(error):
+    if isinstance(error, httpx.TransportError):
+        return True
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code in _RETRY_STATUSES
+
+
+def idempotency_key(name, document_json):
+    # The same document always gets the same key, whichever batch it is sent in, so Peach can drop
+    # documents it already imported when a retry or a rerun sends them again.
+    return hashlib.sha256(f"{name}\n{document_json}".encode("utf-8")).hexdigest()
+
+
+def to_ndjson(documents):
+    # One compact JSON document per line; the result files themselves are formatted for reading.
+    lines = []
+    for name, document_json in documents:
+        document = json.loads(document_json)
+        document["idempotency_key"] = idempotency_key(name, document_json)
+        lines.append(json.dumps(document, ensure_ascii=False, separators=(",", ":")) + "\n")
+    return "".join(lines).encode("utf-8")
+
+
+class PeachClient:
+    """Posts NDJSON batches to the Peach bulk import endpoint over one keep-alive HTTP session."""
+
+    def __init__(self, url, api_key=None, max_attempts=PEACH_MAX_ATTEMPTS, backoff=PEACH_RETRY_BACKOFF,
+                 timeout=PEACH_TIMEOUT):
+        headers = {"Content-Type": "application/x-ndjson"}
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        self.url = url
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.attempts = 0
+        self._http = httpx.Client(headers=headers, timeout=timeout)
+
+    def send(self, body):
+        retrying = Retrying(stop=stop_after_attempt(self.max_attempts), retry=retry_if_exception(_retryable),
+                            wait=wait_exponential(multiplier=self.backoff, max=30), reraise=True)
+        for attempt in retrying:
+            with attempt:
+                self.attempts += 1
+                response = self._http.post(self.url, content=body)
+                response.raise_for_status()
+
+    def close(self):
+        self._http.close()
+
+
+class PeachWriter:
+    """Result writer that exports documents to Peach in NDJSON batches as they finish."""
+
+    def __init__(self, client, batch_size=PEACH_BATCH_SIZE):
+        self.client = client
+        self.batch_size = batch_size
+        self.documents = 0
+        self.batches = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.failed = []
+        self.failed_batches = 0
+        self._batch = []
+
+    def write(self, filename, document_json):
+        for name, data in result_files(filename, document_json):
+            self._batch.append((name, data))
+            if len(self._batch) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        body = to_ndjson(batch)
+        start = time.perf_counter()
+        try:
+            with get_metrics().timer("peach"):
+                self.client.send(body)
+        except httpx.HTTPError as e:
+            # The batch is reported instead of raised, so one failed request does not stop the run.
+            logger.error(f"Peach import of {len(batch)} documents failed: {str(e)}")
+            self.failed.extend(name for name, _ in batch)
+            self.failed_batches += 1
+            return
+        finally:
+            self.seconds += time.perf_counter() - start
+        self.documents += len(batch)
+        self.batches += 1
+        self.bytes += len(body)
+        logger.info(f"Exported {len(batch)} documents to Peach ({self.documents} in total)")
+
+    def close(self):
+        self.flush()
+        self.client.close()
+
+    def stats(self):
+        return {"documents": self.documents, "batches": self.batches, "bytes": self.bytes,
+                "failed": len(self.failed),
+                "retries": self.client.attempts - self.batches - self.failed_batches,
+                "docs_per_sec": self.documents / self.seconds if self.seconds else 0.0}
+
+
+def create_peach_writer(url=PEACH_URL, api_key=PEACH_API_KEY, batch_size=PEACH_BATCH_SIZE):
+    if not url:
+        return None
+    return PeachWriter(PeachClient(url, api_key), batch_size)
+
+
+def iter_results(source):
+    """Yields (name, document JSON) from an output directory or ZIP file of an earlier run."""
+    if source.lower().endswith(".zip"):
+        with zipfile.ZipFile(source) as archive:
+            for name in sorted(archive.namelist()):
+                if name.endswith(".json"):
+                    yield name[:-len(".json")], archive.read(name).decode("utf-8")
+        return
+    # Results of a run over nested input folders are written to the same subfolders.
+    for directory, subdirectories, filenames in os.walk(source):
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            if filename.endswith(".json"):
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, source).replace(os.sep, "/")
+                with open(path, encoding="utf-8") as f:
+                    yield name[:-len(".json")], f.read()
+
+
+def export_results(source, writer):
+    for name, document_json in iter_results(source):
+        writer.write(name, document_json)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importer resultater fra en tidligere kjøring til Peach.")
+    parser.add_argument("source", help="Output directory or ZIP file with document JSON files")
+    parser.add_argument("--url", default=PEACH_URL, help="Peach bulk import endpoint (default: PEACH_URL)")
+    parser.add_argument("--api-key", default=PEACH_API_KEY)
+    parser.add_argument("--batch-size", type=int, default=PEACH_BATCH_SIZE)
+    args = parser.parse_args(argv)
+    if not args.url:
+        parser.error("a Peach import URL is required (--url or PEACH_URL)")
+    logging.basicConfig(stream=sys.stderr, level=getattr(logging, LOG_LEVEL),
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    writer = create_peach_writer(args.url, args.api_key, args.batch_size)
+    try:
+        export_results(args.source, writer)
+    finally:
+        writer.close()
+    stats = writer.stats()
+    print(f"Exported {stats['documents']} documents in {stats['batches']} batches "
+          f"({stats['docs_per_sec']:.0f} documents/s), {stats['retries']} retries, {stats['failed']} failed")
+    return 0 if not stats["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
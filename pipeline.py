@@ -0,0 +1,174 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from document_processor import read_file_text, structure_document_async
+from file_handlers import LocalFile
+from manifest import content_hash, file_hash
+from metrics import get_metrics
+from text_processing import detect_language
+from config import MAX_CONCURRENT_FILES, PIPELINE_PARSE_WORKERS, PIPELINE_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class InMemoryFile(io.BytesIO):
+    """Uploaded file contents with the name/type/size attributes document_processor expects."""
+
+    def __init__(self, data, name, type):
+        super().__init__(data)
+        self.name = name
+        self.type = type
+        self.size = len(data)
+
+
+def parse_document(name, mime_type, source):
+    # Runs in a worker process: source is either a path on disk or the file contents.
+    if isinstance(source, bytes):
+        text = read_file_text(InMemoryFile(source, name, mime_type))
+    else:
+        with LocalFile(source) as file:
+            text = read_file_text(file)
+    if not text.strip():
+        return None, None
+    return text, detect_language(text)
+
+
+class Pipeline:
+    """Parse (process pool), analysis (asyncio) and write stages connected by bounded queues."""
+
+    def __init__(self, client, writer, parse_workers=PIPELINE_PARSE_WORKERS,
+                 analysis_workers=MAX_CONCURRENT_FILES, queue_size=PIPELINE_QUEUE_SIZE, on_result=None,
+                 dedup_index=None, manifest=None, budget=None, local_tier=None):
+        self.client = client
+        self.writer = writer
+        self.parse_workers = parse_workers
+        self.analysis_workers = analysis_workers
+        self.queue_size = queue_size
+        self.on_result = on_result
+        self.dedup_index = dedup_index
+        self.manifest = manifest
+        self.budget = budget
+        self.local_tier = local_tier
+        self._digests = {}
+        self.stats = {"processed": 0, "skipped": 0, "failed": 0, "elapsed": 0.0}
+
+    def _failed(self, name, reason):
+        logger.error(f"Error processing file {name}: {reason}")
+        self.stats["failed"] += 1
+        if self.on_result:
+            self.on_result(name, None)
+
+    async def _skip_unchanged(self, name, source, write_queue):
+        try:
+            digest = await asyncio.to_thread(content_hash if isinstance(source, bytes) else file_hash, source)
+        except OSError:
+            return False
+        document_json = self.manifest.lookup(name, digest)
+        if document_json is None:
+            self._digests[name] = digest
+            return False
+        self.stats["skipped"] += 1
+        await write_queue.put((name, document_json, True))
+        return True
+
+    async def _feed(self, items, parse_queue, write_queue):
+        for item in items:
+            name, _, source = item
+            if self.manifest is not None and await self._skip_unchanged(name, source, write_queue):
+                continue
+            await parse_queue.put(item)
+        for _ in range(self.parse_workers):
+            await parse_queue.put(_DONE)
+
+    async def _parse(self, executor, parse_queue, analysis_queue):
+        loop = asyncio.get_running_loop()
+        while (item := await parse_queue.get()) is not _DONE:
+            name, mime_type, source = item
+            try:
+                # Measured here because the worker processes have their own metrics; includes langdetect.
+                with get_metrics().timer("parse"):
+                    text, lang = await loop.run_in_executor(executor, parse_document, name, mime_type, source)
+            except Exception as e:
+                self._failed(name, str(e))
+                continue
+            if text is None:
+                self._failed(name, "file is empty or contains only whitespace")
+                continue
+            await analysis_queue.put((name, text, lang))
+
+    async def _analyse(self, analysis_queue, write_queue):
+        while (item := await analysis_queue.get()) is not _DONE:
+            name, text, lang = item
+            fallbacks = []
+            try:
+                document_json = await structure_document_async(text, self.client, name, lang=lang,
+                                                               dedup_index=self.dedup_index, budget=self.budget,
+                                                               local_tier=self.local_tier,
+                                                               on_fallback=lambda _, names: fallbacks.extend(names))
+            except Exception as e:
+                # A dead analysis worker would leave the queues full and the pipeline waiting forever.
+                self._failed(name, str(e))
+                continue
+            if document_json is None:
+                self._failed(name, "no content was generated")
+                continue
+            await write_queue.put((name, document_json, not fallbacks))
+
+    async def _write(self, write_queue):
+        while (item := await write_queue.get()) is not _DONE:
+            name, document_json, complete = item
+            digest = self._digests.pop(name, None)
+            try:
+                await asyncio.to_thread(self.writer.write, name, document_json)
+                # Results with fields missing after API errors stay out of the manifest, so the next run redoes them.
+                if self.manifest is not None and digest is not None and complete:
+                    await asyncio.to_thread(self.manifest.record, name, digest, document_json)
+                self.stats["processed"] += 1
+                if self.on_result:
+                    self.on_result(name, document_json)
+            except Exception as e:
+                self._failed(name, f"could not write result: {str(e)}")
+
+    async def _close(self, tasks, queue, count):
+        # Signals the next stage once every task of this one has finished.
+        await asyncio.gather(*tasks)
+        for _ in range(count):
+            await queue.put(_DONE)
+
+    async def run(self, items):
+        start_time = time.time()
+        parse_queue = asyncio.Queue(self.queue_size)
+        analysis_queue = asyncio.Queue(self.queue_size)
+        write_queue = asyncio.Queue(self.queue_size)
+
+        with ProcessPoolExecutor(max_workers=self.parse_workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            feeder = asyncio.create_task(self._feed(items, parse_queue, write_queue))
+            parsers = [asyncio.create_task(self._parse(executor, parse_queue, analysis_queue))
+                       for _ in range(self.parse_workers)]
+            analysers = [asyncio.create_task(self._analyse(analysis_queue, write_queue))
+                         for _ in range(self.analysis_workers)]
+            writer = asyncio.create_task(self._write(write_queue))
+            tasks = [feeder, *parsers, *analysers, writer,
+                     asyncio.create_task(self._close([feeder, *parsers], analysis_queue, len(analysers))),
+                     asyncio.create_task(self._close(analysers, write_queue, 1))]
+
+            try:
+                # Any stage that dies fails the run, instead of leaving the others waiting on full queues.
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    if task.exception() is not None:
+                        raise task.exception()
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+
+        self.stats["elapsed"] = time.time() - start_time
+        logger.info(f"Pipeline finished: {self.stats}")
+        return self.stats
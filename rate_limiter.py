@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+import re
+import threading
+import time
+from config import RATE_LIMIT_RPM, RATE_LIMIT_TPM, RATE_LIMITS
+
+logger = logging.getLogger(__name__)
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+_limiters = {}
+_limiter_lock = threading.Lock()
+
+
+def parse_duration(value):
+    # OpenAI reset headers look like "20ms", "1s" or "6m0s".
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def estimate_tokens(messages, max_tokens):
+    # Same rough estimate OpenAI uses for rate limiting: ~4 characters per prompt token plus max_tokens.
+    prompt_chars = sum(len(message.get("content") or "") for message in messages)
+    return prompt_chars // 4 + max_tokens
+
+
+class TokenBucket:
+    """Bucket that refills continuously up to a per-minute capacity."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.available = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0
+        return (amount - self.available) / self.rate
+
+
+class RateLimiter:
+    """Client-side request and token budgets shared by every OpenAI call to one model in the process."""
+
+    def __init__(self, requests_per_minute=RATE_LIMIT_RPM, tokens_per_minute=RATE_LIMIT_TPM, model=None):
+        self.model = model
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.paused_until = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens):
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if wait > 0:
+                return wait
+            self.requests.available -= 1
+            self.tokens.available -= min(tokens, self.tokens.capacity)
+            return 0
+
+    def acquire_sync(self, tokens):
+        while True:
+            wait = self._reserve(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire(self, tokens):
+        while True:
+            wait = self._reserve(tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def update_from_headers(self, headers):
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        retry_after = parse_duration(headers.get("retry-after-ms"))
+        retry_after = retry_after / 1000 if retry_after is not None else parse_duration(headers.get("retry-after"))
+
+        with self._lock:
+            now = time.monotonic()
+            for bucket, remaining, reset in ((self.requests, remaining_requests, "x-ratelimit-reset-requests"),
+                                             (self.tokens, remaining_tokens, "x-ratelimit-reset-tokens")):
+                if remaining is None:
+                    continue
+                bucket.refill(now)
+                bucket.available = min(bucket.available, float(remaining))
+                reset_after = parse_duration(headers.get(reset))
+                if float(remaining) <= 0 and reset_after:
+                    self.paused_until = max(self.paused_until, now + reset_after)
+            if retry_after is not None:
+                self.paused_until = max(self.paused_until, now + retry_after)
+                logger.warning(f"Rate limited by OpenAI, pausing calls to {self.model or 'the model'} "
+                               f"for {retry_after:.2f}s")
+
+    def on_response(self, response):
+        self.update_from_headers(response.headers)
+
+    async def on_response_async(self, response):
+        self.update_from_headers(response.headers)
+
+
+def rate_limiting_enabled():
+    return RATE_LIMIT_RPM is not None and RATE_LIMIT_TPM is not None
+
+
+def get_rate_limiter(model):
+    # OpenAI's request and token limits apply to each model separately.
+    if not rate_limiting_enabled():
+        return None
+    with _limiter_lock:
+        if model not in _limiters:
+            requests_per_minute, tokens_per_minute = RATE_LIMITS.get(model, (RATE_LIMIT_RPM, RATE_LIMIT_TPM))
+            _limiters[model] = RateLimiter(requests_per_minute, tokens_per_minute, model)
+        return _limiters[model]
+
+
+def _request_model(request):
+    try:
+        return json.loads(request.content).get("model")
+    except (ValueError, AttributeError):
+        # Not a JSON request body, e.g. a Batch API file upload.
+        return None
+
+
+def on_response(response):
+    """httpx response hook that applies the rate limit headers to the limiter of the model that was called."""
+    model = _request_model(response.request)
+    limiter = get_rate_limiter(model) if model is not None else None
+    if limiter is not None:
+        limiter.update_from_headers(response.headers)
+
+
+async def on_response_async(response):
+    on_response(response)
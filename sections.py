@@ -0,0 +1,97 @@
+import re
+from chunking import iter_sentences
+from text_processing import is_complete_sentence
+from config import SECTION_MAX_CHARS, SECTION_MIN_CHARS
+
+_LINE = re.compile(r"[^\n]*\n?")
+_MARKDOWN_HEADING = re.compile(r"#{1,6}\s+\S")
+# "3.2", "3.2.1.", "§ 4", "Kapittel 2" or "Del II" followed by the clause text.
+_CLAUSE = re.compile(r"(§\s*\d+[a-z]?|(?:kapittel|del|artikkel)\s+[\dIVXLC]+|\d+(?:\.\d+)+\.?)\s+\S", re.IGNORECASE)
+# Paragraph signs and multi-level numbers ("3.2") are clause numbers wherever they appear.
+_CLAUSE_NUMBER = re.compile(r"§|\d+\.\d")
+# "3", "3." or "A." before a title; on its own a number is as likely to start a sentence ("2024 var ...").
+_LIST_NUMBER = re.compile(r"(?:\d+\.?|[A-ZÆØÅ]\.)\s+(?=\S)")
+_HEADING_MAX_CHARS = 80
+_HEADING_MAX_WORDS = 8
+
+
+def heading_of(line, at_boundary):
+    """Returns the heading a line starts a new section with, or None for ordinary body text."""
+    line = line.strip()
+    if not line:
+        return None
+    if _MARKDOWN_HEADING.match(line):
+        return line.lstrip("#").strip()
+    # Wrapped PDF lines also lack end punctuation and may start with a number ("1. januar"), so
+    # only clauses and headings that follow a blank line or a finished sentence start a section.
+    match = _CLAUSE.match(line)
+    if match and (at_boundary or _CLAUSE_NUMBER.match(match.group(1))):
+        # A long numbered clause starts a section, but only its number is a useful title.
+        return line if len(line) <= _HEADING_MAX_CHARS else match.group(1).rstrip(".")
+    if not at_boundary:
+        return None
+    number = _LIST_NUMBER.match(line)
+    title = line[number.end():] if number else line
+    if len(line) <= _HEADING_MAX_CHARS and title[0].isupper() and len(title.split()) <= _HEADING_MAX_WORDS \
+            and not re.search(r"[.,;:!?]$", line):
+        return line
+    return None
+
+
+def iter_blocks(text):
+    heading, lines = None, []
+    at_boundary = True
+    for match in _LINE.finditer(text):
+        line = match.group()
+        if not line:
+            break
+        line_heading = heading_of(line, at_boundary)
+        if line_heading is not None and any(existing.strip() for existing in lines):
+            yield heading, "".join(lines).strip()
+            lines = []
+        if line_heading is not None:
+            heading = line_heading
+        lines.append(line)
+        at_boundary = not line.strip() or is_complete_sentence(line) or line_heading is not None
+    body = "".join(lines).strip()
+    if body:
+        yield heading, body
+
+
+def _pack_sentences(body, max_chars):
+    current, size = [], 0
+    for sentence in iter_sentences(body):
+        for start in range(0, len(sentence), max_chars):
+            piece = sentence[start:start + max_chars]
+            if current and size + len(piece) + 1 > max_chars:
+                yield " ".join(current)
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece) + 1
+    if current:
+        yield " ".join(current)
+
+
+def split_sections(text, max_chars=SECTION_MAX_CHARS, min_chars=SECTION_MIN_CHARS):
+    """Yields (heading, body) sections split at headings and numbered clauses.
+
+    Blocks shorter than min_chars are merged into the next one, and blocks longer than
+    max_chars are split at sentence boundaries, so every section fits in one prompt.
+    """
+    heading, body = None, ""
+    for block_heading, block in iter_blocks(text):
+        if body and (len(body) >= min_chars or len(body) + len(block) + 2 > max_chars):
+            yield from _emit(heading, body, max_chars)
+            heading, body = None, ""
+        heading = heading if heading is not None else block_heading
+        body = f"{body}\n\n{block}" if body else block
+    if body:
+        yield from _emit(heading, body, max_chars)
+
+
+def _emit(heading, body, max_chars):
+    if len(body) <= max_chars:
+        yield heading, body
+        return
+    for piece in _pack_sentences(body, max_chars):
+        yield heading, piece
@@ -0,0 +1,26 @@
+import pytest
+import hr_openai_utils
+import local_tier
+import manifest
+import response_cache
+
+
+@pytest.fixture(autouse=True)
+def disable_response_cache(monkeypatch):
+    monkeypatch.setattr(response_cache, "CACHE_ENABLED", False)
+
+
+@pytest.fixture(autouse=True)
+def disable_manifest(monkeypatch):
+    monkeypatch.setattr(manifest, "MANIFEST_ENABLED", False)
+
+
+@pytest.fixture(autouse=True)
+def disable_local_tier(monkeypatch):
+    monkeypatch.setattr(local_tier, "LOCAL_TIER_ENABLED", False)
+
+
+@pytest.fixture(autouse=True)
+def disable_model_fallback(monkeypatch):
+    # Fake servers answer every task the same way, which would fail validation and double the calls.
+    monkeypatch.setattr(hr_openai_utils, "MODEL_FALLBACK", None)
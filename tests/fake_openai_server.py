@@ -0,0 +1,273 @@
+import email
+import email.policy
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    # The default listen backlog of 5 drops connections under concurrent load, which the
+    # client only recovers from after a one-second SYN retransmit.
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class FakeOpenAIServer:
+    """Local stand-in for the OpenAI chat completions endpoint."""
+
+    def __init__(self, reply="OK", latency=0.0, rate_limit_first=0, rate_limit_rate=0.0, retry_after=0.1,
+                 requests_per_minute=500, seed=0, connect_latency=0.0, token_latency=0.0):
+        self.reply = reply
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.token_latency = token_latency
+        self.rate_limit_first = rate_limit_first
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.requests_per_minute = requests_per_minute
+        self.requests = []
+        self.connections = set()
+        self.rate_limited = 0
+        self.streamed_chunks = 0
+        self.aborted_streams = 0
+        self.files = {}
+        self.batches = {}
+        self.batch_polls_until_complete = 1
+        self._prefixes = set()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = _HTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    @property
+    def request_count(self):
+        with self._lock:
+            return len(self.requests)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _should_rate_limit(self):
+        with self._lock:
+            if len(self.requests) <= self.rate_limit_first or self._random.random() < self.rate_limit_rate:
+                self.rate_limited += 1
+                return True
+            return False
+
+    @staticmethod
+    def _prefix(body):
+        return json.dumps(body.get("messages", [])[:-1], ensure_ascii=False)
+
+    def _is_cached(self, body):
+        with self._lock:
+            return self._prefix(body) in self._prefixes
+
+    def _cache(self, body):
+        # Like the real cache, a prefix is only reusable once a request that sent it has completed,
+        # so requests sent at the same time all pay for it.
+        with self._lock:
+            self._prefixes.add(self._prefix(body))
+
+    def _usage(self, body, cached):
+        # Mimics automatic prompt caching: a cached prefix of at least 1024 tokens is reported in
+        # 128-token steps (about four characters per token).
+        messages = body.get("messages", [])
+        prompt_tokens = sum(len(message.get("content") or "") for message in messages) // 4 + 1
+        prefix_tokens = len(self._prefix(body)) // 4
+        cached_tokens = prefix_tokens // 128 * 128 if cached and prefix_tokens >= 1024 else 0
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": 5, "total_tokens": prompt_tokens + 5,
+                "prompt_tokens_details": {"cached_tokens": min(cached_tokens, prompt_tokens)}}
+
+    def _completion(self, body, cached=False):
+        content = self.reply(body) if callable(self.reply) else self.reply
+        return {
+            "id": f"chatcmpl-{len(self.requests)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-2024-08-06"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": self._usage(body, cached)
+        }
+
+    def _stream_chunks(self, completion, body):
+        # Streams the reply word by word, then the usage when the client asked for it.
+        base = {key: completion[key] for key in ("id", "created", "model")}
+        base["object"] = "chat.completion.chunk"
+        for word in re.findall(r"\S+\s*", completion["choices"][0]["message"]["content"]):
+            yield dict(base, choices=[{"index": 0, "delta": {"content": word}, "finish_reason": None}])
+        yield dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield dict(base, choices=[], usage=completion["usage"])
+
+    def _upload_file(self, content_type, body):
+        message = email.message_from_bytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body,
+                                           policy=email.policy.HTTP)
+        fields = {part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+                  for part in message.iter_parts()}
+        file_id = f"file-{len(self.files) + 1}"
+        self.files[file_id] = fields["file"]
+        return {"id": file_id, "object": "file", "bytes": len(fields["file"]), "created_at": int(time.time()),
+                "filename": "requests.jsonl", "purpose": fields["purpose"].decode(), "status": "processed"}
+
+    def _create_batch(self, body):
+        batch_id = f"batch-{len(self.batches) + 1}"
+        self.batches[batch_id] = {"id": batch_id, "object": "batch", "endpoint": body["endpoint"],
+                                  "input_file_id": body["input_file_id"], "completion_window": "24h",
+                                  "created_at": int(time.time()), "status": "validating", "polls": 0,
+                                  "output_file_id": None, "errors": None}
+        # Like the real Batch API, an input file may only use one model and fails validation otherwise.
+        models = {json.loads(line)["body"]["model"]
+                  for line in self.files[body["input_file_id"]].decode("utf-8").splitlines() if line.strip()}
+        if len(models) > 1:
+            self.batches[batch_id].update(status="failed", errors={"object": "list", "data": [
+                {"code": "mismatched_model", "message": "Requests in a batch must use the same model."}]})
+        return self._batch_view(batch_id)
+
+    def _batch_view(self, batch_id):
+        return {key: value for key, value in self.batches[batch_id].items() if key != "polls"}
+
+    def _retrieve_batch(self, batch_id):
+        batch = self.batches[batch_id]
+        batch["polls"] += 1
+        if batch["status"] not in ("completed", "failed") and batch["polls"] >= self.batch_polls_until_complete:
+            lines = []
+            for line in self.files[batch["input_file_id"]].decode("utf-8").splitlines():
+                request = json.loads(line)
+                with self._lock:
+                    self.requests.append(request["body"])
+                completion = self._completion(request["body"], self._is_cached(request["body"]))
+                self._cache(request["body"])
+                lines.append(json.dumps({"id": f"resp-{len(lines)}", "custom_id": request["custom_id"],
+                                         "response": {"status_code": 200, "request_id": f"req-{len(lines)}",
+                                                      "body": completion},
+                                         "error": None}, ensure_ascii=False))
+            output_file_id = f"file-{len(self.files) + 1}"
+            self.files[output_file_id] = ("\n".join(lines) + "\n").encode("utf-8")
+            batch.update(status="completed", output_file_id=output_file_id)
+        elif batch["status"] == "validating":
+            batch["status"] = "in_progress"
+        return self._batch_view(batch_id)
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive like the real API, so clients can reuse their connections. Headers and body
+            # are separate writes, which Nagle's algorithm would hold back on a reused connection.
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                if fake.connect_latency:
+                    # Stands in for the TCP and TLS handshake with the remote API on every new connection.
+                    time.sleep(fake.connect_latency)
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, payload, headers=None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                parts = self.path.rstrip("/").split("/")
+                if parts[-2] == "batches":
+                    self._send_json(200, fake._retrieve_batch(parts[-1]))
+                elif parts[-1] == "content":
+                    data = fake.files[parts[-2]]
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                else:
+                    self._send_json(404, {"error": {"message": "Not found"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                raw_body = self.rfile.read(length)
+                if self.path.endswith("/files"):
+                    self._send_json(200, fake._upload_file(self.headers["Content-Type"], raw_body))
+                    return
+                body = json.loads(raw_body or b"{}")
+                if self.path.endswith("/batches"):
+                    self._send_json(200, fake._create_batch(body))
+                    return
+                with fake._lock:
+                    fake.requests.append(body)
+                    fake.connections.add(self.client_address)
+                    remaining = max(0, fake.requests_per_minute - len(fake.requests))
+                cached = fake._is_cached(body)
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if fake._should_rate_limit():
+                    self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                                    "code": "rate_limit_exceeded"}},
+                                    {"retry-after": str(fake.retry_after),
+                                     "x-ratelimit-remaining-requests": "0",
+                                     "x-ratelimit-reset-requests": f"{fake.retry_after}s"})
+                    return
+                headers = {"x-ratelimit-remaining-requests": str(remaining), "x-ratelimit-reset-requests": "120ms"}
+                if body.get("stream"):
+                    if self._send_stream(fake._completion(body, cached), body, headers):
+                        fake._cache(body)
+                else:
+                    self._send_json(200, fake._completion(body, cached), headers)
+                    fake._cache(body)
+
+            def _send_stream(self, completion, body, headers):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                try:
+                    for chunk in fake._stream_chunks(completion, body):
+                        if fake.token_latency:
+                            time.sleep(fake.token_latency)
+                        self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                        with fake._lock:
+                            fake.streamed_chunks += 1
+                    self._write_chunk(b"data: [DONE]\n\n")
+                    self._write_chunk(b"")
+                    return True
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client closed the stream, e.g. because its work was cancelled.
+                    self.close_connection = True
+                    with fake._lock:
+                        fake.aborted_streams += 1
+                    return False
+
+            def _write_chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
@@ -0,0 +1,79 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler
+from tests.fake_openai_server import _HTTPServer
+
+
+class FakePeachServer:
+    """Local stand-in for the Peach bulk import endpoint."""
+
+    def __init__(self, fail_first=0, fail_status=503):
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.requests = 0
+        self.batches = []
+        self.keys = set()
+        self.replayed = 0
+        self.connections = set()
+        self._lock = threading.Lock()
+        self._server = _HTTPServer(("127.0.0.1", 0), self._handler())
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/api/import"
+
+    @property
+    def documents(self):
+        return [document for batch in self.batches for document in batch]
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _import(self, body):
+        with self._lock:
+            self.requests += 1
+            if self.requests <= self.fail_first:
+                return self.fail_status, {"error": "unavailable"}
+            try:
+                documents = [json.loads(line) for line in body.decode("utf-8").splitlines()]
+            except ValueError:
+                return 400, {"error": "invalid NDJSON"}
+            # Documents that were already imported are acknowledged, not imported twice.
+            batch = [document for document in documents if document.get("idempotency_key") not in self.keys]
+            self.replayed += len(documents) - len(batch)
+            self.keys.update(document.get("idempotency_key") for document in batch)
+            if batch:
+                self.batches.append(batch)
+            return 200, {"imported": len(batch)}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with fake._lock:
+                    fake.connections.add(self.client_address)
+                if self.headers.get("Content-Type") != "application/x-ndjson":
+                    status, payload = 415, {"error": "expected NDJSON"}
+                else:
+                    status, payload = fake._import(body)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
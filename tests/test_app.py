@@ -0,0 +1,124 @@
+import asyncio
+import io
+import json
+import threading
+import time
+import zipfile
+from unittest.mock import AsyncMock, Mock, patch
+from openai import AsyncOpenAI
+import app
+from async_processors import run_async
+from hr_openai_utils import summarize_hr_text_async
+from jobs import Job, JobManager
+from manifest import Manifest, content_hash
+from tests.fake_openai_server import FakeOpenAIServer
+
+
+def make_file(name, size=100):
+    mock_file = Mock()
+    mock_file.name = name
+    mock_file.size = size
+    return mock_file
+
+
+def test_process_files_runs_concurrently_and_reports_in_completion_order():
+    in_flight = 0
+    max_in_flight = 0
+    delays = {"slow.txt": 0.05, "fast.txt": 0.0, "medium.txt": 0.02}
+
+    async def fake_process_file_async(file, client, **kwargs):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(delays[file.name])
+        in_flight -= 1
+        return json.dumps({"title": file.name})
+
+    files = [make_file(name) for name in delays]
+    job = Job("job", [file.name for file in files])
+
+    with patch('app.process_file_async', side_effect=fake_process_file_async), \
+         patch('app.get_async_client', return_value=AsyncMock()), \
+         patch('app.MAX_CONCURRENT_FILES', 2):
+        archive = asyncio.run(app.process_files(files, "key", job))
+
+    with zipfile.ZipFile(archive.close()) as zip_file:
+        assert sorted(zip_file.namelist()) == ["fast.txt.json", "medium.txt.json", "slow.txt.json"]
+        assert json.loads(zip_file.read("slow.txt.json")) == {"title": "slow.txt"}
+    assert max_in_flight == 2
+    assert job.document_titles == ["Fast", "Medium", "Slow"]
+    assert job.processed == 3
+
+
+def test_process_files_skips_oversized_files():
+    files = [make_file("big.txt", size=app.MAX_FILE_SIZE + 1)]
+
+    with patch('app.process_file_async') as mock_process, \
+         patch('app.get_async_client', return_value=AsyncMock()), \
+         patch('app.st'):
+        archive = asyncio.run(app.process_files(files, "key", Job("job", [])))
+
+    assert archive.count == 0
+    mock_process.assert_not_called()
+
+
+def test_process_files_skips_files_recorded_in_the_manifest(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    files = [make_file(name) for name in ("ferie.txt", "lønn.txt", "permisjon.txt")]
+    for file in files:
+        file.getvalue.return_value = file.name.encode("utf-8")
+    manifest.record("ferie.txt", content_hash(b"ferie.txt"), json.dumps({"title": "Ferie"}))
+
+    async def fake_process_file_async(file, client, on_fallback=None, **kwargs):
+        if file.name == "permisjon.txt":
+            on_fallback(file.name, ["summary"])
+        return json.dumps({"title": file.name})
+
+    with patch('app.process_file_async', side_effect=fake_process_file_async) as mock_process, \
+         patch('app.get_async_client', return_value=AsyncMock()), \
+         patch('app.get_manifest', return_value=manifest), \
+         patch('app.st'):
+        archive = asyncio.run(app.process_files(files, "key", Job("job", [])))
+
+    assert [call.args[0].name for call in mock_process.call_args_list] == ["lønn.txt", "permisjon.txt"]
+    with zipfile.ZipFile(archive.close()) as zip_file:
+        assert json.loads(zip_file.read("ferie.txt.json")) == {"title": "Ferie"}
+    assert "lønn.txt" in manifest.entries
+    assert "permisjon.txt" not in manifest.entries
+
+
+def test_cancelling_a_job_closes_the_summary_stream_and_keeps_finished_documents():
+    words = " ".join(["ord"] * 200)
+    streaming = threading.Event()
+
+    async def fake_process_file_async(file, client, on_field=None, **kwargs):
+        if file.name == "kort.txt":
+            return json.dumps({"title": file.name})
+
+        def on_delta(partial):
+            on_field(file.name, "summary", partial)
+            streaming.set()
+
+        return json.dumps({"summary": await summarize_hr_text_async("Tekst", client, on_delta=on_delta)})
+
+    files = [make_file(name) for name in ("kort.txt", "lang.txt")]
+    manager = JobManager(workers=1)
+    with FakeOpenAIServer(reply=words, token_latency=0.02) as server, \
+         patch('app.process_file_async', side_effect=fake_process_file_async), \
+         patch('app.get_async_client', side_effect=lambda key: AsyncOpenAI(api_key=key, base_url=server.url)), \
+         patch('hr_openai_utils.get_rate_limiter', return_value=None):
+        job = manager.submit("job", [file.name for file in files],
+                             lambda job: run_async(app.process_files(files, "key", job)))
+        assert streaming.wait(5)
+        assert job.snapshot()["partial"]["lang.txt"]["summary"].startswith("ord")
+        job.cancel()
+        for _ in range(500):
+            if not job.running and server.aborted_streams:
+                break
+            time.sleep(0.01)
+
+    assert job.state == "cancelled"
+    assert server.aborted_streams == 1
+    assert server.streamed_chunks < 200
+    with zipfile.ZipFile(io.BytesIO(job.read_result())) as zip_file:
+        assert zip_file.namelist() == ["kort.txt.json"]
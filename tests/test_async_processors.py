@@ -0,0 +1,37 @@
+import asyncio
+from async_processors import get_async_client, http_timeout, run_async
+from tests.fake_openai_server import FakeOpenAIServer
+
+MESSAGES = [{"role": "user", "content": "Hei"}]
+
+
+async def complete(url):
+    client = get_async_client("key", url)
+    await client.chat.completions.create(model="gpt-4o-2024-08-06", messages=MESSAGES, max_tokens=5)
+    return client
+
+
+def test_jobs_on_the_shared_loop_reuse_the_client_and_its_connections():
+    with FakeOpenAIServer(reply="OK") as server:
+        first = run_async(complete(server.url))
+        second = run_async(complete(server.url))
+        third = run_async(complete(server.url))
+
+    assert first is second is third
+    assert server.request_count == 3
+    assert len(server.connections) == 1
+
+
+def test_clients_are_not_shared_across_event_loops():
+    with FakeOpenAIServer(reply="OK") as server:
+        first = asyncio.run(complete(server.url))
+        second = asyncio.run(complete(server.url))
+    assert first is not second
+
+
+def test_client_uses_explicit_timeouts():
+    async def timeout():
+        return get_async_client("key", "http://127.0.0.1:1/v1").timeout
+
+    assert run_async(timeout()) == http_timeout()
+    assert http_timeout().connect < http_timeout().read
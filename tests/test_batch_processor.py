@@ -0,0 +1,125 @@
+import json
+from unittest.mock import patch
+import pytest
+from openai import OpenAI
+from batch_processor import BulkJob
+from custom_exceptions import APIError
+from config import OPENAI_MODEL
+from tests.fake_openai_server import FakeOpenAIServer
+
+
+def fake_reply(body):
+    prompt = body["messages"][-1]["content"]
+    if "nøkkelord eller fraser" in prompt:
+        return "ferie, lønn"
+    if "Kategoriser" in prompt:
+        return "Kompensasjon og fordeler"
+    if "HR-enheter" in prompt:
+        return json.dumps({"ansatte": [], "avdelinger": ["HR"], "stillinger": [], "kompetanser": []})
+    if "stemning" in prompt:
+        return json.dumps({"positive": ["fleksibel"], "negative": []})
+    return "Sammendrag"
+
+
+@pytest.fixture
+def server():
+    with FakeOpenAIServer(reply=fake_reply) as server:
+        server.batch_polls_until_complete = 2
+        yield server
+
+
+def test_bulk_job_produces_structure_document_json(server, tmp_path):
+    client = OpenAI(api_key="test", base_url=server.url, max_retries=0)
+    documents = [("ferie_policy.txt", "https://example.com/ferie\nAnsatte har rett til ferie."),
+                 ("lonn.txt", "Lønn utbetales den 20. hver måned.")]
+
+    with patch('document_processor.detect_language', return_value='no'):
+        results = BulkJob(str(tmp_path / "job")).run(client, documents, str(tmp_path / "out"), interval=0)
+
+    assert set(results) == {"ferie_policy.txt", "lonn.txt"}
+    document = json.loads((tmp_path / "out" / "ferie_policy.txt.json").read_text(encoding="utf-8"))
+    assert document["title"] == "Ferie Policy"
+    assert document["url"] == "https://example.com/ferie"
+    assert document["body"] == "Ansatte har rett til ferie."
+    assert document["tags"] == ["ferie", "lønn"]
+    assert document["category"] == "Kompensasjon og fordeler"
+    assert document["entities"]["avdelinger"] == ["HR"]
+    assert document["positive"] == ["fleksibel"]
+    assert document["summary"] == "Sammendrag"
+    assert server.request_count == 10
+
+
+def test_bulk_job_resumes_after_restart(server, tmp_path):
+    client = OpenAI(api_key="test", base_url=server.url, max_retries=0)
+    work_dir = str(tmp_path / "job")
+
+    with patch('document_processor.detect_language', return_value='no'):
+        job = BulkJob(work_dir)
+        job.prepare([("lonn.txt", "Lønn utbetales den 20. hver måned.")])
+        job.submit(client)
+
+        # A new process picks up the submitted batch instead of submitting it again.
+        resumed = BulkJob(work_dir)
+        assert resumed.status == "submitted"
+        results = resumed.run(client, [], str(tmp_path / "out"), interval=0)
+
+    assert list(results) == ["lonn.txt"]
+    # One batch per model: the mini model's analyses and the summary.
+    assert len(server.batches) == 2
+
+
+def test_bulk_job_splits_requests_into_batches_within_the_file_limits(server, tmp_path):
+    client = OpenAI(api_key="test", base_url=server.url, max_retries=0)
+    documents = [(f"doc{i}.txt", f"Dokument nummer {i} om ferie.") for i in range(3)]
+
+    with patch('document_processor.detect_language', return_value='no'), \
+         patch('batch_processor.BATCH_MAX_REQUESTS', 4):
+        job = BulkJob(str(tmp_path / "job"))
+        results = job.run(client, documents, str(tmp_path / "out"), interval=0)
+
+    assert len(server.batches) == 4
+    assert [(batch["model"], batch["requests"]) for batch in job.state["batches"]] == [
+        ("gpt-4o-mini", 4), (OPENAI_MODEL, 3), ("gpt-4o-mini", 4), ("gpt-4o-mini", 4)]
+    assert set(results) == {"doc0.txt", "doc1.txt", "doc2.txt"}
+    assert json.loads(results["doc2.txt"])["summary"] == "Sammendrag"
+    assert job.state["failed"] == 0
+
+    with patch('document_processor.detect_language', return_value='no'), \
+         patch('batch_processor.BATCH_MAX_FILE_BYTES', 1):
+        job = BulkJob(str(tmp_path / "job2"))
+        job.prepare(documents[:1])
+    assert [batch["requests"] for batch in job.state["batches"]] == [1] * 5
+
+
+def test_documents_with_missing_results_count_as_failed(server, tmp_path):
+    client = OpenAI(api_key="test", base_url=server.url, max_retries=0)
+    job = BulkJob(str(tmp_path / "job"))
+
+    with patch('document_processor.detect_language', return_value='no'):
+        job.prepare([("lonn.txt", "Lønn utbetales den 20. hver måned."), ("ferie.txt", "Ferie i juli.")])
+        job.submit(client)
+        job.poll(client, interval=0)
+        job._download_output(client)
+        for batch in job.state["batches"]:
+            with open(batch["output_path"], encoding="utf-8") as f:
+                lines = [line for line in f if '"doc-00001:summary"' not in line]
+            with open(batch["output_path"], "w", encoding="utf-8") as f:
+                f.writelines(lines)
+        results = job.collect(client, str(tmp_path / "out"))
+
+    assert set(results) == {"lonn.txt", "ferie.txt"}
+    assert job.state["failed"] == 1
+
+
+def test_fake_server_rejects_batches_that_mix_models(server, tmp_path):
+    client = OpenAI(api_key="test", base_url=server.url, max_retries=0)
+    job = BulkJob(str(tmp_path / "job"))
+    with patch('document_processor.detect_language', return_value='no'):
+        job.prepare([("lonn.txt", "Lønn utbetales den 20. hver måned.")])
+    with open(job.state["batches"][1]["requests_path"], "a", encoding="utf-8") as mixed, \
+         open(job.state["batches"][0]["requests_path"], encoding="utf-8") as other:
+        mixed.write(other.readline())
+
+    job.submit(client)
+    with pytest.raises(APIError, match="failed"):
+        job.poll(client, interval=0)
@@ -0,0 +1,55 @@
+import json
+import pytest
+import dedup
+import local_tier
+import rate_limiter
+from benchmarks.corpus import make_corpus
+from benchmarks.run import compare, fake_reply, percentile, run_scenario
+from document_processor import read_file_text
+
+
+@pytest.fixture
+def isolated_scenario(monkeypatch):
+    monkeypatch.setattr(dedup, "DEDUP_ENABLED", dedup.DEDUP_ENABLED)
+    monkeypatch.setattr(local_tier, "LOCAL_TIER_ENABLED", local_tier.LOCAL_TIER_ENABLED)
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_RPM", rate_limiter.RATE_LIMIT_RPM)
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_TPM", rate_limiter.RATE_LIMIT_TPM)
+    monkeypatch.delenv("OPENAI_BASE_URL", raising=False)
+
+
+@pytest.mark.parametrize("fmt", ["txt", "pdf", "docx"])
+def test_corpus_is_reproducible_and_readable(fmt):
+    first = make_corpus(fmt, "small", 2, seed=1)
+    assert [file.getvalue() for file in first] == [file.getvalue() for file in make_corpus(fmt, "small", 2, seed=1)]
+    assert first[0].getvalue() != first[1].getvalue()
+    text = read_file_text(first[0])
+    assert "ansatte" in text.lower() or "arbeidstaker" in text.lower()
+    assert len(text) > 1000
+
+
+def test_fake_reply_matches_each_prompt():
+    assert fake_reply({"messages": [{"content": "Kategoriser følgende"}]}) == "Personaladministrasjon"
+    analysis = json.loads(fake_reply({"messages": [{"content": "x"}], "response_format": {"type": "json_schema"}}))
+    assert analysis["category"] == "Personaladministrasjon"
+
+
+@pytest.mark.parametrize("target", ["process_files", "structure_document"])
+def test_run_scenario_reports_throughput_and_requests(isolated_scenario, target):
+    scenario = {"target": target, "format": "txt", "size": "small", "docs": 2, "latency": 0.0, "connect_latency": 0.0,
+                "rate_limit_rate": 0.0, "rpm": 10000, "tpm": 10_000_000, "seed": 0}
+    result = run_scenario(scenario)
+    assert result["succeeded"] == 2
+    assert result["requests"] == 10
+    assert result["docs_per_sec"] > 0
+    assert result["p50_latency"] <= result["p95_latency"]
+
+
+def test_percentile_and_compare_flag_regressions():
+    assert percentile([0.1, 0.2, 0.3, 0.4, 5.0], 0.5) == 0.3
+    assert percentile([], 0.95) == 0.0
+
+    baseline = {"results": {"a": {"docs_per_sec": 10.0, "p95_latency": 1.0, "requests": 50}}}
+    assert compare({"a": {"docs_per_sec": 9.5, "p95_latency": 1.05, "requests": 50}}, baseline) == []
+    regressions = compare({"a": {"docs_per_sec": 5.0, "p95_latency": 2.0, "requests": 60}}, baseline)
+    assert len(regressions) == 3
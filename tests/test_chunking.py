@@ -0,0 +1,39 @@
+from unittest.mock import patch
+import pytest
+from chunking import chunk_text, count_tokens, iter_sentences
+
+
+class WordEncoding:
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+@pytest.fixture(autouse=True)
+def word_encoding():
+    with patch('chunking.get_encoding', return_value=WordEncoding()):
+        yield
+
+
+def test_iter_sentences_joins_fragments_until_sentence_ends():
+    text = "Ferie\nAnsatte har rett til ferie. Ferien avtales med leder!"
+    assert list(iter_sentences(text)) == ["Ferie Ansatte har rett til ferie.", "Ferien avtales med leder!"]
+
+
+def test_chunk_text_packs_whole_sentences_up_to_max_tokens():
+    text = "En to tre. Fire fem seks. Sju åtte ni."
+    assert chunk_text(text, max_tokens=6, token_budget=None) == ["En to tre. Fire fem seks.", "Sju åtte ni."]
+
+
+def test_chunk_text_splits_sentences_longer_than_max_tokens():
+    text = "en to tre fire fem seks sju."
+    assert chunk_text(text, max_tokens=3, token_budget=None) == ["en to tre", "fire fem seks", "sju."]
+
+
+def test_chunk_text_stops_at_token_budget():
+    text = "En to tre. Fire fem seks. Sju åtte ni."
+    chunks = chunk_text(text, max_tokens=3, token_budget=6)
+    assert chunks == ["En to tre.", "Fire fem seks."]
+    assert sum(count_tokens(chunk) for chunk in chunks) == 6
@@ -0,0 +1,54 @@
+import json
+import zipfile
+from cli import collect_paths, document_name, input_root, shard_paths, main
+from tests.fake_openai_server import FakeOpenAIServer
+
+
+def write_corpus(tmp_path):
+    corpus = tmp_path / "corpus"
+    (corpus / "nested").mkdir(parents=True)
+    (corpus / "ferie.txt").write_text("Ansatte har rett til fem ukers ferie hvert år.", encoding="utf-8")
+    (corpus / "nested" / "lonn.txt").write_text("Lønn utbetales den 20. hver måned.", encoding="utf-8")
+    (corpus / "notes.md").write_text("Ikke et støttet format.", encoding="utf-8")
+    return corpus
+
+
+def test_collect_paths_walks_directories_and_skips_unsupported_files(tmp_path):
+    corpus = write_corpus(tmp_path)
+    paths = collect_paths([str(corpus)])
+    assert [path[len(str(corpus)) + 1:] for path in paths] == ["ferie.txt", "nested/lonn.txt"]
+    assert collect_paths([str(corpus / "**" / "lonn.txt")]) == [str(corpus / "nested" / "lonn.txt")]
+
+
+def test_documents_are_named_relative_to_the_input_root(tmp_path):
+    corpus = write_corpus(tmp_path)
+    (corpus / "ferie.txt").rename(corpus / "lonn.txt")
+    root = input_root([str(corpus)])
+    names = [document_name(path, root) for path in collect_paths([str(corpus)])]
+    assert names == ["lonn.txt", "nested/lonn.txt"]
+    assert input_root([str(corpus / "**" / "*.txt")]) == str(corpus)
+    assert input_root([str(corpus / "nested"), str(corpus / "lonn.txt")]) == str(corpus)
+
+
+def test_shard_paths_splits_without_overlap():
+    paths = [f"{i}.txt" for i in range(5)]
+    shards = [shard_paths(paths, index, 2) for index in range(2)]
+    assert sorted(shards[0] + shards[1]) == paths
+    assert not set(shards[0]) & set(shards[1])
+
+
+def test_main_writes_zip_of_documents(tmp_path, capsys):
+    corpus = write_corpus(tmp_path)
+    output = tmp_path / "out" / "results.zip"
+
+    with FakeOpenAIServer(reply="ferie, lønn") as server:
+        exit_code = main([str(corpus), "-o", str(output), "--api-key", "test", "--base-url", server.url])
+
+    assert exit_code == 0
+    with zipfile.ZipFile(output) as zip_file:
+        assert sorted(zip_file.namelist()) == ["ferie.txt.json", "nested/lonn.txt.json"]
+        document = json.loads(zip_file.read("nested/lonn.txt.json"))
+    assert document["title"] == "Lonn"
+    assert document["body"] == "Lønn utbetales den 20. hver måned."
+    assert server.request_count == 10
+    assert "Processed 2 files, 0 failed" in capsys.readouterr().out
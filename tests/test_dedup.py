@@ -0,0 +1,140 @@
+import asyncio
+import numpy as np
+from dedup import DuplicateIndex, MinHasher, normalize_text, similarity
+
+BASE_TEXT = " ".join(f"Ansatte har rett til {i} dager ferie etter avtale med leder." for i in range(40))
+
+
+def make_analyse(result, delay=0.0):
+    calls = []
+
+    async def analyse():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return result
+
+    return analyse, calls
+
+
+def test_normalize_text_ignores_case_punctuation_and_whitespace():
+    assert normalize_text("Hei,   VERDEN!\n") == normalize_text("hei verden")
+
+
+def test_minhash_similarity_tracks_overlap():
+    hasher = MinHasher()
+    signature = hasher.signature(normalize_text(BASE_TEXT))
+    near = hasher.signature(normalize_text(BASE_TEXT.replace("39 dager", "39 uker")))
+    other = hasher.signature(normalize_text("Rutiner for varsling av kritikkverdige forhold i virksomheten."))
+    assert similarity(signature, signature) == 1.0
+    assert similarity(signature, near) > 0.9
+    assert similarity(signature, other) < 0.2
+
+
+def test_exact_and_near_duplicates_reuse_the_analysis():
+    index = DuplicateIndex()
+
+    async def run():
+        analyse, calls = make_analyse({"summary": "ferie"})
+        first = await index.get_or_analyse(BASE_TEXT, "a.txt", analyse, calls=5)
+        exact = await index.get_or_analyse(BASE_TEXT.upper(), "b.txt", analyse, calls=5)
+        near = await index.get_or_analyse(BASE_TEXT.replace("39 dager", "39 uker"), "c.txt", analyse, calls=5)
+        return first, exact, near, calls
+
+    first, exact, near, calls = asyncio.run(run())
+    assert first == exact == near == {"summary": "ferie"}
+    assert len(calls) == 1
+    assert index.stats() == {"documents": 1, "duplicates": 2, "calls_saved": 10}
+
+
+def test_unrelated_documents_are_analysed_separately():
+    index = DuplicateIndex()
+
+    async def run():
+        analyse, calls = make_analyse({})
+        await index.get_or_analyse(BASE_TEXT, "a.txt", analyse)
+        await index.get_or_analyse("Rutiner for varsling av kritikkverdige forhold.", "b.txt", analyse)
+        return calls
+
+    assert len(asyncio.run(run())) == 2
+    assert index.duplicates == 0
+
+
+def test_concurrent_duplicates_wait_for_the_first_analysis():
+    index = DuplicateIndex()
+
+    async def run():
+        analyse, calls = make_analyse({"summary": "ferie"}, delay=0.05)
+        results = await asyncio.gather(*(index.get_or_analyse(BASE_TEXT, f"{i}.txt", analyse) for i in range(3)))
+        return results, calls
+
+    results, calls = asyncio.run(run())
+    assert results == [{"summary": "ferie"}] * 3
+    assert len(calls) == 1
+
+
+def test_failed_analysis_is_not_reused():
+    index = DuplicateIndex()
+
+    async def fail():
+        raise RuntimeError("boom")
+
+    async def run():
+        try:
+            await index.get_or_analyse(BASE_TEXT, "a.txt", fail)
+        except RuntimeError:
+            pass
+        analyse, calls = make_analyse({"summary": "ferie"})
+        return await index.get_or_analyse(BASE_TEXT, "a.txt", analyse), calls
+
+    result, calls = asyncio.run(run())
+    assert result == {"summary": "ferie"}
+    assert len(calls) == 1
+
+
+def test_incomplete_analysis_is_not_reused_or_saved(tmp_path):
+    path = str(tmp_path / "dedup_index.json")
+    index = DuplicateIndex(path)
+    incomplete, _ = make_analyse({"summary": "", "fallbacks": ["summary"]})
+    complete, calls = make_analyse({"summary": "ferie", "fallbacks": []})
+    reusable = lambda analysis: not analysis["fallbacks"]
+
+    async def run():
+        first = await index.get_or_analyse(BASE_TEXT, "a.txt", incomplete, reusable=reusable)
+        index.save()
+        saved = DuplicateIndex(path).entries
+        second = await index.get_or_analyse(BASE_TEXT, "b.txt", complete, reusable=reusable)
+        return first, saved, second
+
+    first, saved, second = asyncio.run(run())
+    assert first["fallbacks"] == ["summary"]
+    assert saved == {}
+    assert second["summary"] == "ferie"
+    assert len(calls) == 1
+    assert index.duplicates == 0
+
+
+def test_index_persists_across_batches(tmp_path):
+    path = str(tmp_path / "dedup_index.json")
+    index = DuplicateIndex(path)
+    analyse, calls = make_analyse({"summary": "ferie"})
+    asyncio.run(index.get_or_analyse(BASE_TEXT, "a.txt", analyse))
+    index.save()
+
+    reloaded = DuplicateIndex(path)
+    assert isinstance(reloaded.entries["a.txt"]["signature"], np.ndarray)
+    result = asyncio.run(reloaded.get_or_analyse(BASE_TEXT, "b.txt", analyse))
+    assert result == {"summary": "ferie"}
+    assert len(calls) == 1
+    assert reloaded.calls_saved == 1
+
+
+def test_index_from_another_prompt_version_or_model_is_discarded(tmp_path):
+    path = str(tmp_path / "dedup_index.json")
+    index = DuplicateIndex(path, prompt_version="1", model="gpt-4o")
+    analyse, calls = make_analyse({"summary": "ferie"})
+    asyncio.run(index.get_or_analyse(BASE_TEXT, "a.txt", analyse))
+    index.save()
+
+    assert set(DuplicateIndex(path, prompt_version="1", model="gpt-4o").entries) == {"a.txt"}
+    assert DuplicateIndex(path, prompt_version="2", model="gpt-4o").entries == {}
+    assert DuplicateIndex(path, prompt_version="1", model="gpt-4o-mini").entries == {}
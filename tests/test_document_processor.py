@@ -1,6 +1,6 @@
 import json
-from unittest.mock import Mock, MagicMock, patch
-from document_processor import process_file
+from unittest.mock import AsyncMock, Mock, MagicMock, patch
+from document_processor import build_document, process_file, structure_document, structure_document_async
 
 def test_process_file():
     mock_client = Mock()
@@ -41,4 +41,146 @@ def test_process_file():
     mock_entities.assert_called_once()
     mock_sentiment.assert_called_once()
     mock_sentiment_keywords.assert_called_once()
-    mock_summary.assert_called_once()
\ No newline at end of file
+    mock_summary.assert_called_once()
+
+def test_structure_document_async_degrades_only_failed_field():
+    import asyncio
+
+    async def failing_summary(text, client, max_words=200):
+        raise RuntimeError("API down")
+
+    with patch('document_processor.detect_language', return_value='no'), \
+         patch('document_processor.extract_hr_keywords_async', AsyncMock(return_value=["lønn", "ferie"])), \
+         patch('document_processor.categorize_hr_document_async', AsyncMock(return_value="Kompensasjon og fordeler")), \
+         patch('document_processor.extract_hr_entities_async', AsyncMock(return_value={"ansatte": []})), \
+         patch('document_processor.extract_sentiment_keywords_async',
+               AsyncMock(return_value={"positive": ["godt"], "negative": []})), \
+         patch('document_processor.summarize_hr_text_async', side_effect=failing_summary):
+        result = asyncio.run(structure_document_async("Ansatte har rett til ferie.", Mock(), "ferie_policy.txt"))
+
+    document = json.loads(result)
+    assert document["title"] == "Ferie Policy"
+    assert document["tags"] == ["lønn", "ferie"]
+    assert document["category"] == "Kompensasjon og fordeler"
+    assert document["positive"] == ["godt"]
+    assert document["summary"] == ""
+
+
+def test_structure_document_full_analysis_uses_one_structured_call():
+    mock_client = Mock()
+    mock_response = MagicMock()
+    mock_response.choices[0].message.content = json.dumps({
+        "keywords": ["ferie", "lønn", "avtale", "permisjon", "arbeidstid", "ekstra"],
+        "category": "Kompensasjon og fordeler",
+        "entities": {"ansatte": [], "avdelinger": ["HR"], "stillinger": [], "kompetanser": []},
+        "positive": ["fleksibel"],
+        "negative": ["overtid"],
+        "summary": "Kort sammendrag."
+    })
+    mock_client.chat.completions.create.return_value = mock_response
+
+    with patch('document_processor.detect_language', return_value='no'):
+        result = structure_document("Ansatte har rett til ferie.", mock_client, "ferie.txt", full_analysis=True)
+
+    mock_client.chat.completions.create.assert_called_once()
+    response_format = mock_client.chat.completions.create.call_args.kwargs["response_format"]
+    assert response_format["type"] == "json_schema"
+    assert response_format["json_schema"]["strict"] is True
+
+    document = json.loads(result)
+    assert document["tags"] == ["ferie", "lønn", "avtale", "permisjon", "arbeidstid"]
+    assert document["category"] == "Kompensasjon og fordeler"
+    assert document["entities"]["avdelinger"] == ["HR"]
+    assert document["positive"] == ["fleksibel"]
+    assert document["negative"] == ["overtid"]
+    assert document["summary"] == "Kort sammendrag."
+
+
+def test_structure_document_async_chunked_covers_whole_document():
+    import asyncio
+
+    prompts = []
+    documents = []
+
+    async def fake_call(client, messages, max_tokens, response_format=None, **kwargs):
+        prompt = messages[-1]["content"]
+        prompts.append(prompt)
+        documents.append(messages[-2]["content"])
+        if "nøkkelord eller fraser" in prompt:
+            return "ferie, lønn"
+        return "Sammendrag"
+
+    with patch('document_processor.detect_language', return_value='no'), \
+         patch('document_processor.chunk_text', return_value=["Første del om ferie.", "Andre del om lønn."]), \
+         patch('hr_openai_utils.call_openai_api_async', side_effect=fake_call), \
+         patch('document_processor.categorize_hr_document_async', AsyncMock(return_value="Annet")), \
+         patch('document_processor.extract_hr_entities_async', AsyncMock(return_value={})), \
+         patch('document_processor.extract_sentiment_keywords_async',
+               AsyncMock(return_value={"positive": [], "negative": []})):
+        result = asyncio.run(structure_document_async("Første del om ferie. Andre del om lønn.", Mock(),
+                                                      "ferie.txt", chunked=True))
+
+    document = json.loads(result)
+    assert document["tags"] == ["ferie", "lønn"]
+    assert document["summary"] == "Sammendrag"
+    assert any("Andre del om lønn." in document for document in documents)
+    assert any(prompt.startswith("Følgende er sammendrag av hver del") for prompt in prompts)
+
+
+def test_structure_document_async_reports_fields_and_the_streamed_summary():
+    import asyncio
+
+    async def streaming_summary(text, client, max_words=200, on_delta=None):
+        on_delta("Ansatte har")
+        on_delta("Ansatte har rett til ferie.")
+        return "Ansatte har rett til ferie."
+
+    reported = []
+    with patch('document_processor.detect_language', return_value='no'), \
+         patch('document_processor.extract_hr_keywords_async', AsyncMock(return_value=["ferie"])), \
+         patch('document_processor.categorize_hr_document_async', AsyncMock(return_value="Annet")), \
+         patch('document_processor.extract_hr_entities_async', AsyncMock(return_value={})), \
+         patch('document_processor.extract_sentiment_keywords_async',
+               AsyncMock(return_value={"positive": [], "negative": []})), \
+         patch('document_processor.summarize_hr_text_async', side_effect=streaming_summary):
+        result = asyncio.run(structure_document_async("Ansatte har rett til ferie.", Mock(), "ferie.txt",
+                                                      on_field=lambda *field: reported.append(field)))
+
+    summaries = [value for doc_id, name, value in reported if name == "summary"]
+    assert summaries == ["Ansatte har", "Ansatte har rett til ferie.", "Ansatte har rett til ferie."]
+    assert ("ferie.txt", "keywords", ["ferie"]) in reported
+    assert {name for _, name, _ in reported} == {"keywords", "category", "entities", "sentiment_keywords", "summary"}
+    assert json.loads(result)["summary"] == "Ansatte har rett til ferie."
+
+
+def test_structure_document_async_does_not_reuse_an_analysis_with_failed_fields():
+    import asyncio
+    from dedup import DuplicateIndex
+
+    text = " ".join(f"Ansatte har rett til {i} dager ferie." for i in range(40))
+    summarize = AsyncMock(side_effect=[RuntimeError("timeout"), "Ferieregler."])
+    with patch('document_processor.detect_language', return_value='no'), \
+         patch('document_processor.extract_hr_keywords_async', AsyncMock(return_value=["ferie"])), \
+         patch('document_processor.categorize_hr_document_async', AsyncMock(return_value="Annet")), \
+         patch('document_processor.extract_hr_entities_async', AsyncMock(return_value={})), \
+         patch('document_processor.extract_sentiment_keywords_async',
+               AsyncMock(return_value={"positive": [], "negative": []})), \
+         patch('document_processor.summarize_hr_text_async', summarize):
+        index = DuplicateIndex()
+        first = asyncio.run(structure_document_async(text, Mock(), "a.txt", dedup_index=index))
+        second = asyncio.run(structure_document_async(text, Mock(), "b.txt", dedup_index=index))
+
+    assert json.loads(first)["summary"] == ""
+    assert "fallbacks" not in json.loads(first)
+    assert json.loads(second)["summary"] == "Ferieregler."
+    assert summarize.await_count == 2
+
+
+def test_build_document_keeps_sentiment_keywords_out_of_info_logs():
+    with patch('document_processor.logger') as logger:
+        logger.isEnabledFor.return_value = False
+        document = build_document("ferie.txt", "Ansatte har rett til ferie.", None, ["ferie"], "Annet", {},
+                                  {"positive": ["trygghet"], "negative": []}, "Kort.")
+
+    assert json.loads(document)["positive"] == ["trygghet"]
+    assert "trygghet" not in str(logger.mock_calls)
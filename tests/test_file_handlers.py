@@ -8,8 +8,29 @@ def test_read_pdf():
         result = read_pdf(mock_open(read_data=b"pdf content")())
     assert result == "Test content\n"
 
-def test_read_docx():
-    with patch('docx2txt.process', return_value="Test content"):
-        result = read_docx(mock_open(read_data=b"docx content")())
-    assert result == "Test content"
+def test_read_docx_matches_docx2txt():
+    import io
+    import docx2txt
+    from tests.document_factory import make_docx
+    data = make_docx(["Personalhåndbok", "Ansatte har rett til ferie.", "Lønn & goder"])
+    result = read_docx(io.BytesIO(data))
+    assert result == docx2txt.process(io.BytesIO(data))
+    assert result.startswith("Personalhåndbok\n\nAnsatte")
 
+
+def test_read_pdf_stops_once_max_chars_are_read():
+    pages = [Mock(extract_text=Mock(return_value="a" * 10)) for _ in range(5)]
+    with patch('PyPDF2.PdfReader') as mock_pdf_reader:
+        mock_pdf_reader.return_value.pages = pages
+        result = read_pdf(mock_open(read_data=b"pdf content")(), max_chars=15)
+    assert result == "a" * 10 + "\n" + "a" * 10 + "\n"
+    assert [page.extract_text.called for page in pages] == [True, True, False, False, False]
+
+def test_read_pdf_in_process_pool_keeps_page_order():
+    import io
+    from tests.document_factory import make_pdf
+    data = make_pdf([f"Side {i}" for i in range(25)])
+    sequential = read_pdf(io.BytesIO(data))
+    parallel = read_pdf(io.BytesIO(data), workers=2)
+    assert parallel == sequential
+    assert parallel.index("Side 3") < parallel.index("Side 24")
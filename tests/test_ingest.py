@@ -0,0 +1,101 @@
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from file_handlers import read_text
+from ingest import MemoryBudget, SpooledUpload, upload_digest
+from manifest import content_hash
+
+
+def test_spooled_upload_is_hashed_while_copied_to_disk():
+    upload = SpooledUpload(io.BytesIO("\ufeffAnsatte har rett til ferie.".encode("utf-8")), "ferie.txt", "text/plain")
+    try:
+        assert upload.size == len("\ufeffAnsatte har rett til ferie.".encode("utf-8"))
+        assert upload_digest(upload) == content_hash(upload.getvalue())
+        assert read_text(upload) == "Ansatte har rett til ferie."
+    finally:
+        upload.discard()
+
+
+def test_memory_budget_holds_documents_back_until_memory_is_released():
+    budget = MemoryBudget(100)
+
+    async def run():
+        first, second = budget.reserve(60), budget.reserve(60)
+        await first.__aenter__()
+        waiting = asyncio.create_task(second.__aenter__())
+        await asyncio.sleep(0.05)
+        assert not waiting.done() and budget.waits == 1
+
+        await first.__aexit__(None, None, None)
+        await asyncio.wait_for(waiting, 1)
+        assert budget.used == 60
+        await second.__aexit__(None, None, None)
+        # A document larger than the budget runs on its own instead of waiting forever.
+        async with budget.reserve(500):
+            assert budget.used == 100
+
+    asyncio.run(run())
+    assert budget.used == 0
+
+
+def test_cancelled_reservations_are_returned():
+    budget = MemoryBudget(100)
+
+    async def run():
+        held = budget.reserve(100)
+        await held.__aenter__()
+        waiting = asyncio.create_task(budget.reserve(50).__aenter__())
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        await held.__aexit__(None, None, None)
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert budget.used == 0
+
+
+def test_waiting_reservations_do_not_occupy_executor_threads():
+    budget = MemoryBudget(100)
+    order = []
+
+    async def document(name, nbytes, parsed):
+        async with budget.reserve(nbytes):
+            order.append(name)
+            await parsed.wait()
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        # With a single executor thread, a reservation parked in a thread would block this to_thread call.
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=1))
+        parsed = asyncio.Event()
+        tasks = [asyncio.create_task(document(f"doc{i}", 60, parsed)) for i in range(4)]
+        await asyncio.sleep(0.01)
+        assert await asyncio.wait_for(asyncio.to_thread(lambda: "parsed"), 1) == "parsed"
+        parsed.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == ["doc0", "doc1", "doc2", "doc3"]
+    assert budget.used == 0 and budget.waits == 3
+
+
+def test_cancelling_the_first_waiter_lets_the_next_one_in():
+    budget = MemoryBudget(100)
+
+    async def run():
+        held, reservation = budget.reserve(50), budget.reserve(40)
+        await held.__aenter__()
+        large = asyncio.create_task(budget.reserve(100).__aenter__())
+        small = asyncio.create_task(reservation.__aenter__())
+        await asyncio.sleep(0.01)
+        large.cancel()
+        await asyncio.wait_for(small, 1)
+        assert budget.used == 90
+        await reservation.__aexit__(None, None, None)
+        await held.__aexit__(None, None, None)
+
+    asyncio.run(run())
+    assert budget.used == 0
@@ -0,0 +1,135 @@
+import tempfile
+import threading
+from concurrent.futures import CancelledError
+from unittest.mock import Mock
+from jobs import JobManager, job_key
+from pipeline import InMemoryFile
+
+
+def wait_for(job):
+    for _ in range(500):
+        if not job.running:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError(f"job {job.id} did not finish")
+
+
+def spooled(data):
+    file = tempfile.SpooledTemporaryFile(max_size=1024)
+    file.write(data)
+    return file
+
+
+def archive(count):
+    result = Mock(count=count)
+    result.close.return_value = spooled(b"PK")
+    return result
+
+
+def test_job_key_depends_on_the_api_key_and_the_names_and_contents_of_the_files():
+    files = [InMemoryFile(b"ferie", "ferie.txt", "text/plain"), InMemoryFile(b"lonn", "lonn.txt", "text/plain")]
+    assert job_key(files, "sk-a") == job_key(list(reversed(files)), "sk-a")
+    changed = [InMemoryFile(b"ferie 2", "ferie.txt", "text/plain"), files[1]]
+    assert job_key(files, "sk-a") != job_key(changed, "sk-a")
+    assert job_key(files, "sk-a") != job_key(files, "sk-b")
+    assert "sk-a" not in job_key(files, "sk-a")
+
+
+def test_finished_jobs_are_reused_instead_of_recomputed():
+    manager = JobManager(workers=1)
+    release = threading.Event()
+    calls = []
+
+    def work(job):
+        calls.append(job.id)
+        job.update(processed=1)
+        release.wait(5)
+        return archive(2)
+
+    job = manager.submit("abc", ["ferie.txt"], work)
+    assert manager.submit("abc", ["ferie.txt"], work) is job
+    release.set()
+    wait_for(job)
+
+    snapshot = manager.get("abc").snapshot()
+    assert snapshot["state"] == "done"
+    assert job.read_result() == b"PK" and snapshot["count"] == 2
+    assert manager.submit("abc", ["ferie.txt"], work) is job
+    assert calls == ["abc"]
+
+
+def test_failed_jobs_report_the_error_and_can_be_retried():
+    manager = JobManager(workers=1)
+
+    def fail(job):
+        raise RuntimeError("API nede")
+
+    job = manager.submit("abc", ["ferie.txt"], fail)
+    wait_for(job)
+    assert job.snapshot()["error"] == "API nede"
+
+    retry = manager.submit("abc", ["ferie.txt"], lambda job: archive(1))
+    wait_for(retry)
+    assert retry is not job and retry.state == "done"
+
+
+def test_only_the_newest_finished_jobs_are_kept():
+    manager = JobManager(workers=1, history=2)
+    jobs = []
+    for key in ("a", "b", "c"):
+        jobs.append(manager.submit(key, [], lambda job: archive(0)))
+        wait_for(jobs[-1])
+    manager.submit("d", [], lambda job: archive(0))
+    assert manager.get("a") is None
+    assert manager.get("c") is jobs[2]
+    # The pruned job's archive is deleted with it; the kept ones stay on disk, not in memory.
+    assert jobs[0].read_result() is None
+    assert jobs[2].result._rolled and jobs[2].read_result() == b"PK"
+
+
+def test_cancelling_a_queued_job_skips_it_and_allows_a_new_run():
+    manager = JobManager(workers=1)
+    release = threading.Event()
+    calls = []
+
+    def work(job):
+        calls.append(job.id)
+        release.wait(5)
+        return archive(1)
+
+    first = manager.submit("a", [], work)
+    queued = manager.submit("b", [], work)
+    assert queued.cancel() and queued.state == "cancelled"
+    release.set()
+    wait_for(first)
+
+    assert calls == ["a"]
+    rerun = manager.submit("b", [], work)
+    wait_for(rerun)
+    assert rerun is not queued and rerun.state == "done"
+
+
+def test_cancelling_a_running_job_stops_its_work():
+    manager = JobManager(workers=1)
+    stopped = threading.Event()
+
+    def work(job):
+        job.on_cancel(stopped.set)
+        job.set_field("ferie.txt", "summary", "Ansatte har")
+        stopped.wait(5)
+        job.keep_result(spooled(b"PK"), 1)
+        raise CancelledError()
+
+    job = manager.submit("abc", ["ferie.txt"], work)
+    for _ in range(500):
+        if job.snapshot()["partial"]:
+            break
+        threading.Event().wait(0.01)
+    assert job.snapshot()["partial"] == {"ferie.txt": {"summary": "Ansatte har"}}
+    assert job.cancel()
+    wait_for(job)
+
+    snapshot = job.snapshot()
+    assert snapshot["state"] == "cancelled"
+    assert job.read_result() == b"PK" and snapshot["partial"] == {}
+    assert not job.cancel()
@@ -0,0 +1,113 @@
+import asyncio
+from unittest.mock import AsyncMock, Mock, patch
+from document_processor import analyse_text_async
+from local_tier import LocalTier
+
+VACATION = "Ansatte har rett til ferie og feriepenger. Ferie avtales med leder, og feriedager registreres i {n}."
+SALARY = "Lønn utbetales den tjuende. Lønnsjustering og lønnssamtale skjer årlig med lønnsoppgjøret {n}."
+
+
+def trained_tier(documents=20, **kwargs):
+    tier = LocalTier(min_documents=10, shadow_documents=10, shadow_rate=0.0, **kwargs)
+    for n in range(documents):
+        tier.learn(VACATION.format(n=n), "Personaladministrasjon",
+                   ["ferie", "feriepenger", "feriedager", "leder", "avtales"])
+        tier.learn(SALARY.format(n=n), "Kompensasjon og fordeler", ["lønn", "lønnsjustering", "lønnssamtale",
+                                                                    "lønnsoppgjøret", "årlig"])
+    return tier
+
+
+def test_untrained_tier_defers_to_the_llm():
+    tier = LocalTier(min_documents=10)
+    tier.learn(VACATION.format(n=1), "Personaladministrasjon", ["ferie"])
+    assert tier.answer_category(VACATION.format(n=2)) is None
+    assert tier.answer_keywords(VACATION.format(n=2)) is None
+    assert tier.stats()["avoided_fraction"] == 0.0
+
+
+def test_category_classifier_answers_confident_documents():
+    tier = trained_tier()
+    category, confidence = tier.category("Feriedager og feriepenger: ferie avtales med leder.")
+    assert category == "Personaladministrasjon"
+    assert confidence > 0.95
+    assert tier.answer_category("Spørsmål om lønnsjustering og lønn.") == "Kompensasjon og fordeler"
+    assert tier.answer_category("Ingen kjente ord her overhodet.") is None
+
+
+def test_confident_categories_that_disagree_with_the_llm_are_not_answered_locally():
+    tier = trained_tier()
+    assert tier.agreement() == 1.0
+    # The LLM files the same vacation documents under another category, so the candidates stop matching.
+    for n in range(40):
+        tier.learn(VACATION.format(n=n), "Arbeidsmiljø")
+    assert tier.agreement() < 0.95
+    assert tier.answer_category("Feriedager og feriepenger: ferie avtales med leder.") is None
+
+
+def test_some_candidates_still_go_to_the_llm_to_keep_measuring():
+    tier = trained_tier()
+    tier.shadow_rate = 0.5
+    answers = [tier.answer_category("Spørsmål om lønnsjustering og lønn.") for _ in range(100)]
+    assert 0 < answers.count(None) < 100
+
+
+def test_categories_outside_the_fixed_list_are_not_learned():
+    tier = LocalTier()
+    tier.learn("Tekst om ferie.", "Kategori: ferie", ["ferie"])
+    assert not tier.class_documents
+
+
+def test_keywords_come_from_phrases_the_llm_picked_before():
+    tier = trained_tier()
+    keywords = tier.answer_keywords(VACATION.format(n=99))
+    assert sorted(keywords) == sorted(["ferie", "feriepenger", "feriedager", "leder", "avtales"])
+    assert tier.answer_keywords("Ferie og lønn nevnes bare kort.") is None
+    assert tier.stats()["keywords"] == {"local": 1, "llm": 1}
+
+
+def test_keywords_that_the_llm_does_not_pick_are_not_answered_locally():
+    tier = trained_tier()
+    assert tier.keyword_overlap() == 1.0
+    # The LLM describes the same vacation documents with other keywords, so the local top 5 stop matching.
+    for n in range(40):
+        tier.learn(VACATION.format(n=n), "Personaladministrasjon", ["ferie", "fravær", "permisjon", "HR", "rutiner"])
+    assert tier.keyword_overlap() < 0.8
+    assert tier.answer_keywords(VACATION.format(n=99)) is None
+
+
+def test_analyse_text_async_skips_calls_answered_locally_and_learns_from_the_rest():
+    tier = trained_tier()
+    categorize = AsyncMock(return_value="Annet")
+    keywords = AsyncMock(return_value=["ferie"])
+
+    with patch('document_processor.categorize_hr_document_async', categorize), \
+         patch('document_processor.extract_hr_keywords_async', keywords), \
+         patch('document_processor.extract_hr_entities_async', AsyncMock(return_value={})), \
+         patch('document_processor.extract_sentiment_keywords_async',
+               AsyncMock(return_value={"positive": [], "negative": []})), \
+         patch('document_processor.summarize_hr_text_async', AsyncMock(return_value="Kort.")):
+        fields = asyncio.run(analyse_text_async(VACATION.format(n=99), Mock(), "ferie.txt", local_tier=tier))
+        documents = tier.documents
+        asyncio.run(analyse_text_async("Rutiner for varsling.", Mock(), "varsling.txt", local_tier=tier))
+
+    assert fields["category"] == "Personaladministrasjon"
+    assert len(fields["keywords"]) == 5
+    assert fields["summary"] == "Kort."
+    categorize.assert_awaited_once()
+    keywords.assert_awaited_once()
+    assert documents == 40
+    assert tier.documents == 41
+    assert tier.stats()["avoided_fraction"] == 0.5
+
+
+def test_tier_persists_its_training(tmp_path):
+    path = str(tmp_path / "local_tier.json")
+    tier = trained_tier()
+    tier.path = path
+    tier.save()
+
+    reloaded = LocalTier(path, min_documents=10, shadow_documents=10, shadow_rate=0.0)
+    assert reloaded.documents == 40
+    assert reloaded.agreement() == tier.agreement()
+    assert reloaded.answer_category("Lønnsjustering og lønn.") == "Kompensasjon og fordeler"
+    assert "feriepenger" in reloaded.answer_keywords(VACATION.format(n=5))
@@ -0,0 +1,58 @@
+import os
+from manifest import Manifest, content_hash, file_hash, model_signature
+
+
+def test_file_hash_matches_content_hash(tmp_path):
+    path = tmp_path / "ferie.txt"
+    path.write_bytes(b"Ansatte har rett til ferie.")
+    assert file_hash(str(path), chunk_size=4) == content_hash(b"Ansatte har rett til ferie.")
+
+
+def test_lookup_returns_recorded_result_for_unchanged_content(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    digest = content_hash(b"innhold")
+    assert manifest.lookup("ferie.txt", digest) is None
+
+    manifest.record("ferie.txt", digest, '{"title": "Ferie"}')
+    assert manifest.lookup("ferie.txt", digest) == '{"title": "Ferie"}'
+    assert manifest.lookup("ferie.txt", content_hash(b"endret innhold")) is None
+    assert manifest.skipped == 1
+
+
+def test_sectioned_results_are_returned_as_section_documents(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    digest = content_hash(b"innhold")
+    sections = ['{\n    "title": "Håndbok - Ferie"\n}', '{\n    "title": "Håndbok - Lønn"\n}']
+    manifest.record("handbok.pdf", digest, sections)
+    assert Manifest(str(tmp_path)).lookup("handbok.pdf", digest) == sections
+
+
+def test_prompt_version_or_model_change_reprocesses(tmp_path):
+    digest = content_hash(b"innhold")
+    Manifest(str(tmp_path), prompt_version="1", model="gpt-4o").record("ferie.txt", digest, "{}")
+
+    assert Manifest(str(tmp_path), prompt_version="1", model="gpt-4o").lookup("ferie.txt", digest) == "{}"
+    assert Manifest(str(tmp_path), prompt_version="2", model="gpt-4o").lookup("ferie.txt", digest) is None
+    assert Manifest(str(tmp_path), prompt_version="1", model="gpt-4o-mini").lookup("ferie.txt", digest) is None
+
+
+def test_torn_last_line_and_missing_output_are_ignored(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    manifest.record("a.txt", content_hash(b"a"), "{}")
+    manifest.record("b.txt", content_hash(b"b"), "{}")
+    with open(manifest.path, "a", encoding="utf-8") as f:
+        f.write('{"filename": "c.txt", "content_')
+
+    reloaded = Manifest(str(tmp_path))
+    assert set(reloaded.entries) == {"a.txt", "b.txt"}
+    os.remove(reloaded.entries["b.txt"]["output"])
+    assert reloaded.lookup("a.txt", content_hash(b"a")) == "{}"
+    assert reloaded.lookup("b.txt", content_hash(b"b")) is None
+
+
+def test_model_signature_changes_with_the_routing(tmp_path):
+    routes = {"category": {"model": "gpt-4o-mini"}}
+    assert model_signature("gpt-4o", {}, None) == "gpt-4o"
+    assert model_signature("gpt-4o", routes, "gpt-4o") == model_signature("gpt-4o", dict(routes), "gpt-4o")
+    assert model_signature("gpt-4o", routes, "gpt-4o") != model_signature("gpt-4o", routes, None)
+    assert model_signature("gpt-4o", routes, None) != model_signature("gpt-4o", {"category": {"model": "gpt-4o"}}, None)
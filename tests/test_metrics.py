@@ -0,0 +1,111 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+from openai import AsyncOpenAI, OpenAI
+import hr_openai_utils
+import metrics
+from metrics import Metrics, timed, log_payload
+from tests.fake_openai_server import FakeOpenAIServer
+
+
+def test_timer_records_count_total_and_max():
+    recorder = Metrics()
+    recorder.observe("parse", 0.5)
+    recorder.observe("parse", 1.5)
+    with recorder.timer("write"):
+        pass
+    stages = recorder.snapshot()["stages"]
+    assert stages["parse"] == {"count": 2, "seconds": 2.0, "max_seconds": 1.5}
+    assert stages["write"]["count"] == 1
+
+
+def test_timed_shares_one_stage_between_sync_and_async_variants():
+    recorder = Metrics()
+
+    @timed()
+    def summarize_hr_text():
+        return "sync"
+
+    @timed()
+    async def summarize_hr_text_async():
+        return "async"
+
+    with patch('metrics.get_metrics', return_value=recorder):
+        assert summarize_hr_text() == "sync"
+        assert asyncio.run(summarize_hr_text_async()) == "async"
+    assert recorder.snapshot()["stages"]["summarize_hr_text"]["count"] == 2
+
+
+def test_record_usage_counts_prompt_completion_and_cached_tokens():
+    recorder = Metrics()
+    recorder.record_usage(SimpleNamespace(prompt_tokens=100, completion_tokens=20,
+                                          prompt_tokens_details=SimpleNamespace(cached_tokens=64)))
+    recorder.record_usage(SimpleNamespace(prompt_tokens=50, completion_tokens=10,
+                                          prompt_tokens_details={"cached_tokens": None}))
+    recorder.record_usage(None)
+    assert recorder.snapshot()["tokens"] == {"prompt": 150, "completion": 30, "cached": 64}
+    assert recorder.api_calls == 2
+
+
+def test_exports_json_and_prometheus_text(tmp_path):
+    recorder = Metrics()
+    recorder.observe("langdetect", 0.25)
+    recorder.record_usage(SimpleNamespace(prompt_tokens=7, completion_tokens=3, prompt_tokens_details=None))
+
+    assert json.loads(recorder.to_json())["tokens"]["prompt"] == 7
+    text = recorder.to_prometheus()
+    assert 'hr_stage_seconds_count{stage="langdetect"} 1' in text
+    assert 'hr_stage_seconds_sum{stage="langdetect"} 0.250000' in text
+    assert 'hr_openai_tokens_total{type="completion"} 3' in text
+
+    recorder.export(str(tmp_path / "metrics.prom"))
+    assert (tmp_path / "metrics.prom").read_text().startswith("# TYPE")
+
+
+def test_api_calls_record_usage_from_the_response():
+    recorder = Metrics()
+    with FakeOpenAIServer(reply="ferie") as server, \
+         patch('hr_openai_utils.get_metrics', return_value=recorder), \
+         patch('metrics.get_metrics', return_value=recorder), \
+         patch('hr_openai_utils.get_rate_limiter', return_value=None):
+        client = OpenAI(api_key="test", base_url=server.url, max_retries=0)
+        assert hr_openai_utils.categorize_hr_document("Tekst", client) == "ferie"
+
+    snapshot = recorder.snapshot()
+    assert snapshot["tokens"]["prompt"] > 0
+    assert snapshot["tokens"]["completion"] == 5
+    assert snapshot["stages"]["categorize_hr_document"]["count"] == 1
+
+
+def test_log_payload_is_opt_in_and_lazy(monkeypatch):
+    logger = Mock()
+    logger.isEnabledFor.return_value = True
+
+    log_payload(logger, "Tekst", "Dette er dokumentteksten")
+    logger.debug.assert_not_called()
+
+    monkeypatch.setattr(metrics, "LOG_PAYLOADS", True)
+    log_payload(logger, "Tekst", "linje\nto", limit=5)
+    logger.debug.assert_called_once_with("%s: %s", "Tekst", "linje")
+
+    logger.isEnabledFor.return_value = False
+    log_payload(logger, "Tekst", "annen")
+    assert logger.debug.call_count == 1
+
+
+def test_streamed_calls_record_time_to_first_token_and_usage():
+    recorder = Metrics()
+    partials = []
+    with FakeOpenAIServer(reply="Ansatte har rett til fem ukers ferie.") as server, \
+         patch('hr_openai_utils.get_metrics', return_value=recorder), \
+         patch('metrics.get_metrics', return_value=recorder), \
+         patch('hr_openai_utils.get_rate_limiter', return_value=None):
+        client = AsyncOpenAI(api_key="test", base_url=server.url, max_retries=0)
+        summary = asyncio.run(hr_openai_utils.summarize_hr_text_async("Tekst", client, on_delta=partials.append))
+
+    assert summary == "Ansatte har rett til fem ukers ferie."
+    assert partials[0] == "Ansatte " and partials[-1] == summary
+    snapshot = recorder.snapshot()
+    assert snapshot["stages"]["first_token"]["count"] == 1
+    assert snapshot["tokens"]["completion"] == 5
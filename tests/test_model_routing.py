@@ -0,0 +1,54 @@
+import asyncio
+from unittest.mock import patch
+from openai import AsyncOpenAI
+import hr_openai_utils
+from metrics import Metrics
+from tests.fake_openai_server import FakeOpenAIServer
+
+
+def test_tasks_are_routed_to_their_model_and_max_tokens(monkeypatch):
+    monkeypatch.setattr(hr_openai_utils, "MODEL_ROUTES", {"category": {"model": "gpt-4o-mini"},
+                                                          "keywords": {"model": "gpt-4o-mini", "max_tokens": 30}})
+    assert hr_openai_utils.task_route("category") == ("gpt-4o-mini", hr_openai_utils.task_max_tokens("category"))
+    assert hr_openai_utils.task_route("keywords") == ("gpt-4o-mini", 30)
+    assert hr_openai_utils.task_route("summary", 100) == (hr_openai_utils.OPENAI_MODEL,
+                                                         hr_openai_utils.task_max_tokens("summary", 100))
+    requests = hr_openai_utils.build_hr_analysis_requests("Ansatte har rett til ferie.")
+    assert requests["category"]["model"] == "gpt-4o-mini" and requests["keywords"]["max_tokens"] == 30
+    assert requests["summary"]["model"] == hr_openai_utils.OPENAI_MODEL
+
+
+def test_invalid_answers_from_a_routed_model_fall_back_to_the_larger_model(monkeypatch):
+    monkeypatch.setattr(hr_openai_utils, "MODEL_ROUTES", {"category": {"model": "gpt-4o-mini"}})
+    monkeypatch.setattr(hr_openai_utils, "MODEL_FALLBACK", "gpt-4o")
+    recorder = Metrics()
+    answers = {"gpt-4o-mini": "Dette handler om ferie", "gpt-4o": "Kompensasjon og fordeler"}
+
+    async def categorize(client):
+        first = await hr_openai_utils.categorize_hr_document_async("Tekst", client)
+        answers["gpt-4o-mini"] = "HMS"
+        return first, await hr_openai_utils.categorize_hr_document_async("Annen tekst", client)
+
+    with FakeOpenAIServer(reply=lambda body: answers[body["model"]]) as server, \
+         patch('hr_openai_utils.get_metrics', return_value=recorder), \
+         patch('hr_openai_utils.get_rate_limiter', return_value=None):
+        client = AsyncOpenAI(api_key="test", base_url=server.url, max_retries=0)
+        categories = asyncio.run(categorize(client))
+
+    assert categories == ("Kompensasjon og fordeler", "HMS")
+    assert [request["model"] for request in server.requests] == ["gpt-4o-mini", "gpt-4o", "gpt-4o-mini"]
+    snapshot = recorder.snapshot()
+    assert snapshot["fallbacks"] == 1
+    assert snapshot["models"]["gpt-4o-mini"]["calls"] == 2 and snapshot["models"]["gpt-4o"]["calls"] == 1
+
+
+def test_answer_validation_matches_each_task():
+    assert hr_openai_utils.is_valid_answer("category", "HMS.")
+    assert not hr_openai_utils.is_valid_answer("category", "Ferie")
+    assert hr_openai_utils.is_valid_answer("keywords", "ferie, lønn")
+    assert not hr_openai_utils.is_valid_answer("keywords", " , ")
+    assert hr_openai_utils.is_valid_answer("entities", '```json\n{"ansatte": []}\n```')
+    assert not hr_openai_utils.is_valid_answer("entities", "Ingen enheter funnet")
+    assert hr_openai_utils.is_valid_answer("sentiment_keywords", '{"positive": [], "negative": []}')
+    assert not hr_openai_utils.is_valid_answer("sentiment_keywords", '{"positive": []}')
+    assert not hr_openai_utils.is_valid_answer("summary", "  ")
@@ -0,0 +1,110 @@
+import json
+from cli import main as cli_main
+from peach import PeachClient, PeachWriter, idempotency_key, iter_results, main, to_ndjson
+from tests.fake_openai_server import FakeOpenAIServer
+from tests.fake_peach_server import FakePeachServer
+
+
+def document(n):
+    return json.dumps({"title": f"Dokument {n}", "body": "Ansatte har rett til ferie.", "tags": ["ferie"]},
+                      ensure_ascii=False, indent=4)
+
+
+def test_documents_are_sent_as_compact_ndjson():
+    body = to_ndjson([("dokument_1.txt", document(1)), ("dokument_2.txt", document(2))])
+    lines = body.decode("utf-8").splitlines()
+    assert len(lines) == 2
+    key = idempotency_key("dokument_1.txt", document(1))
+    assert lines[0] == ('{"title":"Dokument 1","body":"Ansatte har rett til ferie.","tags":["ferie"],'
+                        f'"idempotency_key":"{key}"}}')
+    assert key != idempotency_key("dokument_2.txt", document(1))
+    assert key != idempotency_key("dokument_1.txt", document(2))
+
+
+def test_writer_batches_documents_over_one_connection():
+    with FakePeachServer() as server:
+        writer = PeachWriter(PeachClient(server.url, backoff=0), batch_size=4)
+        for n in range(10):
+            writer.write(f"dokument_{n}.txt", document(n))
+        writer.write("handbok.pdf", [json.dumps({"title": "Del 1"}), json.dumps({"title": "Del 2"})])
+        writer.close()
+
+    assert [len(batch) for batch in server.batches] == [4, 4, 4]
+    assert [doc["title"] for doc in server.documents][-2:] == ["Del 1", "Del 2"]
+    assert len(server.connections) == 1
+    stats = writer.stats()
+    assert stats["documents"] == 12 and stats["batches"] == 3 and stats["failed"] == 0
+    assert stats["docs_per_sec"] > 0
+
+
+def test_failed_requests_are_retried_with_the_same_idempotency_key():
+    with FakePeachServer(fail_first=2) as server:
+        writer = PeachWriter(PeachClient(server.url, backoff=0), batch_size=5)
+        for n in range(5):
+            writer.write(f"dokument_{n}.txt", document(n))
+        writer.close()
+
+        # A rerun sends the same documents in other batches, but they are not imported twice.
+        rerun = PeachWriter(PeachClient(server.url, backoff=0), batch_size=2)
+        for n in range(6):
+            rerun.write(f"dokument_{n}.txt", document(n))
+        rerun.close()
+
+    assert len(server.documents) == 6
+    assert server.replayed == 5
+    assert writer.stats()["retries"] == 2
+
+
+def test_batches_that_keep_failing_are_reported_without_stopping_the_export():
+    with FakePeachServer(fail_first=3) as server:
+        writer = PeachWriter(PeachClient(server.url, max_attempts=3, backoff=0), batch_size=2)
+        for n in range(4):
+            writer.write(f"dokument_{n}.txt", document(n))
+        writer.close()
+
+    assert writer.failed == ["dokument_0.txt", "dokument_1.txt"]
+    assert len(server.documents) == 2
+    assert writer.stats()["failed"] == 2
+
+
+def test_client_errors_are_not_retried():
+    with FakePeachServer(fail_first=1, fail_status=400) as server:
+        writer = PeachWriter(PeachClient(server.url, backoff=0), batch_size=1)
+        writer.write("dokument.txt", document(1))
+        writer.close()
+    assert server.requests == 1
+    assert writer.failed == ["dokument.txt"]
+
+
+def test_results_of_an_earlier_run_can_be_exported(tmp_path, capsys):
+    for n in range(3):
+        (tmp_path / f"dokument_{n}.txt.json").write_text(document(n), encoding="utf-8")
+
+    with FakePeachServer() as server:
+        assert main([str(tmp_path), "--url", server.url, "--batch-size", "2"]) == 0
+    assert [doc["title"] for doc in server.documents] == ["Dokument 0", "Dokument 1", "Dokument 2"]
+    assert "Exported 3 documents in 2 batches" in capsys.readouterr().out
+
+
+def test_results_in_subfolders_are_exported_by_relative_path(tmp_path):
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    (tmp_path / "dokument.txt.json").write_text(document(0), encoding="utf-8")
+    (tmp_path / "a" / "dokument.txt.json").write_text(document(1), encoding="utf-8")
+    (tmp_path / "a" / "b" / "dokument.txt.json").write_text(document(2), encoding="utf-8")
+
+    assert [name for name, _ in iter_results(str(tmp_path))] == ["dokument.txt", "a/dokument.txt",
+                                                                 "a/b/dokument.txt"]
+
+
+def test_cli_exports_pipeline_results_to_peach(tmp_path, capsys):
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    (corpus / "ferie.txt").write_text("Ansatte har rett til fem ukers ferie hvert år.", encoding="utf-8")
+
+    with FakeOpenAIServer(reply="ferie, lønn") as openai_server, FakePeachServer() as peach_server:
+        exit_code = cli_main([str(corpus), "--peach", peach_server.url, "--api-key", "test",
+                              "--base-url", openai_server.url])
+
+    assert exit_code == 0
+    assert [doc["title"] for doc in peach_server.documents] == ["Ferie"]
+    assert "Peach: 1 documents in 1 batches" in capsys.readouterr().out
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import pytest
+from unittest.mock import Mock, patch
+from manifest import Manifest
+from pipeline import Pipeline, parse_document
+
+
+class ListWriter:
+    def __init__(self):
+        self.written = []
+
+    def write(self, filename, document_json):
+        self.written.append((filename, document_json))
+
+
+def test_parse_document_reads_bytes_and_detects_language():
+    text, lang = parse_document("ferie.txt", "text/plain",
+                                "Ansatte har rett til fem ukers ferie hvert år.".encode("utf-8"))
+    assert text == "Ansatte har rett til fem ukers ferie hvert år."
+    assert lang == "no"
+    assert parse_document("tom.txt", "text/plain", b"  \n") == (None, None)
+
+
+def test_pipeline_limits_analysis_concurrency_and_writes_every_document(tmp_path):
+    items = []
+    for i in range(6):
+        path = tmp_path / f"dokument_{i}.txt"
+        path.write_text(f"Dokument nummer {i} handler om ferie.", encoding="utf-8")
+        items.append((path.name, "text/plain", str(path)))
+    empty = tmp_path / "tom.txt"
+    empty.write_text(" ", encoding="utf-8")
+    items.append((empty.name, "text/plain", str(empty)))
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def fake_structure_document_async(text, client, filename, lang=None, **kwargs):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return json.dumps({"title": filename, "body": text})
+
+    writer = ListWriter()
+    on_result = Mock()
+    with patch('pipeline.structure_document_async', side_effect=fake_structure_document_async):
+        pipeline = Pipeline(Mock(), writer, parse_workers=2, analysis_workers=2, queue_size=1, on_result=on_result)
+        stats = asyncio.run(pipeline.run(items))
+
+    assert stats["processed"] == 6
+    assert stats["failed"] == 1
+    assert max_in_flight == 2
+    assert sorted(name for name, _ in writer.written) == [f"dokument_{i}.txt" for i in range(6)]
+    assert on_result.call_count == 7
+
+
+def test_pipeline_skips_files_recorded_in_the_manifest(tmp_path):
+    items = []
+    for name in ("ferie.txt", "lønn.txt"):
+        path = tmp_path / name
+        path.write_text(f"{name} handler om ferie.", encoding="utf-8")
+        items.append((name, "text/plain", str(path)))
+    manifest = Manifest(str(tmp_path / "manifest"))
+    calls = []
+
+    async def fake_structure_document_async(text, client, filename, lang=None, **kwargs):
+        calls.append(filename)
+        return json.dumps({"title": filename})
+
+    with patch('pipeline.structure_document_async', side_effect=fake_structure_document_async):
+        asyncio.run(Pipeline(Mock(), ListWriter(), parse_workers=1, manifest=manifest).run(items))
+        (tmp_path / "lønn.txt").write_text("Endret innhold om lønn.", encoding="utf-8")
+        writer = ListWriter()
+        stats = asyncio.run(Pipeline(Mock(), writer, parse_workers=1, manifest=manifest).run(items))
+
+    assert sorted(calls) == ["ferie.txt", "lønn.txt", "lønn.txt"]
+    assert stats["skipped"] == 1
+    assert stats["processed"] == 2
+    assert dict(writer.written)["ferie.txt"] == json.dumps({"title": "ferie.txt"})
+
+
+def test_pipeline_finishes_when_an_analysis_raises(tmp_path):
+    items = []
+    for name in ("ferie.txt", "lønn.txt", "permisjon.txt"):
+        path = tmp_path / name
+        path.write_text(f"{name} handler om ferie.", encoding="utf-8")
+        items.append((name, "text/plain", str(path)))
+
+    async def fake_structure_document_async(text, client, filename, lang=None, **kwargs):
+        if filename == "lønn.txt":
+            raise RuntimeError("API nede")
+        return json.dumps({"title": filename})
+
+    writer = ListWriter()
+    with patch('pipeline.structure_document_async', side_effect=fake_structure_document_async):
+        stats = asyncio.run(asyncio.wait_for(
+            Pipeline(Mock(), writer, parse_workers=1, analysis_workers=1, queue_size=1).run(items), 10))
+
+    assert stats["processed"] == 2 and stats["failed"] == 1
+    assert sorted(name for name, _ in writer.written) == ["ferie.txt", "permisjon.txt"]
+
+
+def test_pipeline_keeps_incomplete_results_and_manifest_errors_out_of_the_manifest(tmp_path):
+    items = []
+    for name in ("ferie.txt", "lønn.txt", "permisjon.txt"):
+        path = tmp_path / name
+        path.write_text(f"{name} handler om ferie.", encoding="utf-8")
+        items.append((name, "text/plain", str(path)))
+    manifest = Manifest(str(tmp_path / "manifest"))
+    record = manifest.record
+
+    def flaky_record(name, digest, document_json):
+        if name == "permisjon.txt":
+            raise OSError("disk full")
+        record(name, digest, document_json)
+
+    async def fake_structure_document_async(text, client, filename, lang=None, on_fallback=None, **kwargs):
+        if filename == "lønn.txt":
+            on_fallback(filename, ["summary"])
+        return json.dumps({"title": filename})
+
+    writer = ListWriter()
+    with patch('pipeline.structure_document_async', side_effect=fake_structure_document_async), \
+         patch.object(manifest, 'record', side_effect=flaky_record):
+        stats = asyncio.run(asyncio.wait_for(
+            Pipeline(Mock(), writer, parse_workers=1, analysis_workers=1, queue_size=1, manifest=manifest).run(items),
+            10))
+        stats_again = asyncio.run(Pipeline(Mock(), ListWriter(), parse_workers=1, manifest=manifest).run(items))
+
+    assert stats["processed"] == 2 and stats["failed"] == 1
+    assert stats_again["skipped"] == 1 and stats_again["processed"] == 2
+
+
+def test_pipeline_fails_instead_of_hanging_when_the_writer_dies(tmp_path):
+    path = tmp_path / "ferie.txt"
+    path.write_text("Ferie.", encoding="utf-8")
+    items = [(f"{i}.txt", "text/plain", str(path)) for i in range(4)]
+
+    class BrokenWriter:
+        def write(self, filename, document_json):
+            raise OSError("disk full")
+
+    async def fake_structure_document_async(text, client, filename, lang=None, **kwargs):
+        return json.dumps({"title": filename})
+
+    on_result = Mock(side_effect=RuntimeError("callback failed"))
+    with patch('pipeline.structure_document_async', side_effect=fake_structure_document_async):
+        pipeline = Pipeline(Mock(), BrokenWriter(), parse_workers=1, analysis_workers=1, queue_size=1,
+                            on_result=on_result)
+        with pytest.raises(RuntimeError, match="callback failed"):
+            asyncio.run(asyncio.wait_for(pipeline.run(items), 10))
@@ -0,0 +1,98 @@
+import time
+from unittest.mock import patch
+import httpx
+from openai import OpenAI, DefaultHttpxClient, RateLimitError
+from tenacity import RetryCallState
+import hr_openai_utils
+import rate_limiter
+from rate_limiter import RateLimiter, estimate_tokens, get_rate_limiter, on_response, parse_duration
+from tests.fake_openai_server import FakeOpenAIServer
+
+
+def test_parse_duration():
+    assert parse_duration("20ms") == 0.02
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("1.5") == 1.5
+    assert parse_duration(None) is None
+
+
+def test_estimate_tokens_counts_prompt_characters_and_max_tokens():
+    assert estimate_tokens([{"role": "user", "content": "a" * 40}], 100) == 110
+
+
+def test_requests_are_paced_to_the_per_minute_budget():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=100000)
+    limiter.requests.available = 1
+    start = time.monotonic()
+    limiter.acquire_sync(10)
+    limiter.acquire_sync(10)
+    assert time.monotonic() - start >= 0.09
+
+
+def test_retry_after_header_pauses_all_callers():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=100000)
+    limiter.update_from_headers({"retry-after": "0.2"})
+    start = time.monotonic()
+    limiter.acquire_sync(10)
+    assert time.monotonic() - start >= 0.19
+
+
+def test_remaining_headers_cap_the_local_budget():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=100000)
+    limiter.update_from_headers({"x-ratelimit-remaining-requests": "3", "x-ratelimit-remaining-tokens": "50"})
+    assert limiter.requests.available <= 3
+    assert limiter.tokens.available <= 50
+
+
+def test_each_model_has_its_own_limits(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    monkeypatch.setattr(rate_limiter, "RATE_LIMITS", {"gpt-4o-mini": (1000, 200000)})
+    assert get_rate_limiter("gpt-4o") is get_rate_limiter("gpt-4o")
+    assert get_rate_limiter("gpt-4o") is not get_rate_limiter("gpt-4o-mini")
+    assert get_rate_limiter("gpt-4o-mini").tokens.capacity == 200000
+    assert get_rate_limiter("gpt-4o").tokens.capacity == rate_limiter.RATE_LIMIT_TPM
+
+
+def test_a_429_only_pauses_the_model_that_was_rate_limited(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions", json={"model": "gpt-4o-mini"})
+    on_response(httpx.Response(429, headers={"retry-after": "0.2", "x-ratelimit-remaining-requests": "0"},
+                               request=request))
+
+    assert get_rate_limiter("gpt-4o-mini").paused_until > time.monotonic()
+    assert get_rate_limiter("gpt-4o").paused_until == 0
+    start = time.monotonic()
+    get_rate_limiter("gpt-4o").acquire_sync(10)
+    assert time.monotonic() - start < 0.1
+    # Requests without a JSON body, such as file uploads, don't belong to a model.
+    on_response(httpx.Response(200, request=httpx.Request("POST", "https://api.openai.com/v1/files", content=b"\xff")))
+
+
+def test_call_openai_api_recovers_from_429_without_backoff_sleep():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=100000)
+
+    with FakeOpenAIServer(reply="Svar", rate_limit_first=1, retry_after=0.2) as server, \
+         patch('hr_openai_utils.get_rate_limiter', return_value=limiter):
+        client = OpenAI(api_key="test", base_url=server.url, max_retries=0,
+                        http_client=DefaultHttpxClient(event_hooks={"response": [limiter.on_response]}))
+        start = time.monotonic()
+        result = hr_openai_utils.call_openai_api(client, [{"role": "user", "content": "Hei"}], 10)
+        elapsed = time.monotonic() - start
+
+    assert result == "Svar"
+    assert server.request_count == 2
+    assert server.rate_limited == 1
+    assert 0.2 <= elapsed < 2
+
+
+def test_429_without_a_pause_falls_back_to_backoff(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    error = RateLimitError("Too many requests", response=httpx.Response(429, request=request), body=None)
+    retry_state = RetryCallState(None, hr_openai_utils._create_completion, (None, {"model": "gpt-4o-mini"}), {})
+    retry_state.set_exception((RateLimitError, error, None))
+
+    assert hr_openai_utils._retry_wait(retry_state) >= 4
+    get_rate_limiter("gpt-4o-mini").update_from_headers({"retry-after": "1"})
+    assert hr_openai_utils._retry_wait(retry_state) == 0
+    assert get_rate_limiter("gpt-4o").paused_until == 0
@@ -0,0 +1,55 @@
+from unittest.mock import patch
+from response_cache import ResponseCache
+
+
+def make_cache(tmp_path, **kwargs):
+    return ResponseCache(str(tmp_path / "cache.sqlite3"), **kwargs)
+
+
+def test_make_key_depends_on_model_messages_and_max_tokens():
+    messages = [{"role": "user", "content": "Hei"}]
+    key = ResponseCache.make_key("gpt-4o", messages, 100)
+    assert key == ResponseCache.make_key("gpt-4o", [{"content": "Hei", "role": "user"}], 100)
+    assert key != ResponseCache.make_key("gpt-4o-mini", messages, 100)
+    assert key != ResponseCache.make_key("gpt-4o", messages, 200)
+    assert key != ResponseCache.make_key("gpt-4o", [{"role": "user", "content": "Hallo"}], 100)
+
+
+def test_get_and_set_count_hits_and_misses(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.get("key") is None
+    cache.set("key", "svar")
+    assert cache.get("key") == "svar"
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["entries"] == 1
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = make_cache(tmp_path, ttl=10)
+    with patch('response_cache.time.time', return_value=1000):
+        cache.set("key", "svar")
+    with patch('response_cache.time.time', return_value=1011):
+        assert cache.get("key") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = make_cache(tmp_path, ttl=float("inf"), max_size=10)
+    with patch('response_cache.time.time', return_value=1000):
+        cache.set("a", "aaaa")
+    with patch('response_cache.time.time', return_value=1001):
+        cache.set("b", "bbbb")
+    with patch('response_cache.time.time', return_value=1002):
+        cache.get("a")
+    with patch('response_cache.time.time', return_value=1003):
+        cache.set("c", "cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == "aaaa"
+    assert cache.get("c") == "cccc"
+
+
+def test_entries_are_shared_between_instances(tmp_path):
+    make_cache(tmp_path).set("key", "svar")
+    assert make_cache(tmp_path).get("key") == "svar"
@@ -0,0 +1,90 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, Mock, patch
+from document_processor import structure_document_async
+from sections import heading_of, split_sections
+
+HANDBOOK = """Personalhåndbok
+
+1 Innledning
+Denne håndboken gjelder alle ansatte. Den beskriver rettigheter og plikter.
+
+2. Ferie
+Ansatte har rett til fem ukers ferie. Ferien avtales med leder
+1. januar hvert år.
+2.1 Feriepenger utbetales i juni.
+§ 4 Oppsigelse skjer skriftlig.
+Arbeidstid
+Normal arbeidstid er 37,5 timer.
+"""
+
+
+def test_headings_and_numbered_clauses_start_sections():
+    assert heading_of("## Ferie og fritid", at_boundary=False) == "Ferie og fritid"
+    assert heading_of("2.1 Feriepenger utbetales i juni.", at_boundary=False) == "2.1 Feriepenger utbetales i juni."
+    assert heading_of("§ 4 " + "Oppsigelse skjer skriftlig. " * 10, at_boundary=False) == "§ 4"
+    assert heading_of("Arbeidstid", at_boundary=True) == "Arbeidstid"
+    # Wrapped lines in the middle of a sentence are body text.
+    assert heading_of("1. januar hvert år.", at_boundary=False) is None
+    assert heading_of("Arbeidstid", at_boundary=False) is None
+    # A bare number only numbers a short title; otherwise it starts a sentence.
+    assert heading_of("3 Arbeidstid", at_boundary=True) == "3 Arbeidstid"
+    assert heading_of("2024 var første år med ny ordning.", at_boundary=True) is None
+    assert heading_of("2024 Var første år med ny ordning.", at_boundary=True) is None
+    assert heading_of("12 ansatte deltok", at_boundary=True) is None
+
+
+def test_split_sections_merges_small_blocks_and_keeps_all_text():
+    sections = list(split_sections(HANDBOOK, max_chars=120, min_chars=60))
+    assert [heading for heading, _ in sections] == ["Personalhåndbok", "2. Ferie", "2.1 Feriepenger utbetales i juni.",
+                                                    "Arbeidstid"]
+    assert "1 Innledning" in sections[0][1]
+    assert "§ 4 Oppsigelse" in sections[2][1]
+    assert all(len(body) <= 120 for _, body in sections)
+
+
+def test_long_sections_are_split_at_sentence_boundaries():
+    text = "3 Arbeidstid\n" + "Ansatte registrerer arbeidstiden sin hver dag. " * 40
+    sections = list(split_sections(text, max_chars=500, min_chars=100))
+    assert len(sections) > 1
+    assert all(heading == "3 Arbeidstid" and len(body) <= 500 for heading, body in sections)
+    assert all(body.endswith(".") for _, body in sections)
+
+
+def test_structure_document_async_analyses_sections_in_parallel():
+    analysis = {"keywords": ["ferie"], "category": "Annet", "entities": {},
+                "sentiment_keywords": {"positive": [], "negative": []}, "summary": "Kort."}
+    running = 0
+    peak = 0
+
+    async def analyse(text, client, filename, *args):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return dict(analysis, summary=text.split("\n")[0])
+
+    with patch('document_processor.detect_language', return_value='no'), \
+         patch('document_processor.analyse_text_async', side_effect=analyse), \
+         patch('document_processor.split_sections',
+               side_effect=lambda text: split_sections(text, max_chars=120, min_chars=60)), \
+         patch('document_processor.MAX_CONCURRENT_SECTIONS', 2):
+        result = asyncio.run(structure_document_async(HANDBOOK, Mock(), "personal_handbok.txt", sectioned=True))
+
+    documents = [json.loads(section) for section in result]
+    assert [document["section"] for document in documents] == [1, 2, 3, 4]
+    assert documents[1]["title"] == "Personal Handbok - 2. Ferie"
+    assert documents[3]["summary"] == "Arbeidstid"
+    assert documents[3]["body"] == "Arbeidstid\nNormal arbeidstid er 37,5 timer."
+    assert peak == 2
+
+
+def test_short_documents_stay_one_document():
+    analyse = AsyncMock(return_value={"keywords": [], "category": "Annet", "entities": {},
+                                      "sentiment_keywords": {}, "summary": "Kort."})
+    with patch('document_processor.detect_language', return_value='no'), \
+         patch('document_processor.analyse_text_async', analyse):
+        result = asyncio.run(structure_document_async("Kort tekst om ferie.", Mock(), "ferie.txt", sectioned=True))
+    assert json.loads(result)["title"] == "Ferie"
+    analyse.assert_awaited_once()
@@ -1,5 +1,7 @@
 import pytest
-from text_processing import norwegian_tokenize, is_complete_sentence, detect_language
+from unittest.mock import patch
+from text_processing import (norwegian_tokenize, is_complete_sentence, detect_language, detect_languages,
+                             sample_text, is_norwegian)
 
 def test_norwegian_tokenize():
     text = "Dette er en setning. Dette er en annen setning."
@@ -14,4 +16,30 @@ def test_detect_language():
     assert detect_language("Dette er på norsk.") == "no"
     assert detect_language("This is in English.") == "en"
 
+def test_detect_language_is_deterministic():
+    text = "Medarbeideren kan be om permisjon i forbindelse med flytting."
+    assert len({detect_language(text) for _ in range(5)}) == 1
+
+def test_sample_text_is_bounded_and_covers_the_whole_text():
+    text = "norsk " * 2000 + "slutt"
+    sample = sample_text(text, size=100, count=3)
+    assert len(sample) <= 302
+    assert sample.startswith("norsk")
+    assert "slutt" in sample
+    assert sample_text("kort tekst", size=100, count=3) == "kort tekst"
+
+def test_is_norwegian_rejects_english_and_danish():
+    assert is_norwegian("Ansatte har rett til ferie og skal avtale den med leder.")
+    assert not is_norwegian("Employees are entitled to holidays agreed with their manager.")
+    assert not is_norwegian("Medarbejderen har ret til ferie efter aftale med lederen af afdelingen.")
+
+def test_detect_language_only_runs_langdetect_on_the_sample():
+    text = "This is in English. " * 5000
+    with patch('text_processing.detect', return_value="en") as mock_detect:
+        assert detect_language(text) == "en"
+    assert len(mock_detect.call_args[0][0]) < 4000
+
+def test_detect_languages_returns_none_for_undetectable_text():
+    assert detect_languages(["Dette er på norsk.", "This is in English.", "12345"]) == ["no", "en", None]
+
 # Add more tests for text_processing.py functions
\ No newline at end of file
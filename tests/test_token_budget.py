@@ -0,0 +1,105 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock, patch
+import pytest
+from openai import AsyncOpenAI
+import hr_openai_utils
+from custom_exceptions import TokenBudgetExceeded
+from document_processor import analyse_text_async, structure_document_async
+from metrics import Metrics
+from token_budget import TokenBudget, charge_usage, use_budget
+from tests.fake_openai_server import FakeOpenAIServer
+
+
+def test_analysis_prompts_share_the_document_prefix():
+    text = "Ansatte har rett til fem ukers ferie. " * 200
+    prompts = [hr_openai_utils._hr_keywords_messages(text), hr_openai_utils._categorize_hr_messages(text),
+               hr_openai_utils._hr_entities_messages(text), hr_openai_utils._sentiment_keywords_messages(text),
+               hr_openai_utils._summarize_hr_messages(text, 200)]
+    assert all(messages[:-1] == prompts[0][:-1] for messages in prompts)
+    assert len({messages[-1]["content"] for messages in prompts}) == len(prompts)
+    assert text[:hr_openai_utils.PROMPT_DOCUMENT_CHARS] in prompts[0][1]["content"]
+    # The combined analysis is the document's only call, so it keeps its own slice.
+    full_analysis = hr_openai_utils._full_hr_analysis_messages(text, 200)
+    assert full_analysis[1]["content"] == f"Dokument:\n\n{text[:2000]}"
+
+
+def test_documents_below_the_cache_threshold_get_per_task_slices():
+    text = "Ansatte har rett til fem ukers ferie. " * 80
+    assert not hr_openai_utils.is_prefix_cacheable(text)
+    assert hr_openai_utils._hr_keywords_messages(text)[1]["content"] == f"Dokument:\n\n{text[:1000]}"
+    assert hr_openai_utils._categorize_hr_messages(text)[1]["content"] == f"Dokument:\n\n{text[:1000]}"
+    assert hr_openai_utils._summarize_hr_messages(text, 200)[1]["content"] == f"Dokument:\n\n{text[:2000]}"
+    assert hr_openai_utils._summarize_hr_messages(text, 200, whole=True)[1]["content"] == f"Dokument:\n\n{text}"
+
+
+def test_one_call_per_model_primes_the_prompt_cache_before_the_rest():
+    text = "Ansatte har rett til fem ukers ferie. " * 200
+    recorder = Metrics()
+    with FakeOpenAIServer(reply="HMS", latency=0.05) as server, \
+         patch('hr_openai_utils.get_metrics', return_value=recorder), \
+         patch('hr_openai_utils.get_rate_limiter', return_value=None):
+        client = AsyncOpenAI(api_key="test", base_url=server.url, max_retries=0)
+        asyncio.run(analyse_text_async(text, client, "ferie.txt"))
+
+    first = server.requests[0]
+    assert first["messages"][-1] == hr_openai_utils._categorize_hr_messages(text)[-1]
+    prefix_tokens = len(FakeOpenAIServer._prefix(first)) // 4 // 128 * 128
+    # Keywords, entities and sentiment reuse the category call's prefix; the summary runs on its own model.
+    assert recorder.snapshot()["tokens"]["cached"] == 3 * prefix_tokens
+    assert not hr_openai_utils.is_prefix_cacheable("Kort tekst om ferie.")
+
+
+def test_task_max_tokens_follows_the_task():
+    assert hr_openai_utils.task_max_tokens("category") < hr_openai_utils.task_max_tokens("keywords")
+    assert hr_openai_utils.task_max_tokens("summary", 100) < hr_openai_utils.task_max_tokens("summary", 200)
+    total = sum(hr_openai_utils.task_max_tokens(task)
+                for task in ("keywords", "category", "entities", "sentiment_keywords", "summary"))
+    assert hr_openai_utils.task_max_tokens("full_analysis") == total
+
+
+def test_budget_downgrades_then_stops():
+    budget = TokenBudget(1000, downgrade_at=0.5)
+    budget.charge(400)
+    assert not budget.should_downgrade
+    budget.charge(100)
+    assert budget.should_downgrade and not budget.exhausted
+    budget.charge(500)
+    with pytest.raises(TokenBudgetExceeded):
+        budget.check("ferie.txt")
+    assert budget.stats() == {"limit": 1000, "used": 1000, "downgraded": 0, "rejected": 1}
+
+
+def test_usage_is_charged_to_the_budget_of_the_current_task():
+    budgets = [TokenBudget(1000), TokenBudget(1000)]
+
+    async def document(budget, tokens):
+        use_budget(budget)
+        await asyncio.sleep(0)
+        charge_usage(SimpleNamespace(prompt_tokens=tokens, completion_tokens=10))
+
+    async def run():
+        await asyncio.gather(document(budgets[0], 100), document(budgets[1], 200))
+
+    asyncio.run(run())
+    assert [budget.used for budget in budgets] == [110, 210]
+
+
+def test_structure_document_async_downgrades_to_one_call_and_skips_when_exhausted():
+    budget = TokenBudget(1000, downgrade_at=0.5)
+    budget.charge(600)
+    analysis = {"keywords": ["ferie"], "category": "Annet", "entities": {},
+                "sentiment_keywords": {"positive": [], "negative": []}, "summary": "Kort."}
+
+    with patch('document_processor.detect_language', return_value='no'), \
+         patch('document_processor.analyze_hr_document_async', AsyncMock(return_value=analysis)) as mock_full:
+        result = asyncio.run(structure_document_async("Tekst om ferie.", Mock(), "ferie.txt", full_analysis=False,
+                                                      budget=budget))
+        assert json.loads(result)["summary"] == "Kort."
+        mock_full.assert_awaited_once()
+        assert budget.downgraded == 1
+
+        budget.charge(400)
+        assert asyncio.run(structure_document_async("Tekst om ferie.", Mock(), "ferie.txt", budget=budget)) is None
+        assert budget.rejected == 1
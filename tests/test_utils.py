@@ -0,0 +1,38 @@
+import json
+import zipfile
+from utils import ResultWriter, SpooledZipWriter
+
+
+def test_spooled_zip_writer_stores_documents_without_reformatting():
+    archive = SpooledZipWriter(max_memory=1024)
+    archive.write("ferie.txt", '{"title": "Ferie"}')
+    archive.write("lonn.txt", '{"title": "Lønn", "body": "' + "x" * 5000 + '"}')
+
+    assert archive.count == 2
+    with zipfile.ZipFile(archive.close()) as zip_file:
+        assert zip_file.namelist() == ["ferie.txt.json", "lonn.txt.json"]
+        assert zip_file.read("ferie.txt.json").decode("utf-8") == '{"title": "Ferie"}'
+
+
+def test_spooled_zip_writer_getvalue_returns_complete_archive():
+    archive = SpooledZipWriter()
+    archive.write("ferie.txt", "{}")
+    data = archive.getvalue()
+    assert data.startswith(b"PK")
+    assert archive.getvalue() == data
+
+
+def test_sectioned_documents_are_written_one_file_per_section(tmp_path):
+    sections = ['{"title": "Håndbok - Ferie", "section": 1}', '{"title": "Håndbok - Lønn", "section": 2}']
+    archive = SpooledZipWriter()
+    archive.write("handbok.pdf", sections)
+    assert archive.count == 1
+    with zipfile.ZipFile(archive.close()) as zip_file:
+        assert len(zip_file.namelist()) == 2
+
+    writer = ResultWriter(str(tmp_path))
+    writer.write("handbok.pdf", sections)
+    writer.close()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["handbok.pdf_section_1.json",
+                                                                 "handbok.pdf_section_2.json"]
+    assert json.loads((tmp_path / "handbok.pdf_section_2.json").read_text(encoding="utf-8"))["title"] == "Håndbok - Lønn"
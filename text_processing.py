@@ -1,5 +1,22 @@
+import logging
 import re
-from langdetect import detect
+from langdetect import DetectorFactory, LangDetectException, detect
+from langdetect.detector_factory import init_factory
+from config import LANG_SAMPLE_CHARS, LANG_SAMPLE_COUNT, LANG_DETECT_SEED
+
+logger = logging.getLogger(__name__)
+
+DetectorFactory.seed = LANG_DETECT_SEED
+# Load the language profiles up front: langdetect loads them lazily on first use,
+# which is not safe when several documents are detected in parallel threads.
+init_factory()
+
+_WORD = re.compile(r"\w+")
+# Frequent Norwegian words, and words that mark Danish or Swedish text with a similar vocabulary.
+_NORWEGIAN_WORDS = {"og", "er", "på", "av", "til", "som", "det", "med", "ikke", "har", "skal", "eller",
+                    "ved", "når", "etter", "også", "kan", "den", "de", "vi", "du", "jeg", "hvis", "fra"}
+_NEIGHBOUR_WORDS = {"af", "efter", "hvad", "mellem", "nu", "och", "inte", "är", "att", "jag"}
+_NORWEGIAN_RATIO = 0.2
 
 def norwegian_tokenize(text):
     text = re.sub(r'(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|\!)\s', '\n', text)
@@ -8,5 +25,37 @@ def norwegian_tokenize(text):
 def is_complete_sentence(text):
     return re.search(r'[.!?]$', text.strip()) is not None
 
+def sample_text(text, size=LANG_SAMPLE_CHARS, count=LANG_SAMPLE_COUNT):
+    if len(text) <= size * count:
+        return text
+    step = (len(text) - size) / max(count - 1, 1)
+    samples = []
+    for i in range(count):
+        start = int(i * step)
+        # Start on a word boundary so the sample does not begin with half a word.
+        space = text.find(" ", start, start + 50)
+        start = space + 1 if space != -1 else start
+        samples.append(text[start:start + size])
+    return "\n".join(samples)
+
+def is_norwegian(sample):
+    words = _WORD.findall(sample.lower())
+    if not words or any(word in _NEIGHBOUR_WORDS for word in words):
+        return False
+    return sum(word in _NORWEGIAN_WORDS for word in words) / len(words) >= _NORWEGIAN_RATIO
+
 def detect_language(text):
-    return detect(text)
\ No newline at end of file
+    sample = sample_text(text)
+    if is_norwegian(sample):
+        return "no"
+    return detect(sample)
+
+def detect_languages(texts):
+    languages = []
+    for text in texts:
+        try:
+            languages.append(detect_language(text))
+        except LangDetectException as e:
+            logger.warning(f"Could not detect language: {str(e)}")
+            languages.append(None)
+    return languages
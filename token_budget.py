@@ -0,0 +1,61 @@
+import logging
+import threading
+from contextvars import ContextVar
+from custom_exceptions import TokenBudgetExceeded
+from config import BATCH_TOKEN_BUDGET, BATCH_BUDGET_DOWNGRADE_AT
+
+logger = logging.getLogger(__name__)
+
+# Set per document, so API calls deep in hr_openai_utils charge the batch they belong to.
+_current_budget = ContextVar("token_budget", default=None)
+
+
+class TokenBudget:
+    """Token allowance for one batch that first downgrades documents to one call, then stops them."""
+
+    def __init__(self, limit, downgrade_at=BATCH_BUDGET_DOWNGRADE_AT):
+        self.limit = limit
+        self.downgrade_at = downgrade_at
+        self.used = 0
+        self.downgraded = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def charge(self, tokens):
+        with self._lock:
+            self.used += tokens
+
+    @property
+    def exhausted(self):
+        return self.used >= self.limit
+
+    @property
+    def should_downgrade(self):
+        return self.used >= self.limit * self.downgrade_at
+
+    def check(self, filename):
+        if self.exhausted:
+            self.rejected += 1
+            raise TokenBudgetExceeded(f"Token budget of {self.limit} tokens is used up, skipping {filename}")
+
+    def stats(self):
+        return {"limit": self.limit, "used": self.used, "downgraded": self.downgraded, "rejected": self.rejected}
+
+
+def create_token_budget():
+    if BATCH_TOKEN_BUDGET is None:
+        return None
+    return TokenBudget(BATCH_TOKEN_BUDGET)
+
+
+def use_budget(budget):
+    _current_budget.set(budget)
+
+
+def charge_usage(usage):
+    budget = _current_budget.get()
+    if budget is None or usage is None:
+        return
+    tokens = sum(value for value in (getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None))
+                 if isinstance(value, int))
+    budget.charge(tokens)
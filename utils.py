@@ -1,7 +1,11 @@
 import re
+import os
 import json
 import zipfile
 import io
+import tempfile
+from metrics import timed
+from config import ZIP_SPOOL_MAX_MEMORY
 
 def sanitize_filename(filename):
     sanitized = re.sub(r'[^\w\-_\. ]', '', filename).replace(' ', '_')
@@ -16,4 +20,83 @@ def create_zip_file(all_results):
                 json_str = json.dumps(section, indent=4, ensure_ascii=False)
                 zip_file.writestr(f"{section_filename}.json", json_str)
     zip_buffer.seek(0)
-    return zip_buffer
\ No newline at end of file
+    return zip_buffer
+
+
+def result_files(filename, document_json):
+    """Yields the (name, JSON) files for a result; sectioned documents get one file per section."""
+    if isinstance(document_json, str):
+        yield filename, document_json
+        return
+    for i, section in enumerate(document_json):
+        yield f"{filename}_section_{i + 1}", section
+
+
+class ResultWriter:
+    """Writes each document JSON to an output directory or ZIP file as soon as it is ready."""
+
+    def __init__(self, output):
+        self.output = output
+        self._zip = None
+        if output.lower().endswith(".zip"):
+            os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+            self._zip = zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED)
+        else:
+            os.makedirs(output, exist_ok=True)
+
+    @timed("write")
+    def write(self, filename, document_json):
+        for name, data in result_files(filename, document_json):
+            if self._zip is not None:
+                self._zip.writestr(f"{name}.json", data)
+            else:
+                path = os.path.join(self.output, f"{name}.json")
+                # Names from the command line keep their folders relative to the input root.
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(data)
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+
+
+class MultiWriter:
+    """Passes every result on to several writers, e.g. an output directory and the Peach export."""
+
+    def __init__(self, *writers):
+        self.writers = writers
+
+    def write(self, filename, document_json):
+        for writer in self.writers:
+            writer.write(filename, document_json)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+
+class SpooledZipWriter:
+    """ZIP archive that documents are appended to as they finish, spooled to disk when it grows."""
+
+    def __init__(self, max_memory=ZIP_SPOOL_MAX_MEMORY):
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory)
+        self._zip = zipfile.ZipFile(self._file, "w", zipfile.ZIP_DEFLATED)
+        self.count = 0
+
+    @timed("write")
+    def write(self, filename, document_json):
+        for name, data in result_files(filename, document_json):
+            self._zip.writestr(f"{name}.json", data)
+        # Counts source documents; a sectioned document adds one file per section.
+        self.count += 1
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+        self._file.seek(0)
+        return self._file
+
+    def getvalue(self):
+        return self.close().read()